@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+ # Copyright (C) 2013-2015 StaDynA
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License");
+ # you may not use this file except in compliance with the License.
+ # You may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ # See the License for the specific language governing permissions and
+ # limitations under the License.
+
+"""
+Benchmark of dvm.LinearSweepAlgorithm on large synthetic methods.
+
+The instructions are decoded once with the current (zero-copy) algorithm and
+once with the previous one, which passed a copy of the remaining bytecode
+(insn[idx:]) to every instruction. Usage:
+
+    python bench_linear_sweep.py [number of code units ...]
+"""
+
+import os
+import sys
+import time
+from struct import pack, unpack, calcsize
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from androguard.core.bytecodes import dvm
+
+
+class BenchClassManager:
+    #instructions are only decoded, so only the format is needed
+    def get_odex_format(self):
+        return False
+
+
+def makeStraightMethod(units):
+    """const/4, invoke-virtual, if-eqz and const-wide, repeated"""
+    block = pack("=H", 0x1012)                              #const/4 v0, 1
+    block += pack("=HHH", 0x206e, 0x0001, 0x0010)           #invoke-virtual {v0, v1}, meth@1
+    block += pack("=HH", 0x0038, 0x0002)                    #if-eqz v0, +2
+    block += pack("=HHHHH", 0x0018, 1, 2, 3, 4)             #const-wide v0, #long
+    blockUnits = len(block) / 2
+    insn = block * (units / blockUnits)
+    insn += pack("=H", 0x000e)                              #return-void
+    return insn
+
+
+def makeSwitchMethod(units):
+    """packed-switch instructions, each followed by its payload (16 targets)"""
+    block = pack("=HHH", 0x002b, 0x0003, 0x0000)            #packed-switch v0, +3
+    block += pack("=HHi", 0x0100, 16, 0)                    #packed-switch-payload
+    block += "".join(pack("=i", -3) for _ in xrange(16))
+    blockUnits = len(block) / 2
+    insn = block * (units / blockUnits)
+    insn += pack("=H", 0x000e)                              #return-void
+    return insn
+
+
+def getSlicedInstructions(cm, insn):
+    """the previous algorithm, copying the rest of the method for every instruction"""
+    idx = 0
+    max_idx = len(insn)
+    while idx < max_idx:
+        op_value = unpack('=B', insn[idx])[0]
+        obj = None
+        if op_value == 0x00 and (idx + 2) < max_idx:
+            op_value = unpack('=H', insn[idx:idx + 2])[0]
+            if op_value in dvm.DALVIK_OPCODES_PAYLOAD:
+                obj = dvm.get_instruction_payload(op_value, insn[idx:])
+        if obj == None:
+            obj = dvm.get_instruction(cm, unpack('=B', insn[idx])[0], insn[idx:])
+        yield obj
+        idx = idx + obj.get_length()
+
+
+def getInstructions(cm, insn):
+    return dvm.LinearSweepAlgorithm().get_instructions(cm, len(insn) / calcsize('=H'), insn, 0)
+
+
+def measure(decode, cm, insn):
+    startTime = time.time()
+    count = 0
+    for _ in decode(cm, insn):
+        count += 1
+    return count, time.time() - startTime
+
+
+def main(sizes):
+    cm = BenchClassManager()
+    print "%-10s %10s %14s %12s %12s" % ("method", "code units", "instructions", "zero-copy", "sliced")
+    for units in sizes:
+        for name, make in (("straight", makeStraightMethod), ("switch", makeSwitchMethod)):
+            insn = make(units)
+            count, zeroCopyTime = measure(getInstructions, cm, insn)
+            slicedCount, slicedTime = measure(getSlicedInstructions, cm, insn)
+            assert count == slicedCount
+            print "%-10s %10d %14d %11.3fs %11.3fs" % (name, len(insn) / 2, count, zeroCopyTime, slicedTime)
+
+
+if __name__ == "__main__":
+    sizes = [int(i) for i in sys.argv[1:]] or [10000, 50000, 200000]
+    main(sizes)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+ # Copyright (C) 2013-2015 StaDynA
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License");
+ # you may not use this file except in compliance with the License.
+ # You may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ # See the License for the specific language governing permissions and
+ # limitations under the License.
+
+"""
+Benchmark of the node table of method_call_graph.StadynaMcgAnalysis.
+
+A synthetic call graph (method nodes, fake class nodes and edges between them)
+is built once with the current node lookup and, for the small sizes only, once
+with the previous one, which formatted a string key and scanned the list of all
+keys for every node request. The script fails if the graph of 100000 nodes is
+not built in MAX_SECONDS. Usage:
+
+    python bench_mcg_nodes.py [number of method nodes ...]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import method_call_graph
+from method_call_graph import NodeS, NODE_FAKE_CLASS, ATTR_CLASS_NAME
+
+#the previous lookup is quadratic, bigger graphs take too long
+LEGACY_MAX_NODES = 20000
+REGRESSION_NODES = 100000
+MAX_SECONDS = 10.0
+
+METHODS_PER_CLASS = 10
+
+
+class LegacyMcgAnalysis(method_call_graph.StadynaMcgAnalysis):
+    def _get_node(self, nType, key, label=None, real=True):
+        node_key = None
+        if isinstance(key, basestring):
+            node_key = key
+        elif isinstance(key, tuple):
+            node_key = "%s %s %s" % key
+
+        if node_key not in self.nodes.keys():
+            new_node = NodeS(len(self.nodes), nType, node_key, label, real)
+            self.nodes[node_key] = new_node
+            self.nodes_id.append(new_node)
+
+        return self.nodes[node_key]
+
+    def _get_existed_node(self, key):
+        if isinstance(key, tuple):
+            key = "%s %s %s" % key
+        return self.nodes[key]
+
+
+def getMethod(i):
+    return ("Lcom/bench/C%d;" % (i / METHODS_PER_CLASS), "m%d" % (i % METHODS_PER_CLASS), "()V")
+
+
+def buildGraph(mcg, nodes):
+    """every method calls the next one, the first method of a class is linked to its class node"""
+    startTime = time.time()
+    for i in xrange(nodes):
+        n = mcg._get_method_node(getMethod(i))
+        mcg.G.add_node(n.id)
+
+    for i in xrange(nodes):
+        class_name, _, _ = method = getMethod(i)
+        n1 = mcg._get_existed_node(method)
+        n2 = mcg._get_existed_node(getMethod((i + 1) % nodes))
+        mcg._add_edge(n1.id, n2.id)
+        if i % METHODS_PER_CLASS == 0:
+            n_class = mcg._get_node(NODE_FAKE_CLASS, class_name, None, False)
+            n_class.set_attribute(ATTR_CLASS_NAME, class_name)
+            mcg._add_edge(n_class.id, n1.id)
+    return time.time() - startTime
+
+
+def main(sizes):
+    failed = False
+    print "%12s %12s %12s %12s" % ("methods", "nodes", "current", "previous")
+    for nodes in sizes:
+        mcg = method_call_graph.StadynaMcgAnalysis()
+        currentTime = buildGraph(mcg, nodes)
+        legacy = "skipped"
+        if nodes <= LEGACY_MAX_NODES:
+            legacyMcg = LegacyMcgAnalysis()
+            legacy = "%11.3fs" % buildGraph(legacyMcg, nodes)
+            assert len(legacyMcg.nodes_id) == len(mcg.nodes_id)
+        print "%12d %12d %11.3fs %12s" % (nodes, len(mcg.nodes_id), currentTime, legacy)
+        if nodes >= REGRESSION_NODES and currentTime > MAX_SECONDS * nodes / REGRESSION_NODES:
+            print "FAILED: the graph of [%d] methods is built in more than %.1fs!" % (nodes, MAX_SECONDS * nodes / REGRESSION_NODES)
+            failed = True
+    return failed
+
+
+if __name__ == "__main__":
+    sizes = [int(i) for i in sys.argv[1:]] or [5000, 20000, REGRESSION_NODES]
+    sys.exit(1 if main(sizes) else 0)
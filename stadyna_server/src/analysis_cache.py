@@ -0,0 +1,177 @@
+ # Copyright (C) 2013-2015 StaDynA
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License");
+ # you may not use this file except in compliance with the License.
+ # You may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ # See the License for the specific language governing permissions and
+ # limitations under the License.
+ #
+ # Author(s): Yury Zhauniarovich
+
+"""
+Persistent cache of the static analysis of code files (apk, dex).
+
+An entry holds the MOI found in a file and the call graph built for it alone,
+so that a file analysed once (e.g., a packer stub or an ad SDK plugin, which
+recur in many applications) is merged into the graph of an application without
+being parsed again. Entries are addressed by the SHA-256 of the file and the
+analysis profile, and are stored as compressed pickles in a directory, which
+can be shared by several processes. The least recently used entries are
+removed when the directory grows above its maximum size.
+"""
+
+import os
+import zlib
+import errno
+import cPickle
+import tempfile
+from logconfig import logger
+
+#Must be increased whenever the stored objects (MOI lists, StadynaMcgAnalysis,
+#NodeS) or the analysis change, the entries of the other versions are ignored
+CACHE_VERSION = 2
+
+CACHE_FILE_EXTENSION = ".moi"
+
+DEFAULT_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+
+class AnalysisCache:
+    def __init__(self, cacheDir, maxSize=DEFAULT_CACHE_MAX_SIZE):
+        self._cacheDir = cacheDir
+        self._maxSize = maxSize
+        self._size = None
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.errors = 0
+
+
+    def _getEntryPath(self, fileHash, profile):
+        #entries are spread over subdirectories by the first byte of the hash
+        entryName = "%s-%d-%d%s" % (fileHash, profile, CACHE_VERSION, CACHE_FILE_EXTENSION)
+        return os.path.join(self._cacheDir, fileHash[:2], entryName)
+
+
+    def get(self, fileHash, profile):
+        """
+        :rtype: (MOI lists as (invoke, newInstance, dexload), StadynaMcgAnalysis) or None
+        """
+        entryPath = self._getEntryPath(fileHash, profile)
+        try:
+            with open(entryPath, 'rb') as f:
+                data = f.read()
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                logger.warning("Could not read the cache entry [%s]: %s" % (entryPath, e))
+                self.errors += 1
+            self.misses += 1
+            return None
+
+        try:
+            entry = cPickle.loads(zlib.decompress(data))
+        except Exception as e:
+            logger.warning("The cache entry [%s] is corrupted and is removed: %s" % (entryPath, e))
+            self.errors += 1
+            self.misses += 1
+            self._remove(entryPath)
+            return None
+
+        #the modification time orders the entries for the eviction
+        try:
+            os.utime(entryPath, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return entry
+
+
+    def put(self, fileHash, profile, entry):
+        entryPath = self._getEntryPath(fileHash, profile)
+        data = zlib.compress(cPickle.dumps(entry, cPickle.HIGHEST_PROTOCOL))
+        if len(data) > self._maxSize:
+            logger.debug("The analysis of [%s] is too big to be cached!" % fileHash)
+            return
+
+        tmpPath = None
+        try:
+            entryDir = os.path.dirname(entryPath)
+            if not os.path.isdir(entryDir):
+                os.makedirs(entryDir)
+            #written under a temporary name, the other processes never see a partial entry
+            fd, tmpPath = tempfile.mkstemp(dir=entryDir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.rename(tmpPath, entryPath)
+        except (IOError, OSError) as e:
+            logger.warning("Could not store the cache entry [%s]: %s" % (entryPath, e))
+            self.errors += 1
+            #the temporary file is not an entry, so the eviction would never remove it
+            if tmpPath != None:
+                self._remove(tmpPath)
+            return
+
+        self.stores += 1
+        if self._size == None:
+            self._size = self._scan()[1]
+        else:
+            self._size += len(data)
+        if self._size > self._maxSize:
+            self._evict()
+
+
+    def _scan(self):
+        entries = []
+        size = 0
+        for root, _, files in os.walk(self._cacheDir):
+            for name in files:
+                if not name.endswith(CACHE_FILE_EXTENSION):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                size += st.st_size
+        return entries, size
+
+
+    def _evict(self):
+        #the directory may be shared, so the size is recomputed before the eviction
+        entries, self._size = self._scan()
+        entries.sort()
+        for _, size, path in entries:
+            if self._size <= self._maxSize:
+                break
+            if self._remove(path):
+                self._size -= size
+                self.evictions += 1
+
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+
+    def get_report(self):
+        buff = ""
+        buff += "=============================================\n"
+        buff += "Analysis cache hits: \t%d\n" % self.hits
+        buff += "Analysis cache misses: \t%d\n" % self.misses
+        buff += "Analysis cache stores: \t%d\n" % self.stores
+        buff += "Analysis cache evictions: \t%d\n" % self.evictions
+        buff += "Analysis cache errors: \t%d\n" % self.errors
+        buff += "=============================================\n"
+        return buff
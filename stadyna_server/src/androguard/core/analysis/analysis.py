@@ -1454,12 +1454,10 @@ class PathP:
     return self.access_flag
 
   def get_dst(self, cm):
-    method = cm.get_method_ref(self.dst_idx)
-    return method.get_class_name(), method.get_name(), method.get_descriptor()
+    return cm.get_method_ref_triple(self.dst_idx)
 
   def get_src(self, cm):
-    method = cm.get_method_ref(self.src_idx)
-    return method.get_class_name(), method.get_name(), method.get_descriptor()
+    return cm.get_method_ref_triple(self.src_idx)
 
   def get_idx(self):
     return self.idx
@@ -1640,6 +1638,39 @@ def is_dyn_code(dx):
     return False
 
 #begin SECCON
+SECCON_INVOKE_METHODS = [ ("Ljava/lang/reflect/Method;", "invoke") ]
+
+SECCON_NEWINSTANCE_METHODS = [ ("Ljava/lang/Class;", "newInstance"),
+                               ("Ljava/lang/reflect/Constructor;", "newInstance") ]
+
+SECCON_DYNCODE_LOADING_METHODS = [ ("Ldalvik/system/BaseDexClassLoader;", "<init>"),
+                                   ("Ldalvik/system/PathClassLoader;", "<init>"),
+                                   ("Ldalvik/system/DexClassLoader;", "<init>"),
+                                   ("Ldalvik/system/DexFile;", "<init>"),
+                                   ("Ldalvik/system/DexFile;", "loadDex") ]
+
+
+def seccon_get_moi_paths(dx):
+    """
+        This method gets the paths of all methods of interest (reflection invoke,
+        reflection newInstance and dynamic code loading) at once. The result is
+        computed only once and cached on the analysis object.
+        :param dx : the analysis virtual machine
+        :type dx: a :class:`VMAnalysis` object
+        :rtype: a tuple of three lists of paths (invoke, newInstance, dynamic code loading)
+    """
+    if dx.seccon_moi_paths == None:
+        tp = dx.get_tainted_packages()
+        moi_paths = []
+        for methods in (SECCON_INVOKE_METHODS, SECCON_NEWINSTANCE_METHODS, SECCON_DYNCODE_LOADING_METHODS):
+            paths = []
+            for class_name, name in methods:
+                paths.extend(tp.get_call_paths(class_name, name))
+            moi_paths.append(paths)
+        dx.seccon_moi_paths = tuple(moi_paths)
+    return dx.seccon_moi_paths
+
+
 def seccon_has_invoke_methods(dx):
     """
         This method checks if the application calls reflection invoke method.
@@ -1647,11 +1678,7 @@ def seccon_has_invoke_methods(dx):
         :type dx: a :class:`VMAnalysis` object
         :rtype: boolean
     """
-    if dx.get_tainted_packages().search_methods("Ljava/lang/reflect/Method;",
-                                                "invoke",
-                                                "."):
-        return True
-    return False
+    return len(seccon_get_moi_paths(dx)[0]) > 0
 
 
 def seccon_has_newInstance_methods(dx):
@@ -1661,16 +1688,7 @@ def seccon_has_newInstance_methods(dx):
         :type dx: a :class:`VMAnalysis` object
         :rtype: boolean
     """
-    if dx.get_tainted_packages().search_methods("Ljava/lang/Class;",
-                                                "newInstance",
-                                                "."):
-        return True
-    
-    if dx.get_tainted_packages().search_methods("Ljava/lang/reflect/Constructor;",
-                                                "newInstance",
-                                                "."):
-        return True
-    return False
+    return len(seccon_get_moi_paths(dx)[1]) > 0
 
 
 def seccon_has_dyncode_loading(dx):
@@ -1680,33 +1698,7 @@ def seccon_has_dyncode_loading(dx):
         :type dx: a :class:`VMAnalysis` object
         :rtype: boolean
     """
-
-    if dx.get_tainted_packages().search_methods("Ldalvik/system/BaseDexClassLoader;",
-                                                "<init>",
-                                                "."):
-        return True
-    
-    if dx.get_tainted_packages().search_methods("Ldalvik/system/PathClassLoader;",
-                                                "<init>",
-                                                "."):
-        return True
-    
-    if dx.get_tainted_packages().search_methods("Ldalvik/system/DexClassLoader;",
-                                                "<init>",
-                                                "."):
-        return True
-    
-    if dx.get_tainted_packages().search_methods("Ldalvik/system/DexFile;",
-                                                "<init>",
-                                                "."):
-        return True
-    
-    if dx.get_tainted_packages().search_methods("Ldalvik/system/DexFile;",
-                                                "loadDex",
-                                                "."):
-        return True
-    
-    return False
+    return len(seccon_get_moi_paths(dx)[2]) > 0
     
     
 
@@ -1716,10 +1708,7 @@ def seccon_get_invoke_method_paths(dx):
         :param dx : the analysis virtual machine
         :type dx: a :class:`VMAnalysis` object
     """
-    paths = dx.get_tainted_packages().search_methods("Ljava/lang/reflect/Method;",
-                                                "invoke",
-                                                ".")
-    return paths
+    return list(seccon_get_moi_paths(dx)[0])
 
 
 def seccon_get_newInstance_method_paths(dx):
@@ -1728,15 +1717,7 @@ def seccon_get_newInstance_method_paths(dx):
         :param dx : the analysis virtual machine
         :type dx: a :class:`VMAnalysis` object
     """
-    paths = []
-    paths.extend(dx.get_tainted_packages().search_methods("Ljava/lang/Class;",
-                                                "newInstance",
-                                                "."))
-    
-    paths.extend(dx.get_tainted_packages().search_methods("Ljava/lang/reflect/Constructor;",
-                                                "newInstance",
-                                                "."))
-    return paths
+    return list(seccon_get_moi_paths(dx)[1])
 
 
 def seccon_show_dyncode_loading_paths(dx):
@@ -1746,28 +1727,7 @@ def seccon_show_dyncode_loading_paths(dx):
         :type dx: a :class:`VMAnalysis` object
         :rtype: boolean
     """
-    paths = []
-    paths.extend(dx.get_tainted_packages().search_methods("Ldalvik/system/BaseDexClassLoader;",
-                                                "<init>",
-                                                "."))
-    
-    paths.extend(dx.get_tainted_packages().search_methods("Ldalvik/system/PathClassLoader;",
-                                                "<init>",
-                                                "."))
-    
-    paths.extend(dx.get_tainted_packages().search_methods("Ldalvik/system/DexClassLoader;",
-                                                "<init>",
-                                                "."))
-    
-    paths.extend(dx.get_tainted_packages().search_methods("Ldalvik/system/DexFile;",
-                                                "<init>",
-                                                "."))
-    
-    paths.extend(dx.get_tainted_packages().search_methods("Ldalvik/system/DexFile;",
-                                                "loadDex",
-                                                "."))
-    
-    show_Paths(dx.get_vm(), paths)
+    show_Paths(dx.get_vm(), seccon_get_moi_paths(dx)[2])
 
 def seccon_show_invoke_method_paths(dx):
     """
@@ -1775,10 +1735,7 @@ def seccon_show_invoke_method_paths(dx):
         :param dx : the analysis virtual machine
         :type dx: a :class:`VMAnalysis` object
     """
-    paths = dx.get_tainted_packages().search_methods("Ljava/lang/reflect/Method;",
-                                                "invoke",
-                                                ".")
-    show_Paths(dx.get_vm(), paths)
+    show_Paths(dx.get_vm(), seccon_get_moi_paths(dx)[0])
 
 
 def seccon_show_newInstance_method_paths(dx):
@@ -1787,15 +1744,7 @@ def seccon_show_newInstance_method_paths(dx):
         :param dx : the analysis virtual machine
         :type dx: a :class:`VMAnalysis` object
     """
-    paths = []
-    paths.extend(dx.get_tainted_packages().search_methods("Ljava/lang/Class;",
-                                                "newInstance",
-                                                "."))
-    
-    paths.extend(dx.get_tainted_packages().search_methods("Ljava/lang/reflect/Constructor;",
-                                                "newInstance",
-                                                "."))
-    show_Paths(dx.get_vm(), paths)
+    show_Paths(dx.get_vm(), seccon_get_moi_paths(dx)[1])
 
 
 def seccon_get_dyncode_loading_paths(dx):
@@ -1805,28 +1754,7 @@ def seccon_get_dyncode_loading_paths(dx):
         :type dx: a :class:`VMAnalysis` object
         :rtype: boolean
     """
-    paths = []
-    paths.extend(dx.get_tainted_packages().search_methods("Ldalvik/system/BaseDexClassLoader;",
-                                                "<init>",
-                                                "."))
-    
-    paths.extend(dx.get_tainted_packages().search_methods("Ldalvik/system/PathClassLoader;",
-                                                "<init>",
-                                                "."))
-    
-    paths.extend(dx.get_tainted_packages().search_methods("Ldalvik/system/DexClassLoader;",
-                                                "<init>",
-                                                "."))
-    
-    paths.extend(dx.get_tainted_packages().search_methods("Ldalvik/system/DexFile;",
-                                                "<init>",
-                                                "."))
-    
-    paths.extend(dx.get_tainted_packages().search_methods("Ldalvik/system/DexFile;",
-                                                "loadDex",
-                                                "."))
-    
-    return paths
+    return list(seccon_get_moi_paths(dx)[2])
 
 #end SECCON
 
@@ -1880,6 +1808,12 @@ class TaintedPackages :
         self.__vm = _vm
         self.__packages = {}
         self.__methods = {}
+        #begin SECCON
+        self.__calls = {}
+        #end SECCON
+        #begin STADYNA
+        self.__stadyna_info = None
+        #end STADYNA
 
     def _add_pkg(self, name) :
         if name not in self.__packages :
@@ -1890,6 +1824,19 @@ class TaintedPackages :
         self._add_pkg( class_name )
         p = self.__packages[ class_name ].push( access, idx, method.get_method_idx(), idx_method )
 
+        #begin STADYNA
+        self.__stadyna_info = None
+        #end STADYNA
+
+        #begin SECCON
+        if access == TAINTED_PACKAGE_CALL :
+            name = self.__vm.get_class_manager().get_method_ref_triple( idx_method )[1]
+            try :
+                self.__calls[ (class_name, name) ].append( p )
+            except KeyError :
+                self.__calls[ (class_name, name) ] = [ p ]
+        #end SECCON
+
         try :
             self.__methods[ method ][ class_name ].append( p )
         except :
@@ -1901,6 +1848,17 @@ class TaintedPackages :
 
             self.__methods[ method ][ class_name ].append( p )
 
+    #begin SECCON
+    def get_call_paths(self, class_name, name) :
+        """
+            @param class_name : the exact class name of the called method
+            @param name : the exact name of the called method
+
+            @rtype : a list of called methods' paths (in the order of the analysis)
+        """
+        return self.__calls.get( (class_name, name), [] )
+    #end SECCON
+
     def get_packages_by_method(self, method):
         try:
             return self.__methods[method]
@@ -1929,7 +1887,7 @@ class TaintedPackages :
             yield self.__packages[i], i
 
     def get_internal_packages_from_package(self, package):
-        classes = self.__vm.get_classes_names()
+        classes = self.__vm.get_classes_names_set()
         l = []
         for m, _ in self.get_packages():
             paths = m.get_methods()
@@ -1957,34 +1915,48 @@ class TaintedPackages :
 #                     l.append(j)
 #         return l
 
-        classes = self.__vm.get_classes_names()
-        l = []
-        for m, _ in self.get_packages():
-            paths = m.get_methods()
-            for j in paths:
-                if j.get_access_flag() == TAINTED_PACKAGE_CALL:
-                    src_class_name, _, _ = j.get_src(self.__vm.get_class_manager())
-                    dst_class_name, _, _ = j.get_dst(self.__vm.get_class_manager())
-                    if src_class_name in classes and dst_class_name in classes:
-                        l.append(j)
-        return l
-    
-    
-        
+        return list( self.stadyna_extract()[0] )
+
     def stadyna_get_internal_called_methods(self):
-        classes = self.__vm.get_classes_names()
-        l = set()
+        return list( self.stadyna_extract()[1] )
+
+    def stadyna_extract(self):
+        """
+            Resolve all called paths once and split them into the internal calls,
+            the internal methods (callers or callees) and the external calls that
+            require a permission.
+
+            :rtype: a tuple (list of internal paths, list of internal methods,
+                    list of (permission, path) in the order of the paths)
+        """
+        if self.__stadyna_info != None :
+            return self.__stadyna_info
+
+        classes = self.__vm.get_classes_names_set()
+        cm = self.__vm.get_class_manager()
+        internal_paths = []
+        internal_methods = set()
+        permission_paths = []
         for m, _ in self.get_packages():
-            paths = m.get_methods()
-            for j in paths:
-                if j.get_access_flag() == TAINTED_PACKAGE_CALL:
-                    src = src_class_name, _, _ = j.get_src(self.__vm.get_class_manager())
-                    dst = dst_class_name, _, _ = j.get_dst(self.__vm.get_class_manager())
-                    if src_class_name in classes: #src classname in classes
-                        l.add(src)
-                    if dst_class_name in classes: #dst classname in classes
-                        l.add(dst)
-        return list(l)
+            for j in m.get_methods():
+                src = src_class_name, _, _ = j.get_src(cm)
+                dst = dst_class_name, dst_method_name, dst_descriptor = j.get_dst(cm)
+                src_internal = src_class_name in classes
+                dst_internal = dst_class_name in classes
+                if src_internal:
+                    internal_methods.add(src)
+                if dst_internal:
+                    internal_methods.add(dst)
+                if src_internal and dst_internal:
+                    internal_paths.append(j)
+                elif src_internal:
+                    data = "%s-%s-%s" % (dst_class_name, dst_method_name, dst_descriptor)
+                    perm = DVM_PERMISSIONS_BY_API_CALLS.get(data)
+                    if perm != None:
+                        permission_paths.append((perm, j))
+
+        self.__stadyna_info = (internal_paths, list(internal_methods), permission_paths)
+        return self.__stadyna_info
     
     #end STADYNA
 
@@ -1992,7 +1964,7 @@ class TaintedPackages :
         """
             :rtype: return a list of the internal packages created in the application
         """
-        classes = self.__vm.get_classes_names()
+        classes = self.__vm.get_classes_names_set()
         l = {}
         for m, _ in self.get_packages():
             paths = m.get_new()
@@ -2011,7 +1983,7 @@ class TaintedPackages :
         """
             :rtype: return a list of the external packages called in the application
         """
-        classes = self.__vm.get_classes_names()
+        classes = self.__vm.get_classes_names_set()
         l = []
         for m, _ in self.get_packages():
             paths = m.get_methods()
@@ -2060,6 +2032,7 @@ class TaintedPackages :
             @param class_name : a regexp for the class name of the method (the package)
             @param name : a regexp for the name of the method
             @param descriptor : a regexp for the descriptor of the method
+            @param re_expr : if False, class_name, name and descriptor are exact values (descriptor None matches any)
 
             @rtype : a list of called methods' paths
         """
@@ -2070,6 +2043,13 @@ class TaintedPackages :
             for m, _ in self.get_packages() :
                 if ex.search( m.get_name() ) != None :
                     l.extend( m.search_method( name, descriptor ) )
+        #begin SECCON
+        else :
+            cm = self.__vm.get_class_manager()
+            for path in self.get_call_paths( class_name, name ) :
+                if descriptor == None or path.get_dst( cm )[2] == descriptor :
+                    l.append( path )
+        #end SECCON
 
         return l
     
@@ -2167,30 +2147,16 @@ class TaintedPackages :
         permissions = {}
         pn = permissions_needed
         if permissions_needed == [] :
-            pn = MANIFEST_PERMISSIONS.keys()
-
-        classes = self.__vm.get_classes_names()
-
-        for m, _ in self.get_packages() :
-            paths = m.get_methods()
-            for j in paths :
-                src_class_name, src_method_name, src_descriptor = j.get_src( self.__vm.get_class_manager() )
-                dst_class_name, dst_method_name, dst_descriptor = j.get_dst( self.__vm.get_class_manager() )
-                if src_class_name in classes and dst_class_name not in classes :
-                    if j.get_access_flag() == TAINTED_PACKAGE_CALL :
-#                         tmp = dst_descriptor
-#                         tmp = tmp[ : tmp.rfind(")") + 1 ]
-
-                        #data = "%s-%s-%s" % (m.get_info(), j.get_name(), j.get_descriptor())
-                        data = "%s-%s-%s" % (dst_class_name, dst_method_name, dst_descriptor)
+            pn = MANIFEST_PERMISSIONS
+        pn = set( pn )
 
-                        if data in DVM_PERMISSIONS_BY_API_CALLS:
-                            if DVM_PERMISSIONS_BY_API_CALLS[ data ] in pn :
-                                try :
-                                    permissions[ DVM_PERMISSIONS_BY_API_CALLS[ data ] ].append( j )
-                                except KeyError :
-                                    permissions[ DVM_PERMISSIONS_BY_API_CALLS[ data ] ] = []
-                                    permissions[ DVM_PERMISSIONS_BY_API_CALLS[ data ] ].append( j )
+        for perm, j in self.stadyna_extract()[2] :
+            if perm in pn :
+                try :
+                    permissions[ perm ].append( j )
+                except KeyError :
+                    permissions[ perm ] = []
+                    permissions[ perm ].append( j )
 
         return permissions
         #end STADYNA
@@ -2421,6 +2387,9 @@ BO["BasicOPCODES_H"] = []
 for i in BO["BasicOPCODES"] :
   BO["BasicOPCODES_H"].append( re.compile( i ) )
 
+# branch opcodes by opcode value, for dex (False) and odex (True) files
+BO["BasicOPCODES_T"] = { False : dvm.get_branch_opcodes( False ), True : dvm.get_branch_opcodes( True ) }
+
 
 class MethodAnalysis:
     """
@@ -2451,28 +2420,29 @@ class MethodAnalysis:
         ##########################################################
 
         bc = code.get_bc()
-        l = []
+        l = set()
         h = {}
         idx = 0
 
+        branch_opcodes, branch_wide_opcodes = BO["BasicOPCODES_T"][ self.__vm.get_class_manager().get_odex_format() ]
+
         debug("Parsing instructions")
         instructions = [i for i in bc.get_instructions()]
         for i in instructions:
-            for j in BO["BasicOPCODES_H"]:
-                if j.match(i.get_name()) != None:
-                    v = BO["Dnext"](i, idx, self.method)
-                    h[ idx ] = v
-                    l.extend(v)
-                    break
+            op_value = i.get_op_value()
+            if (op_value >= 0 and op_value <= 0xff and branch_opcodes[ op_value ]) or op_value in branch_wide_opcodes:
+                v = BO["Dnext"](i, idx, self.method)
+                h[ idx ] = v
+                l.update(v)
 
             idx += i.get_length()
 
         debug("Parsing exceptions")
         excepts = BO["Dexception"]( self.__vm, self.method )
         for i in excepts:
-            l.extend( [i[0]] )
+            l.add( i[0] )
             for handler in i[2:] :
-                l.append( handler[1] )
+                l.add( handler[1] )
 
         debug("Creating basic blocks")
         idx = 0
@@ -2602,18 +2572,33 @@ SIGNATURES = {
 from sign import Signature
 
 
+#begin STADYNA
+# VMAnalysis profiles
+ANALYSIS_PROFILE_FULL = 0
+# only the called/created packages (TaintedPackages), without basic blocks, exceptions and tainted variables
+ANALYSIS_PROFILE_CALL_GRAPH = 1
+
+# invoke-kind and invoke-kind/range
+CALL_GRAPH_INVOKE_OPCODES = frozenset( range(0x6e, 0x73) + range(0x74, 0x79) )
+# new-instance
+CALL_GRAPH_NEW_INSTANCE_OPCODE = 0x22
+#end STADYNA
+
 class VMAnalysis:
     """
        This class analyses a dex file
 
        :param _vm: the object which represent the dex file
        :type _vm: a :class:`DalvikVMFormat` object
+       :param profile: ANALYSIS_PROFILE_FULL or ANALYSIS_PROFILE_CALL_GRAPH (no method analyses are available)
+       :type profile: int
 
        :Example:
             VMAnalysis( DalvikVMFormat( open("toto.dex", "r").read() ) )
     """
-    def __init__(self, _vm) :
+    def __init__(self, _vm, profile=ANALYSIS_PROFILE_FULL) :
         self.__vm = _vm
+        self.profile = profile
 
         self.tainted_variables = TaintedVariables( self.__vm )
         self.tainted_packages = TaintedPackages( self.__vm )
@@ -2623,19 +2608,49 @@ class VMAnalysis:
                        }
 
         self.signature = None
-
-        for i in self.__vm.get_all_fields() :
-            self.tainted_variables.add( [ i.get_class_name(), i.get_descriptor(), i.get_name() ], TAINTED_FIELD )
+        #begin SECCON
+        self.seccon_moi_paths = None
+        #end SECCON
 
         self.methods = []
         self.hmethods = {}
         self.__nmethods = {}
+
+        #begin STADYNA
+        if self.profile == ANALYSIS_PROFILE_CALL_GRAPH :
+            self._create_call_graph_packages()
+            return
+        #end STADYNA
+
+        for i in self.__vm.get_all_fields() :
+            self.tainted_variables.add( [ i.get_class_name(), i.get_descriptor(), i.get_name() ], TAINTED_FIELD )
+
         for i in self.__vm.get_methods() :
             x = MethodAnalysis( self.__vm, i, self )
             self.methods.append( x )
             self.hmethods[ i ] = x
             self.__nmethods[ i.get_name() ] = x
 
+    #begin STADYNA
+    def _create_call_graph_packages(self) :
+        cm = self.__vm.get_class_manager()
+        op_values = CALL_GRAPH_INVOKE_OPCODES | set( [ CALL_GRAPH_NEW_INSTANCE_OPCODE ] )
+        for method in self.__vm.get_methods() :
+            code = method.get_code()
+            if code == None :
+                continue
+
+            for idx, op_value, ref in code.get_bc().get_instructions_refs( op_values ) :
+                # same as DVMBasicBlock.push
+                try :
+                    if op_value == CALL_GRAPH_NEW_INSTANCE_OPCODE :
+                        self.tainted_packages.push_info( cm.get_type( ref ), TAINTED_PACKAGE_CREATE, idx, method, None )
+                    else :
+                        self.tainted_packages.push_info( cm.get_method_ref_triple( ref )[0], TAINTED_PACKAGE_CALL, idx, method, ref )
+                except :
+                    pass
+    #end STADYNA
+
     def get_vm(self) :
         return self.__vm
 
@@ -61,7 +61,9 @@ CONF = {
 
     "TMP_DIRECTORY": "/tmp/",
 
-    # Full python or mix python/c++ (native)
+    # Full python or mix python/c++ (native): "python", "native" or "automatic"
+    # the native engine (make in core/bytecodes/libdvm) decodes the references for the call graph,
+    # python is used if it is not built
     #"ENGINE" : "automatic",
     "ENGINE": "python",
 
@@ -100,6 +102,10 @@ CONF = {
 
     "PRINT_FCT": sys.stdout.write,
     "LAZY_ANALYSIS": False,
+    # maximum number of parsed code items (and class data items) kept with the lazy analysis
+    "LAZY_ANALYSIS_CACHE_SIZE": 1024,
+    # record only the offsets of the debug information and annotations, decode them on access
+    "SKIP_DEBUG_ANNOTATIONS": False,
     "MAGIC_PATH_FILE": None,
 }
 
@@ -252,6 +258,9 @@ log_loading = logging.getLogger("andro.loading")          # logs when loading an
 def set_lazy() :
   CONF["LAZY_ANALYSIS"] = True
 
+def set_skip_debug_annotations() :
+  CONF["SKIP_DEBUG_ANNOTATIONS"] = True
+
 def set_debug() :
     log_andro.setLevel( logging.DEBUG )
 
@@ -17,6 +17,7 @@
 # along with Androguard.  If not, see <http://www.gnu.org/licenses/>.
 
 import hashlib
+import mmap
 from xml.sax.saxutils import escape
 from struct import unpack, pack
 import textwrap
@@ -669,6 +670,18 @@ class Buff :
         self.size = len(buff)
 
 
+def mmap_file(filename) :
+    """
+       Map a file in memory (read only). The result can be given to the parsers
+       (e.g., :class:`DalvikVMFormat`) instead of the content of the file: only the
+       parts which are read are loaded in memory.
+
+       :param filename: the path of the file
+       :rtype: mmap.mmap
+    """
+    with open(filename, "rb") as fd :
+        return mmap.mmap( fd.fileno(), 0, access=mmap.ACCESS_READ )
+
 class _Bytecode(object):
     def __init__(self, buff):
         try :
@@ -693,7 +706,8 @@ class _Bytecode(object):
         if isinstance(off, SV) :
             off = off.value
 
-        return self.__buff[ off : ]
+        # a view on the buffer, the tail is not copied
+        return buffer( self.__buff, off )
 
     def read_b(self, size) :
         return self.__buff[ self.__idx : self.__idx + size ]
@@ -22,6 +22,7 @@ from androguard.core import androconf
 from androguard.core.bytecodes.dvm_permissions import DVM_PERMISSIONS
 
 import StringIO
+import mmap
 from struct import pack, unpack
 from xml.sax.saxutils import escape
 from zlib import crc32
@@ -127,12 +128,39 @@ def sign_apk(filename, keystore, storepass):
     stdout, stderr = compile.communicate()
 
 
+#begin STADYNA
+class MMapFile(object):
+    """
+        A read only file object over a mmap (mmap.read needs a size in python 2)
+    """
+    def __init__(self, mm):
+        self.mm = mm
+        self.pos = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            size = len(self.mm) - self.pos
+        data = self.mm[self.pos:self.pos + size]
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self.pos
+        elif whence == 2:
+            offset += len(self.mm)
+        self.pos = max(0, offset)
+
+    def tell(self):
+        return self.pos
+#end STADYNA
+
 ######################################################## APK FORMAT ########################################################
 class APK:
     """
         This class can access to all elements in an APK file
 
-        :param filename: specify the path of the file, or raw data
+        :param filename: specify the path of the file, or raw data (a string or a read only mmap)
         :param raw: specify if the filename is a path or raw data (optional)
         :param mode: specify the mode to open the file (optional)
         :param magic_file: specify the magic file (optional)
@@ -172,16 +200,26 @@ class APK:
             self.__raw = fd.read()
             fd.close()
 
+        #begin STADYNA
+        # a mmap (see bytecode.mmap_file) is read in place, without a copy of the APK
+        if isinstance(self.__raw, mmap.mmap):
+            raw_file = MMapFile(self.__raw)
+            if zipmodule == 0:
+                zipmodule = 1
+        else:
+            raw_file = StringIO.StringIO(self.__raw)
+        #end STADYNA
+
         self.zipmodule = zipmodule
 
         if zipmodule == 0:
             self.zip = ChilkatZip(self.__raw)
         elif zipmodule == 2:
             from androguard.patch import zipfile
-            self.zip = zipfile.ZipFile(StringIO.StringIO(self.__raw), mode=mode)
+            self.zip = zipfile.ZipFile(raw_file, mode=mode)
         else:
             import zipfile
-            self.zip = zipfile.ZipFile(StringIO.StringIO(self.__raw), mode=mode)
+            self.zip = zipfile.ZipFile(raw_file, mode=mode)
 
         for i in self.zip.namelist():
             if i == "AndroidManifest.xml":
@@ -339,7 +377,7 @@ class APK:
         """
             Return raw bytes of the APK
 
-            :rtype: string
+            :rtype: string (or the mmap given to the constructor)
         """
         return self.__raw
 
@@ -362,6 +400,40 @@ class APK:
         """
         return self.get_file("classes.dex")
 
+    def get_dex_names(self):
+        """
+            Return the names of the dex files of the application (classes.dex, classes2.dex, ...)
+            in the order they are loaded by a multidex application
+
+            :rtype: a list of strings
+        """
+        files = set(self.get_files())
+        names = []
+        if "classes.dex" in files:
+            names.append("classes.dex")
+            i = 2
+            while "classes%d.dex" % i in files:
+                names.append("classes%d.dex" % i)
+                i += 1
+        return names
+
+    def get_all_dex(self):
+        """
+            Return the raw data of all the dex files of the application (see get_dex_names)
+
+            :rtype: a generator of strings
+        """
+        for name in self.get_dex_names():
+            yield self.get_file(name)
+
+    def is_multidex(self):
+        """
+            Return True if the application has more than one dex file
+
+            :rtype: boolean
+        """
+        return len(self.get_dex_names()) > 1
+
     def get_elements(self, tag_name, attribute):
         """
             Return elements in xml files which match with the tag name and the specific attribute
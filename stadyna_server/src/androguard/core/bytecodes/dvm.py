@@ -22,7 +22,15 @@ from androguard.core.androconf import CONF, debug, warning, is_android_raw
 import sys
 import re
 import struct
-from struct import pack, unpack, calcsize
+import bisect
+import collections
+from struct import pack, unpack, unpack_from, calcsize
+
+# the native engine is used only if libdvm has been built (make in core/bytecodes/libdvm)
+try :
+    from androguard.core.bytecodes.libdvm import dvmnative
+except ImportError :
+    dvmnative = None
 
 DEX_FILE_MAGIC_35 = 'dex\n035\x00'
 DEX_FILE_MAGIC_36 = 'dex\n036\x00'
@@ -1336,7 +1344,7 @@ class DebugInfoItemEmpty :
 
         self.offset = buff.get_idx()
         self.__buff = buff
-        self.__raw = ""
+        self.__raw = None
 
     def set_off(self, off) :
       self.offset = off
@@ -1345,6 +1353,12 @@ class DebugInfoItemEmpty :
       return self.offset
 
     def reload(self) :
+        self.__raw = None
+        # the debug information is decoded with ClassManager.get_debug_off
+        if not self.__CM.get_skip_debug_annotations() :
+            self._load_raw()
+
+    def _load_raw(self) :
         offset = self.offset
 
         n = self.__CM.get_next_offset_item( offset )
@@ -1361,10 +1375,12 @@ class DebugInfoItemEmpty :
         return []
 
     def get_raw(self) :
+        if self.__raw == None :
+            self._load_raw()
         return self.__raw
 
     def get_length(self) :
-      return len(self.__raw)
+      return len(self.get_raw())
 
 class EncodedArray :
     """
@@ -2715,18 +2731,21 @@ class EncodedMethod:
         self.name = v[1]
         self.proto = ''.join(i for i in v[2])
 
-        self.code = self.CM.get_code( self.code_off )
+        # with the lazy analysis, the code is parsed when it is requested (see get_code)
+        if not self.CM.get_lazy_analysis() :
+            self.code = self.CM.get_code( self.code_off )
 
     def get_locals(self):
         ret = self.proto.split(')')
         params = ret[0][1:].split()
 
-        return self.code.get_registers_size() - len(params) - 1
+        return self.get_code().get_registers_size() - len(params) - 1
 
     def get_information(self):
         info = {}
-        if self.code:
-          nb = self.code.get_registers_size()
+        code = self.get_code()
+        if code:
+          nb = code.get_registers_size()
           proto = self.get_descriptor()
 
           ret = proto.split(')')
@@ -2785,12 +2804,13 @@ class EncodedMethod:
         """
         self.show_info()
         self.show_notes()
-        if self.code != None :
-            self.each_params_by_register( self.code.get_registers_size(), self.get_descriptor() )
+        code = self.get_code()
+        if code != None :
+            self.each_params_by_register( code.get_registers_size(), self.get_descriptor() )
             if self.CM.get_vmanalysis() == None :
-                self.code.show()
+                code.show()
             else :
-                self.code.pretty_show( self.CM.get_vmanalysis().get_method( self ) )
+                code.pretty_show( self.CM.get_vmanalysis().get_method( self ) )
                 self.show_xref()
 
     def show_xref(self):
@@ -2832,8 +2852,9 @@ class EncodedMethod:
 
           :rtype: int
         """
-        if self.code != None :
-            return self.code.get_length()
+        code = self.get_code()
+        if code != None :
+            return code.get_length()
         return 0
 
     def get_code(self) :
@@ -2842,6 +2863,8 @@ class EncodedMethod:
 
           :rtype: :class:`DalvikCode` object
         """
+        if self.code == None and self.code_off != 0 and self.CM.get_lazy_analysis() :
+            return self.CM.get_code( self.code_off )
         return self.code
 
     def get_instructions(self) :
@@ -2850,9 +2873,10 @@ class EncodedMethod:
 
             :rtype: a generator of each :class:`Instruction` (or a cached list of instructions if you have setup instructions)
         """
-        if self.code == None :
+        code = self.get_code()
+        if code == None :
           return []
-        return self.code.get_bc().get_instructions()
+        return code.get_bc().get_instructions()
 
     def set_instructions(self, instructions) :
         """
@@ -2861,9 +2885,10 @@ class EncodedMethod:
             :param instructions: the list of instructions
             :type instructions: a list of :class:`Instruction`
         """
-        if self.code == None :
+        code = self.get_code()
+        if code == None :
           return []
-        return self.code.get_bc().set_instructions(instructions)
+        return code.get_bc().set_instructions(instructions)
 
     def get_instruction(self, idx, off=None) :
         """
@@ -2876,8 +2901,9 @@ class EncodedMethod:
 
             :rtype: an :class:`Instruction` object
         """
-        if self._code != None :
-            return self.code.get_bc().get_instruction(idx, off)
+        code = self.get_code()
+        if code != None :
+            return code.get_bc().get_instruction(idx, off)
         return None
 
     def get_debug(self) :
@@ -2886,9 +2912,10 @@ class EncodedMethod:
 
           :rtype: :class:`DebugInfoItem`
         """
-        if self.code == None :
+        code = self.get_code()
+        if code == None :
             return None
-        return self.code.get_debug()
+        return code.get_debug()
 
     def get_descriptor(self) :
         """
@@ -2925,8 +2952,9 @@ class EncodedMethod:
             :param off: address of the instruction
             :type off: int
         """
-        if self.code != None :
-            self.code.add_inote(msg, idx, off)
+        code = self.get_code()
+        if code != None :
+            code.add_inote(msg, idx, off)
 
     def add_note(self, msg) :
         """
@@ -2944,8 +2972,9 @@ class EncodedMethod:
             :param idx: the index
             :type idx: int
         """
-        if self.code != None :
-            self.code.set_idx( idx )
+        code = self.get_code()
+        if code != None :
+            code.set_idx( idx )
 
     def set_name(self, value) :
         self.CM.set_hook_method_name( self, value )
@@ -3196,6 +3225,7 @@ class ClassDefItem:
 
         self.interfaces = None
         self.class_data_item = None
+        self.class_data_loaded = False
         self.static_values = None
 
         self.name = None
@@ -3209,14 +3239,23 @@ class ClassDefItem:
         if self.interfaces_off != 0 :
             self.interfaces = self.__CM.get_type_list( self.interfaces_off )
 
+        if self.static_values_off != 0 :
+            self.static_values = self.__CM.get_encoded_array_item ( self.static_values_off )
+
+        # with the lazy analysis, the class data is parsed when it is requested
+        self.class_data_item = None
+        self.class_data_loaded = False
+        if not self.__CM.get_lazy_analysis() :
+            self._load_class_data()
+
+    def _load_class_data(self) :
+        self.class_data_loaded = True
+
         if self.class_data_off != 0 :
             self.class_data_item = self.__CM.get_class_data_item( self.class_data_off )
             self.class_data_item.reload()
 
-        if self.static_values_off != 0 :
-            self.static_values = self.__CM.get_encoded_array_item ( self.static_values_off )
-
-            if self.class_data_item != None :
+            if self.static_values != None :
                 self.class_data_item.set_static_fields( self.static_values.get_value() )
 
     def get_methods(self) :
@@ -3225,8 +3264,9 @@ class ClassDefItem:
 
             :rtype: a list of :class:`EncodedMethod` objects
         """
-        if self.class_data_item != None :
-            return self.class_data_item.get_methods()
+        class_data_item = self.get_class_data()
+        if class_data_item != None :
+            return class_data_item.get_methods()
         return []
 
     def get_fields(self) :
@@ -3235,8 +3275,9 @@ class ClassDefItem:
 
             :rtype: a list of :class:`EncodedField` objects
         """
-        if self.class_data_item != None :
-            return self.class_data_item.get_fields()
+        class_data_item = self.get_class_data()
+        if class_data_item != None :
+            return class_data_item.get_fields()
         return []
 
     def get_class_idx(self) :
@@ -3289,6 +3330,14 @@ class ClassDefItem:
         """
         return self.annotations_off
 
+    def get_annotations(self) :
+        """
+            Return the annotations structure for this class
+
+            :rtype: None or a :class:`AnnotationsDirectoryItem` object
+        """
+        return self.__CM.get_annotations_directory_item( self.annotations_off )
+
     def get_class_data_off(self) :
         """
             Return the offset from the start of the file to the associated class data for this item,
@@ -3314,6 +3363,8 @@ class ClassDefItem:
 
             :rtype: a :class:`ClassDataItem` object
         """
+        if not self.class_data_loaded :
+            self._load_class_data()
         return self.class_data_item
 
     def get_name(self) :
@@ -5999,10 +6050,181 @@ DALVIK_OPCODES_OPTIMIZED = {
 }
 
 
+def get_branch_opcodes(odex=False) :
+    """
+        Return the opcode values of the instructions which end a basic block
+        (the instructions whose name matches BRANCH_DVM_OPCODES)
+
+        :param odex: the opcodes are decoded as in an odex file
+        :type odex: boolean
+
+        :rtype: a tuple (a list of 256 booleans indexed by the opcode value, a frozenset of the extended/optimized opcode values)
+    """
+    branch = [ re.compile( i ) for i in BRANCH_DVM_OPCODES ]
+    def is_branch(name) :
+        for j in branch :
+            if j.match( name ) != None :
+                return True
+        return False
+
+    opcodes = [ False ] * 256
+    for op_value in DALVIK_OPCODES_FORMAT :
+        # decoded as InstructionInvalid (see get_instruction)
+        if not odex and (op_value >= 0xe3 and op_value <= 0xfe) :
+            continue
+        opcodes[ op_value ] = is_branch( DALVIK_OPCODES_FORMAT[ op_value ][1][0] )
+
+    wide_opcodes = [ i for i in DALVIK_OPCODES_EXTENDED_WIDTH if is_branch( DALVIK_OPCODES_EXTENDED_WIDTH[ i ][1][0] ) ]
+    if odex :
+        wide_opcodes.extend( i for i in DALVIK_OPCODES_OPTIMIZED if is_branch( DALVIK_OPCODES_OPTIMIZED[ i ][1][0] ) )
+
+    return opcodes, frozenset( wide_opcodes )
+
+
+def get_instructions_length(odex=False) :
+    """
+        Return the length (in bytes) of the instructions by opcode value. The first
+        digit of a format id is the number of 16-bit code units (Instruction35c -> 6 bytes).
+
+        :param odex: the opcodes are decoded as in an odex file
+        :type odex: boolean
+
+        :rtype: a tuple (a list of 256 lengths indexed by the opcode value, a dict of the extended/optimized opcode lengths)
+    """
+    def format_length(format_class) :
+        return int( format_class.__name__[ len("Instruction") ] ) * 2
+
+    # InstructionInvalid
+    lengths = [ 2 ] * 256
+    for op_value in DALVIK_OPCODES_FORMAT :
+        if not odex and (op_value >= 0xe3 and op_value <= 0xfe) :
+            continue
+        lengths[ op_value ] = format_length( DALVIK_OPCODES_FORMAT[ op_value ][0] )
+
+    wide_lengths = dict( (i, format_length( DALVIK_OPCODES_EXTENDED_WIDTH[ i ][0] )) for i in DALVIK_OPCODES_EXTENDED_WIDTH )
+    if odex :
+        wide_lengths.update( (i, format_length( DALVIK_OPCODES_OPTIMIZED[ i ][0] )) for i in DALVIK_OPCODES_OPTIMIZED )
+
+    return lengths, wide_lengths
+
+DALVIK_OPCODES_LENGTH = { False : get_instructions_length( False ), True : get_instructions_length( True ) }
+
+
+def get_payload_length(op_value, insn, idx) :
+    # packed-switch-payload
+    if op_value == 0x0100 :
+        size = unpack_from( "=H", insn, idx + 2 )[0]
+        return calcsize( "=HHI" ) + size * calcsize( "=L" )
+    # sparse-switch-payload
+    elif op_value == 0x0200 :
+        size = unpack_from( "=H", insn, idx + 2 )[0]
+        return calcsize( "=HH" ) + size * calcsize( "=L" ) * 2
+    # fill-array-data-payload
+    element_width, size = unpack_from( "=HI", insn, idx + 2 )
+    return ((size * element_width + 1) / 2 + 4) * 2
+
+
+def get_instructions_refs(cm, size, insn, idx, op_values) :
+    """
+        Walk through a raw buffer of instructions (like :class:`LinearSweepAlgorithm`) but
+        only decode the reference index (BBBB) of the classical instructions in op_values
+
+        :param cm: a ClassManager object
+        :type cm: :class:`ClassManager` object
+        :param size: the total size of the buffer (in 16-bit code units)
+        :type size: int
+        :param insn: a raw buffer where are the instructions
+        :type insn: string
+        :param idx: a start address in the buffer
+        :type idx: int
+        :param op_values: the opcode values of the instructions to decode (invoke-kind, new-instance ...)
+        :type op_values: a set of int
+
+        :rtype: a generator of (offset, opcode value, reference index)
+    """
+    odex = cm.get_odex_format()
+    lengths, wide_lengths = DALVIK_OPCODES_LENGTH[ odex ]
+
+    max_idx = size * calcsize('=H')
+    if max_idx > len(insn):
+      max_idx = len(insn)
+
+    start = idx
+    end = len(insn)
+    try :
+      while idx < max_idx:
+        op_value = ord(insn[idx])
+        length = None
+
+        #payload instructions or extented/optimized instructions
+        if (op_value == 0x00 or op_value == 0xff) and ((idx + 2) < max_idx):
+          wide_op_value = unpack_from('=H', insn, idx)[0]
+          if wide_op_value in DALVIK_OPCODES_PAYLOAD:
+            length = get_payload_length(wide_op_value, insn, idx)
+          elif wide_op_value in wide_lengths:
+            length = wide_lengths[ wide_op_value ]
+
+        # classical instructions
+        classic_instruction = length == None
+        if classic_instruction:
+          length = lengths[ op_value ]
+
+        # a truncated instruction is the last one (see Unresolved)
+        if idx + length > end:
+          break
+
+        if classic_instruction and op_value in op_values:
+          yield idx - start, op_value, unpack_from('=H', insn, idx + 2)[0]
+        idx += length
+    except struct.error:
+      warning("error while decoding instruction ...")
+
+
+def get_native_instructions_refs(cm, size, insn, idx, op_values) :
+    """
+        Same as :func:`get_instructions_refs`, but the instructions are decoded by the native engine (libdvm).
+        The native engine stops before the payloads, and decodes some unused opcodes as optimized instructions:
+        the rest of the buffer is walked in python
+
+        :rtype: a generator of (offset, opcode value, reference index)
+    """
+    max_idx = size * calcsize('=H')
+    if max_idx > len(insn):
+      max_idx = len(insn)
+
+    if idx >= max_idx:
+      return
+
+    # the nops are requested to find the payloads which are not used by an instruction
+    refs, end = cm.get_native_bytecode().new_code( buffer(insn, idx, max_idx - idx) ).get_refs( op_values | NATIVE_UNTRUSTED_OP_VALUES )
+
+    # a truncated instruction is the last one, only the python engine knows it
+    if idx + end > max_idx:
+      for i in get_instructions_refs(cm, size, insn, idx, op_values):
+        yield i
+      return
+
+    for offset, op_value, ref in refs:
+      if op_value in NATIVE_UNTRUSTED_OP_VALUES:
+        if op_value != 0x00 or ((idx + offset + 2) < max_idx and unpack_from('=H', insn, idx + offset)[0] in DALVIK_OPCODES_PAYLOAD):
+          end = offset
+          break
+        if op_value not in op_values:
+          continue
+      yield offset, op_value, ref
+
+    if idx + end < max_idx:
+      for offset, op_value, ref in get_instructions_refs(cm, size, insn, idx + end, op_values):
+        yield offset + end, op_value, ref
+
+NATIVE_UNTRUSTED_OP_VALUES = frozenset( [ 0x00 ] + range(0xe3, 0x100) )
+
+
 class Unresolved(Instruction):
   def __init__(self, cm, data):
     self.cm = cm
-    self.data = data
+    # data may be a buffer over the instructions of the method
+    self.data = str(data)
 
   def get_name(self):
     return "unresolved"
@@ -6059,7 +6281,7 @@ class LinearSweepAlgorithm :
             :param size: the total size of the buffer
             :type size: int
             :param insn: a raw buffer where are the instructions
-            :type insn: string
+            :type insn: string (or any object supporting the buffer interface)
             :param idx: a start address in the buffer
             :type idx: int
 
@@ -6071,43 +6293,44 @@ class LinearSweepAlgorithm :
         if max_idx > len(insn):
           max_idx = len(insn)
 
-        # Get instructions
+        # The instructions are decoded from a read-only view of the remaining
+        # bytes (buffer) and not from a copy of them (insn[idx:])
         while idx < max_idx:
           obj = None
           classic_instruction = True
 
-          op_value = unpack('=B', insn[idx])[0]
+          op_value = ord(insn[idx])
 
           #print "%x %x" % (op_value, idx)
 
           #payload instructions or extented/optimized instructions
           if (op_value == 0x00 or op_value == 0xff) and ((idx + 2) < max_idx):
-            op_value = unpack('=H', insn[idx:idx + 2])[0]
+            op_value = unpack_from('=H', insn, idx)[0]
 
             # payload instructions ?
             if op_value in DALVIK_OPCODES_PAYLOAD:
               try:
-                obj = get_instruction_payload(op_value, insn[idx:])
+                obj = get_instruction_payload(op_value, buffer(insn, idx))
                 classic_instruction = False
               except struct.error:
                 warning("error while decoding instruction ...")
 
             elif op_value in DALVIK_OPCODES_EXTENDED_WIDTH:
               try:
-                obj = get_extented_instruction(cm, op_value, insn[idx:])
+                obj = get_extented_instruction(cm, op_value, buffer(insn, idx))
                 classic_instruction = False
               except struct.error, why:
                 warning("error while decoding instruction ..." + why.__str__())
 
             # optimized instructions ?
             elif self.odex and (op_value in DALVIK_OPCODES_OPTIMIZED):
-              obj = get_optimized_instruction(cm, op_value, insn[idx:])
+              obj = get_optimized_instruction(cm, op_value, buffer(insn, idx))
               classic_instruction = False
 
           # classical instructions
           if classic_instruction:
-            op_value = unpack('=B', insn[idx])[0]
-            obj = get_instruction(cm, op_value, insn[idx:], self.odex)
+            op_value = ord(insn[idx])
+            obj = get_instruction(cm, op_value, buffer(insn, idx), self.odex)
 
           # emit instruction
           yield obj
@@ -6203,6 +6426,31 @@ class DCode:
             for i in lsa.get_instructions(self.CM, self.size, self.insn, self.idx):
                 yield i
 
+    def get_instructions_refs(self, op_values):
+        """
+            Get the reference index of some instructions without decoding all instructions
+
+            :param op_values: the opcode values of the instructions (invoke-kind, new-instance ...)
+            :type op_values: a set of int
+
+            :rtype: a generator of (offset, opcode value, reference index)
+        """
+        if self.cached_instructions:
+          idx = 0
+          for i in self.cached_instructions:
+            if i.get_op_value() in op_values:
+              yield idx, i.get_op_value(), i.get_ref_kind()
+            idx += i.get_length()
+
+        # the native engine does not know the optimized instructions
+        elif self.CM.get_engine() == "native" and not self.CM.get_odex_format():
+          for i in get_native_instructions_refs(self.CM, self.size, self.insn, self.idx, frozenset(op_values)):
+            yield i
+
+        else:
+          for i in get_instructions_refs(self.CM, self.size, self.insn, self.idx, op_values):
+            yield i
+
     def reload(self):
         pass
 
@@ -6639,6 +6887,198 @@ class CodeItem :
         length += i.get_size()
       return length
 
+class DeferredItems :
+    """
+        The items of a section of the dex file which are decoded only when they are accessed
+        (annotations with the SKIP_DEBUG_ANNOTATIONS option)
+
+        :param size: the number of items
+        :type size: int
+        :param Type: the class of the items
+    """
+    def __init__(self, size, buff, cm, Type) :
+        self.__CM = cm
+        self.__buff = buff
+        self.__Type = Type
+
+        self.offset = buff.get_idx()
+        self.size = size
+
+        self.__items = None
+        self.__items_off = {}
+
+    def set_off(self, off) :
+      self.offset = off
+
+    def get_off(self) :
+      return self.offset
+
+    def get_item(self, off) :
+        """
+            Return the item at an offset
+
+            :param off: the offset of the item
+            :type off: int
+        """
+        try :
+            return self.__items_off[ off ]
+        except KeyError :
+            s_idx = self.__buff.get_idx()
+            self.__buff.set_idx( off )
+            item = self.__Type( self.__buff, self.__CM )
+            self.__buff.set_idx( s_idx )
+
+            self.__items_off[ off ] = item
+            return item
+
+    def get_items(self) :
+        """
+            Return all items of the section
+
+            :rtype: a list
+        """
+        if self.__items == None :
+            s_idx = self.__buff.get_idx()
+            self.__buff.set_idx( self.offset )
+            items = []
+            for i in xrange(0, self.size) :
+                item = self.__Type( self.__buff, self.__CM )
+                item = self.__items_off.setdefault( item.get_off(), item )
+                self.__CM.set_obj_offset( item.get_off(), item )
+                items.append( item )
+            self.__buff.set_idx( s_idx )
+            self.__items = items
+        return self.__items
+
+    def reload(self) :
+        pass
+
+    def show(self) :
+        for i in self.get_items() :
+            i.show()
+
+    def get_obj(self) :
+        return self.get_items()
+
+    def get_raw(self) :
+        return ''.join(i.get_raw() for i in self.get_items())
+
+    def get_length(self) :
+      length = 0
+      for i in self.get_items() :
+        length += i.get_length()
+      return length
+
+class LazyCodeItem :
+    """
+        The code items of a dex file with the lazy analysis: a :class:`DalvikCode` is parsed
+        when the code at its offset is requested, and only the most recently used ones are kept
+    """
+    def __init__(self, size, buff, cm) :
+        self.__CM = cm
+        self.__buff = buff
+
+        self.offset = buff.get_idx()
+        self.size = size
+
+        self.__code_off = collections.OrderedDict()
+        self.__cache_size = cm.get_lazy_analysis_cache_size()
+
+    def set_off(self, off) :
+      self.offset = off
+
+    def get_off(self) :
+      return self.offset
+
+    def get_code(self, off) :
+        try :
+            code = self.__code_off.pop( off )
+        except KeyError :
+            if off == 0 :
+                return None
+
+            s_idx = self.__buff.get_idx()
+            self.__buff.set_idx( off )
+            code = DalvikCode( self.__buff, self.__CM )
+            self.__buff.set_idx( s_idx )
+
+            if len(self.__code_off) >= self.__cache_size :
+                self.__code_off.popitem( last=False )
+
+        self.__code_off[ off ] = code
+        return code
+
+    def get_code_item(self) :
+        """
+            Parse all code items
+
+            :rtype: a :class:`CodeItem` object
+        """
+        s_idx = self.__buff.get_idx()
+        self.__buff.set_idx( self.offset )
+        code_item = CodeItem( self.size, self.__buff, self.__CM )
+        self.__buff.set_idx( s_idx )
+        return code_item
+
+    def reload(self) :
+        pass
+
+    def show(self) :
+        self.get_code_item().show()
+
+    def get_obj(self) :
+        return self.get_code_item().get_obj()
+
+    def get_raw(self) :
+        return self.get_code_item().get_raw()
+
+    def get_length(self) :
+        return self.get_code_item().get_length()
+
+class LazyClassDataItem :
+    """
+        The class data items of a dex file with the lazy analysis: a :class:`ClassDataItem`
+        is parsed when the class data at its offset is requested, and only the most recently
+        used ones are kept (the :class:`ClassDefItem` keeps its own class data)
+    """
+    def __init__(self, size, buff, cm) :
+        self.__CM = cm
+        self.__buff = buff
+
+        self.offset = buff.get_idx()
+        self.size = size
+
+        self.__class_data_off = collections.OrderedDict()
+        self.__cache_size = cm.get_lazy_analysis_cache_size()
+
+    def set_off(self, off) :
+      self.offset = off
+
+    def get_off(self) :
+      return self.offset
+
+    def get_class_data_item(self, off) :
+        try :
+            class_data_item = self.__class_data_off.pop( off )
+        except KeyError :
+            s_idx = self.__buff.get_idx()
+            self.__buff.set_idx( off )
+            class_data_item = ClassDataItem( self.__buff, self.__CM )
+            self.__buff.set_idx( s_idx )
+
+            if len(self.__class_data_off) >= self.__cache_size :
+                self.__class_data_off.popitem( last=False )
+
+        self.__class_data_off[ off ] = class_data_item
+        return class_data_item
+
+    def reload(self) :
+        pass
+
+    def show(self) :
+        for i in sorted( self.__class_data_off ) :
+            self.__class_data_off[ i ].show()
+
 class MapItem :
     def __init__(self, buff, cm) :
         self.__CM = cm
@@ -6676,7 +7116,10 @@ class MapItem :
     def next(self, buff, cm):
         debug("%s @ 0x%x(%d) %x %x" % (TYPE_MAP_ITEM[self.type], buff.get_idx(), buff.get_idx(), self.size, self.offset))
 
-        if TYPE_MAP_ITEM[ self.type ] == "TYPE_STRING_ID_ITEM" :
+        if TYPE_MAP_ITEM[ self.type ] in DEFERRED_ANNOTATION_ITEMS and cm.get_skip_debug_annotations() :
+            self.item = DeferredItems( self.size, buff, cm, DEFERRED_ANNOTATION_ITEMS[ TYPE_MAP_ITEM[ self.type ] ] )
+
+        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_STRING_ID_ITEM" :
             self.item = [ StringIdItem( buff, cm ) for i in xrange(0, self.size) ]
 
         elif TYPE_MAP_ITEM[ self.type ] == "TYPE_CODE_ITEM" :
@@ -6734,48 +7177,14 @@ class MapItem :
             bytecode.Exit( "Map item %d @ 0x%x(%d) is unknown" % (self.type, buff.get_idx(), buff.get_idx()) )
 
     def next_lazy(self, buff, cm) :
-        if TYPE_MAP_ITEM[ self.type ] == "TYPE_STRING_ID_ITEM" :
-            self.item = [ StringIdItem( buff, cm ) for i in xrange(0, self.size) ]
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_CODE_ITEM" :
-            self.item = CodeItem( self.size, buff, cm )
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_TYPE_ID_ITEM" :
-            self.item = TypeIdItem( self.size, buff, cm )
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_PROTO_ID_ITEM" :
-            self.item = ProtoIdItem( self.size, buff, cm )
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_FIELD_ID_ITEM" :
-            self.item = FieldIdItem( self.size, buff, cm )
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_METHOD_ID_ITEM" :
-            self.item = MethodIdItem( self.size, buff, cm )
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_CLASS_DEF_ITEM" :
-            self.item = ClassDefItem( self.size, buff, cm )
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_HEADER_ITEM" :
-            self.item = HeaderItem( self.size, buff, cm )
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_TYPE_LIST" :
-            self.item = [ TypeList( buff, cm ) for i in xrange(0, self.size) ]
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_STRING_DATA_ITEM" :
-            self.item = [ StringDataItem( buff, cm ) for i in xrange(0, self.size) ]
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_DEBUG_INFO_ITEM" :
-            self.item = DebugInfoItemEmpty( buff, cm )
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_ENCODED_ARRAY_ITEM" :
-            self.item = [ EncodedArrayItem( buff, cm ) for i in xrange(0, self.size) ]
+        if TYPE_MAP_ITEM[ self.type ] == "TYPE_CODE_ITEM" :
+            self.item = LazyCodeItem( self.size, buff, cm )
 
         elif TYPE_MAP_ITEM[ self.type ] == "TYPE_CLASS_DATA_ITEM" :
-            self.item = [ ClassDataItem(buff, cm) for i in xrange(0, self.size) ]
-
-        elif TYPE_MAP_ITEM[ self.type ] == "TYPE_MAP_LIST" :
-            pass # It's me I think !!!
+            self.item = LazyClassDataItem( self.size, buff, cm )
 
+        else :
+            self.next( buff, cm )
 
     def reload(self) :
         if self.item != None :
@@ -6829,6 +7238,15 @@ class MapItem :
       self.item = item
 
 
+# annotation sections which are not decoded with the SKIP_DEBUG_ANNOTATIONS option
+DEFERRED_ANNOTATION_ITEMS = {
+    "TYPE_ANNOTATION_ITEM" : AnnotationItem,
+    "TYPE_ANNOTATION_SET_ITEM" : AnnotationSetItem,
+    "TYPE_ANNOTATIONS_DIRECTORY_ITEM" : AnnotationsDirectoryItem,
+    "TYPE_ANNOTATION_SET_REF_LIST" : AnnotationSetRefList,
+}
+
+
 class OffObj:
     def __init__(self, o):
         self.off = o
@@ -6848,6 +7266,9 @@ class ClassManager:
 
         self.__manage_item = {}
         self.__manage_item_off = []
+        self.__manage_item_off_sorted = True
+        # type_item -> { offset of the item : item }
+        self.__manage_item_by_off = {}
 
         self.__strings_off = {}
 
@@ -6856,6 +7277,8 @@ class ClassManager:
 
         self.__cached_type_list = {}
         self.__cached_proto = {}
+        self.__cached_method_refs = {}
+        self.__interned_strings = {}
 
         self.recode_ascii_string = config["RECODE_ASCII_STRING"]
         self.recode_ascii_string_meth = None
@@ -6863,10 +7286,20 @@ class ClassManager:
           self.recode_ascii_string_meth = config["RECODE_ASCII_STRING_METH"]
 
         self.lazy_analysis = config["LAZY_ANALYSIS"]
+        self.lazy_analysis_cache_size = config.get( "LAZY_ANALYSIS_CACHE_SIZE", CONF["LAZY_ANALYSIS_CACHE_SIZE"] )
+        self.skip_debug_annotations = config.get( "SKIP_DEBUG_ANNOTATIONS", CONF["SKIP_DEBUG_ANNOTATIONS"] )
 
         self.hook_strings = {}
 
         self.engine = []
+        self.native_bytecode = None
+        engine = config.get( "ENGINE", CONF["ENGINE"] )
+        if self.vm != None and engine in ("native", "automatic"):
+          if dvmnative != None:
+            self.engine.append("native")
+            self.native_bytecode = dvmnative.DalvikBytecode()
+          elif engine == "native":
+            debug("the native engine (libdvm) is not built, the python engine is used")
         self.engine.append("python")
 
         if self.vm != None:
@@ -6888,7 +7321,19 @@ class ClassManager:
         return self.odex_format
 
     def get_obj_by_offset(self, offset) :
-      return self.__obj_offset[ offset ]
+      try :
+        return self.__obj_offset[ offset ]
+      except KeyError :
+        if not self.skip_debug_annotations :
+          raise
+        # the object can be in a section which has not been decoded yet
+        for i in self.__manage_item.values() :
+          if isinstance(i, DeferredItems) :
+            i.get_items()
+        return self.__obj_offset[ offset ]
+
+    def set_obj_offset(self, offset, obj) :
+      self.__obj_offset[ offset ] = obj
 
     def get_item_by_offset(self, offset) :
       return self.__item_offset[ offset ]
@@ -6899,6 +7344,12 @@ class ClassManager:
     def get_lazy_analysis(self) :
       return self.lazy_analysis
 
+    def get_lazy_analysis_cache_size(self) :
+      return self.lazy_analysis_cache_size
+
+    def get_skip_debug_annotations(self) :
+      return self.skip_debug_annotations
+
     def get_vmanalysis(self) :
         return self.vmanalysis_ob
 
@@ -6920,6 +7371,9 @@ class ClassManager:
     def get_all_engine(self) :
         return self.engine
 
+    def get_native_bytecode(self) :
+        return self.native_bytecode
+
     def add_type_item(self, type_item, c_item, item) :
         self.__manage_item[ type_item ] = item
 
@@ -6932,16 +7386,41 @@ class ClassManager:
 
         if item != None :
             if isinstance(item, list) :
+                items_off = {}
                 for i in item :
                     goff = i.offset
-                    self.__manage_item_off.append( goff )
+                    self._add_manage_item_off( goff )
 
                     self.__obj_offset[ i.get_off() ] = i
 
                     if sdi == True :
                       self.__strings_off[ goff ] = i
+
+                    if type_item == "TYPE_TYPE_LIST" :
+                      items_off.setdefault( i.get_type_list_off(), i )
+                    else :
+                      items_off.setdefault( i.get_off(), i )
+                self.__manage_item_by_off[ type_item ] = items_off
             else :
-                self.__manage_item_off.append( c_item.get_offset() )
+                self._add_manage_item_off( c_item.get_offset() )
+
+    def _add_manage_item_off(self, off) :
+        if self.__manage_item_off and off < self.__manage_item_off[-1] :
+            self.__manage_item_off_sorted = False
+        self.__manage_item_off.append( off )
+
+    def _get_item_by_off(self, type_item, off) :
+        """
+            Return the first item of a type (list of items) at an offset, or None
+        """
+        item = self.__manage_item_by_off[ type_item ].get( off )
+        if item == None :
+            # the offsets of the items have been changed (set_off)
+            for i in self.__manage_item[ type_item ] :
+                i_off = i.get_type_list_off() if type_item == "TYPE_TYPE_LIST" else i.get_off()
+                if i_off == off :
+                    return i
+        return item
 
     def get_code(self, idx) :
         try :
@@ -6950,16 +7429,25 @@ class ClassManager:
             return None
 
     def get_class_data_item(self, off) :
-        for i in self.__manage_item[ "TYPE_CLASS_DATA_ITEM" ] :
-            if i.get_off() == off :
-                return i
+        if self.lazy_analysis :
+            return self.__manage_item[ "TYPE_CLASS_DATA_ITEM" ].get_class_data_item( off )
+
+        i = self._get_item_by_off( "TYPE_CLASS_DATA_ITEM", off )
+        if i != None :
+            return i
 
         bytecode.Exit( "unknown class data item @ 0x%x" % off )
 
     def get_encoded_array_item(self, off) :
-        for i in self.__manage_item["TYPE_ENCODED_ARRAY_ITEM" ] :
-            if i.get_off() == off :
-                return i
+        return self._get_item_by_off( "TYPE_ENCODED_ARRAY_ITEM", off )
+
+    def get_annotations_directory_item(self, off) :
+        if off == 0 or "TYPE_ANNOTATIONS_DIRECTORY_ITEM" not in self.__manage_item :
+            return None
+
+        if self.skip_debug_annotations :
+            return self.__manage_item[ "TYPE_ANNOTATIONS_DIRECTORY_ITEM" ].get_item( off )
+        return self._get_item_by_off( "TYPE_ANNOTATIONS_DIRECTORY_ITEM", off )
 
     def get_string(self, idx) :
         if idx in self.hook_strings :
@@ -7001,11 +7489,11 @@ class ClassManager:
         if off in self.__cached_type_list :
             return self.__cached_type_list[ off ]
 
-        for i in self.__manage_item[ "TYPE_TYPE_LIST" ] :
-            if i.get_type_list_off() == off :
-                ret =  "(" + i.get_string() + ")"
-                self.__cached_type_list[ off ] = ret
-                return ret
+        i = self._get_item_by_off( "TYPE_TYPE_LIST", off )
+        if i != None :
+            ret =  "(" + i.get_string() + ")"
+            self.__cached_type_list[ off ] = ret
+            return ret
 
         return None
 
@@ -7041,6 +7529,25 @@ class ClassManager:
     def get_method_ref(self, idx) :
         return self.__manage_item[ "TYPE_METHOD_ID_ITEM" ].get( idx )
 
+    def get_method_ref_triple(self, idx) :
+        """
+            Return the (class name, name, descriptor) of a method reference.
+            The triple is built only once for each index and its strings are shared.
+
+            :param idx: index of the method
+            :type idx: int
+
+            :rtype: a tuple of string
+        """
+        try :
+            return self.__cached_method_refs[ idx ]
+        except KeyError :
+            method = self.get_method_ref( idx )
+            interned = self.__interned_strings
+            triple = tuple( interned.setdefault( i, i ) for i in (method.get_class_name(), method.get_name(), method.get_descriptor()) )
+            self.__cached_method_refs[ idx ] = triple
+            return triple
+
     def set_hook_class_name(self, class_def, value) :
         _type = self.__manage_item[ "TYPE_TYPE_ID_ITEM" ].get( class_def.get_class_idx() )
         self.set_hook_string( _type, value )
@@ -7112,8 +7619,16 @@ class ClassManager:
 
     def set_hook_string(self, idx, value) :
         self.hook_strings[ idx ] = value
+        self.__cached_method_refs = {}
 
     def get_next_offset_item(self, idx) :
+        # the items are usually added by increasing offset
+        if self.__manage_item_off_sorted :
+            pos = bisect.bisect_right( self.__manage_item_off, idx )
+            if pos < len(self.__manage_item_off) :
+                return self.__manage_item_off[ pos ]
+            return idx
+
         for i in self.__manage_item_off :
             if i > idx :
                 return i
@@ -7227,13 +7742,14 @@ class DalvikVMFormat(bytecode._Bytecode):
     """
         This class can parse a classes.dex file of an Android application (APK).
 
-        :param buff: a string which represents the classes.dex file
+        :param buff: a string which represents the classes.dex file (or a read only mmap of the file)
         :param decompiler: associate a decompiler object to display the java source code
-        :type buff: string
+        :type buff: string or mmap.mmap
         :type decompiler: object
 
         :Example:
           DalvikVMFormat( open("classes.dex", "rb").read() )
+          DalvikVMFormat( bytecode.mmap_file("classes.dex") )
     """
     def __init__(self, buff, decompiler=None, config=None):
         super(DalvikVMFormat, self).__init__(buff)
@@ -7242,7 +7758,10 @@ class DalvikVMFormat(bytecode._Bytecode):
         if not self.config:
           self.config = {"RECODE_ASCII_STRING": CONF["RECODE_ASCII_STRING"],
                          "RECODE_ASCII_STRING_METH": CONF["RECODE_ASCII_STRING_METH"],
-                         "LAZY_ANALYSIS": CONF["LAZY_ANALYSIS"]}
+                         "LAZY_ANALYSIS": CONF["LAZY_ANALYSIS"],
+                         "LAZY_ANALYSIS_CACHE_SIZE": CONF["LAZY_ANALYSIS_CACHE_SIZE"],
+                         "SKIP_DEBUG_ANNOTATIONS": CONF["SKIP_DEBUG_ANNOTATIONS"],
+                         "ENGINE": CONF["ENGINE"]}
 
         self.CM = ClassManager(self, self.config)
         self.CM.set_decompiler(decompiler)
@@ -7270,8 +7789,12 @@ class DalvikVMFormat(bytecode._Bytecode):
             self.header = self.map_list.get_item_type( "TYPE_HEADER_ITEM" )
 
         self.classes_names = None
+        self.classes_names_set = None
         self.__cache_methods = None
         self.__cached_methods_idx = None
+        self.__cached_methods_name = None
+        self.__cached_methods_class_name = None
+        self.__cached_classes_superclass = None
 
     def get_classes_def_item(self) :
         """
@@ -7494,6 +8017,16 @@ class DalvikVMFormat(bytecode._Bytecode):
             self.classes_names = [ i.get_name() for i in self.classes.class_def ]
         return self.classes_names
 
+    def get_classes_names_set(self) :
+        """
+            Return the names of classes as a set (for membership tests)
+
+            :rtype: a frozenset of string
+        """
+        if self.classes_names_set == None :
+            self.classes_names_set = frozenset( self.get_classes_names() )
+        return self.classes_names_set
+
     def get_classes(self) :
         """
           Return all classes
@@ -7515,6 +8048,43 @@ class DalvikVMFormat(bytecode._Bytecode):
             return i
         return None
 
+    def _build_methods_name_cache(self) :
+        self.__cached_methods_name = {}
+        self.__cached_methods_class_name = {}
+        for i in self.classes.class_def :
+            for j in i.get_methods() :
+                name = j.get_name()
+                self.__cached_methods_name.setdefault( name, [] ).append( j )
+                self.__cached_methods_class_name.setdefault( (i.get_name(), name), [] ).append( j )
+
+    def get_methods_by_name(self, name) :
+        """
+            Return all methods with a specific name
+
+            :param name: the name of the method (not a regexp, see get_method)
+            :type name: string
+
+            :rtype: a list with :class:`EncodedMethod` objects
+        """
+        if self.__cached_methods_name == None :
+            self._build_methods_name_cache()
+        return list( self.__cached_methods_name.get( name, [] ) )
+
+    def get_classes_by_superclass(self, name) :
+        """
+            Return all classes which directly extend a specific class
+
+            :param name: the name of the superclass
+            :type name: string
+
+            :rtype: a list of :class:`ClassDefItem` objects
+        """
+        if self.__cached_classes_superclass == None :
+            self.__cached_classes_superclass = {}
+            for i in self.classes.class_def :
+                self.__cached_classes_superclass.setdefault( i.get_superclassname(), [] ).append( i )
+        return list( self.__cached_classes_superclass.get( name, [] ) )
+
     def get_method(self, name) :
         """
             Return a list all methods which corresponds to the regexp
@@ -7623,13 +8193,13 @@ class DalvikVMFormat(bytecode._Bytecode):
 
             :rtype: None or a :class:`EncodedMethod` object
         """
-        key = class_name + method_name + descriptor
+        key = (class_name, method_name, descriptor)
 
         if self.__cache_methods == None :
             self.__cache_methods = {}
             for i in self.classes.class_def :
                 for j in i.get_methods() :
-                    self.__cache_methods[ j.get_class_name() + j.get_name() + j.get_descriptor() ] = j
+                    self.__cache_methods[ (j.get_class_name(), j.get_name(), j.get_descriptor()) ] = j
 
         try :
             return self.__cache_methods[ key ]
@@ -7647,14 +8217,9 @@ class DalvikVMFormat(bytecode._Bytecode):
 
             :rtype: None or a :class:`EncodedMethod` object
         """
-        l = []
-        for i in self.classes.class_def:
-          if i.get_name() == class_name:
-            for j in i.get_methods():
-                if j.get_name() == method_name:
-                    l.append(j)
-
-        return l
+        if self.__cached_methods_class_name == None :
+            self._build_methods_name_cache()
+        return list( self.__cached_methods_class_name.get( (class_name, method_name), [] ) )
 
     def get_methods_class(self, class_name) :
         """
@@ -8326,6 +8891,56 @@ def get_bytecodes_methodx(method, mx):
     return i_buffer
 
 
+#begin SECCON
+def _seccon_get_string(buff, dex_off, string_ids_off, idx):
+  string_data_off = dex_off + unpack_from("=I", buff, string_ids_off + idx * 4)[0]
+  # skip the uleb128 utf16 size
+  while ord(buff[string_data_off]) > 0x7f:
+    string_data_off += 1
+  string_data_off += 1
+  return buff[string_data_off : buff.find('\x00', string_data_off)]
+
+def seccon_get_method_refs(buff, class_names):
+  """
+      Return the method references of the given classes by reading only the
+      header, string_ids, type_ids and method_ids tables of a dex (or odex) file
+
+      :param buff: the raw data of the file
+      :type buff: string
+      :param class_names: the class names (e.g. Ljava/lang/Class;) to look for
+      :type class_names: a set of strings
+
+      :rtype: a set of (class name, method name) tuples
+  """
+  dex_off = 0
+  if buff[:4] == ODEX_FILE_MAGIC_35[:4]:
+    dex_off = unpack_from("=I", buff, 8)[0]
+
+  (string_ids_size, string_ids_off,
+   type_ids_size, type_ids_off) = unpack_from("=4I", buff, dex_off + 0x38)
+  method_ids_size, method_ids_off = unpack_from("=2I", buff, dex_off + 0x58)
+  string_ids_off += dex_off
+  type_ids_off += dex_off
+  method_ids_off += dex_off
+
+  types = {}
+  for type_idx in xrange(type_ids_size):
+    descriptor_idx = unpack_from("=I", buff, type_ids_off + type_idx * 4)[0]
+    name = _seccon_get_string(buff, dex_off, string_ids_off, descriptor_idx)
+    if name in class_names:
+      types[type_idx] = name
+
+  refs = set()
+  if not types:
+    return refs
+
+  for method_idx in xrange(method_ids_size):
+    class_idx, _, name_idx = unpack_from("=HHI", buff, method_ids_off + method_idx * 8)
+    if class_idx in types:
+      refs.add((types[class_idx], _seccon_get_string(buff, dex_off, string_ids_off, name_idx)))
+  return refs
+#end SECCON
+
 def auto(filename, raw=None):
   """
       :param filename:
@@ -815,13 +815,13 @@ DBC *DCode::get_bytecode_at(int i) {
 }
 
 DalvikBytecode::DalvikBytecode() {
-    for (int ii=0; ii < 0xff; ii++)
+    for (int ii=0; ii < 0x100; ii++)
         bytecodes_names.push_back( NULL );
 
-    for (int ii=0; ii < 0xff; ii++)
+    for (int ii=0; ii < 0x100; ii++)
         bytecodes.push_back( NULL );
 
-    for (int ii=0; ii < 0xff; ii++)
+    for (int ii=0; ii < 0x100; ii++)
         postbytecodes.push_back( NULL );
 
     bytecodes_names[ 0x0 ] = "nop";
@@ -1634,7 +1634,7 @@ static int
 DCode_init(dvm_DCodeObject *self, PyObject *args, PyObject *kwds)
 {
     const char *code;
-    size_t code_len;
+    int code_len;
 
     if (self != NULL) {
         int ok = PyArg_ParseTuple( args, "s#", &code, &code_len);
@@ -1700,10 +1700,56 @@ static PyObject *DCode_get_bytecodes_spe(dvm_DCodeObject *self, PyObject* args)
     return self->bytecodes_spe_list;
 }
 
+/* [(offset, op value, index of the field/method/type/string or -1), ...] of the bytecodes whose op value is in the sequence,
+   and the offset of the end of the decoded bytecodes (the payloads are not decoded) */
+static PyObject *DCode_get_refs(dvm_DCodeObject *self, PyObject* args)
+{
+    PyObject *op_values;
+
+    if (!PyArg_ParseTuple( args, "O", &op_values ))
+        return NULL;
+
+    PyObject *refs = PyList_New( 0 );
+    unsigned int idx = 0;
+
+    for (int ii=0; ii < self->d->bytecodes.size(); ii++) {
+        DBC *dbc = self->d->bytecodes[ii];
+
+        PyObject *op = PyInt_FromLong( dbc->get_opvalue() );
+        int present = PySequence_Contains( op_values, op );
+        if (present < 0) {
+            Py_DECREF( op );
+            Py_DECREF( refs );
+            return NULL;
+        }
+
+        if (present == 1) {
+            int value = -1;
+            for(int jj=1; jj < dbc->vdescoperands->size(); jj++) {
+                int desc = (*dbc->vdescoperands)[jj];
+                if (desc == FIELD || desc == METHOD || desc == TYPE || desc == STRING) {
+                    value = (*dbc->voperands)[jj];
+                    break;
+                }
+            }
+
+            PyObject *ref = Py_BuildValue( "(iOi)", idx, op, value );
+            PyList_Append( refs, ref );
+            Py_DECREF( ref );
+        }
+
+        Py_DECREF( op );
+        idx += dbc->get_length();
+    }
+
+    return Py_BuildValue( "(Ni)", refs, idx );
+}
+
 static PyMethodDef DCode_methods[] = {
     {"get_nb_bytecodes",  (PyCFunction)DCode_get_nb_bytecodes, METH_NOARGS, "get nb bytecodes" },
     {"get_bytecodes",  (PyCFunction)DCode_get_bytecodes, METH_NOARGS, "get nb bytecodes" },
     {"get_bytecodes_spe",  (PyCFunction)DCode_get_bytecodes_spe, METH_NOARGS, "get nb bytecodes" },
+    {"get_refs",  (PyCFunction)DCode_get_refs, METH_VARARGS, "get the references of some bytecodes" },
     {NULL, NULL, 0, NULL}        /* Sentinel */
 };
 
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+# This file is part of Androguard.
+#
+# Copyright (C) 2011, Anthony Desnos <desnos at t0t0.fr>
+# All rights reserved.
+#
+# Androguard is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Androguard is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Androguard.  If not, see <http://www.gnu.org/licenses/>.
+
+# Parity of the native engine (dvmnative.so, built with make) with the python engine.
+# The tests are skipped if the native engine has not been built.
+
+import os, sys, random, unittest
+from struct import pack
+
+PATH_INSTALL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..")
+sys.path.append(PATH_INSTALL)
+
+from androguard.core.bytecodes import dvm
+
+# invoke-kind, invoke-kind/range and new-instance (see analysis.ANALYSIS_PROFILE_CALL_GRAPH)
+OP_VALUES = frozenset( range(0x6e, 0x73) + range(0x74, 0x79) + [ 0x22 ] )
+
+# instructions which refer to a payload
+PAYLOAD_OPCODES = ( 0x26, 0x2b, 0x2c )
+
+class ClassManager :
+    def __init__(self) :
+        self.native_bytecode = None
+        if dvm.dvmnative != None :
+            self.native_bytecode = dvm.dvmnative.DalvikBytecode()
+
+    def get_odex_format(self) :
+        return False
+
+    def get_native_bytecode(self) :
+        return self.native_bytecode
+
+def make_instruction(op_value, rand) :
+    lengths, _ = dvm.DALVIK_OPCODES_LENGTH[ False ]
+    return chr(op_value) + ''.join( chr(rand.randint(0, 255)) for i in xrange(0, lengths[ op_value ] - 1) )
+
+def make_random_code(rand, nb, op_values=None) :
+    if op_values == None :
+        op_values = [ i for i in xrange(0, 0x100) if i not in PAYLOAD_OPCODES ]
+    return ''.join( make_instruction( rand.choice(op_values), rand ) for i in xrange(0, nb) )
+
+def make_packed_switch(first_key, targets) :
+    return pack("=HHi", 0x0100, len(targets), first_key) + ''.join( pack("=i", i) for i in targets )
+
+@unittest.skipIf(dvm.dvmnative == None, "the native engine is not built")
+class NativeEngineParityTest(unittest.TestCase) :
+    def setUp(self) :
+        self.cm = ClassManager()
+
+    def assertSameRefs(self, insn, op_values=OP_VALUES) :
+        size = len(insn) / 2
+        python_refs = list( dvm.get_instructions_refs( self.cm, size, insn, 0, op_values ) )
+        native_refs = list( dvm.get_native_instructions_refs( self.cm, size, insn, 0, op_values ) )
+        self.assertEqual( python_refs, native_refs )
+        return python_refs
+
+    def test_each_opcode(self) :
+        rand = random.Random(0)
+        for op_value in xrange(0, 0x100) :
+            if op_value in PAYLOAD_OPCODES :
+                continue
+            # the offset of the invoke-virtual depends on the length of the instruction
+            insn = make_instruction( op_value, rand ) + pack("=HHH", 0x106e, 0x0001, 0x0000) + pack("=H", 0x000e)
+            self.assertSameRefs( insn )
+
+    def test_random_code(self) :
+        rand = random.Random(1)
+        for i in xrange(0, 200) :
+            self.assertSameRefs( make_random_code( rand, 100 ) )
+
+    def test_instruction_lengths(self) :
+        # without the nops (which can be payloads) and the unused opcodes
+        rand = random.Random(2)
+        insn = make_random_code( rand, 1000, [ i for i in xrange(1, 0xe3) if i not in PAYLOAD_OPCODES ] )
+        python_lengths = []
+        for i in dvm.LinearSweepAlgorithm().get_instructions( self.cm, len(insn) / 2, insn, 0 ) :
+            python_lengths.append( i.get_length() )
+
+        code = self.cm.get_native_bytecode().new_code( insn )
+        native_lengths = [ i.get_length() for i in code.get_bytecodes() ]
+
+        self.assertEqual( python_lengths, native_lengths )
+
+    def test_switch(self) :
+        # packed-switch v0, +4 ; invoke-virtual {v0}, meth@1 ; nop ; payload ; invoke-static {}, meth@2 ; return-void
+        insn = pack("=HHH", 0x002b, 0x0006, 0x0000)
+        insn += pack("=HHH", 0x106e, 0x0001, 0x0000)
+        insn += make_packed_switch( 0, [ 3, 6 ] )
+        insn += pack("=HHH", 0x0071, 0x0002, 0x0000)
+        insn += pack("=H", 0x000e)
+        refs = self.assertSameRefs( insn )
+        self.assertEqual( [ 1, 2 ], [ i[2] for i in refs ] )
+
+    def test_unused_payload(self) :
+        insn = pack("=HHH", 0x106e, 0x0001, 0x0000)
+        insn += make_packed_switch( 0, [ 3 ] )
+        insn += pack("=HH", 0x0122, 0x0003)
+        insn += pack("=H", 0x000e)
+        refs = self.assertSameRefs( insn )
+        self.assertEqual( [ 1, 3 ], [ i[2] for i in refs ] )
+
+    def test_range_invoke(self) :
+        insn = pack("=HHH", 0x0374, 0x0004, 0x0000)
+        insn += pack("=H", 0x000e)
+        refs = self.assertSameRefs( insn )
+        self.assertEqual( [ (0, 0x74, 4) ], refs )
+
+    def test_truncated_instruction(self) :
+        insn = pack("=HHH", 0x106e, 0x0001, 0x0000)
+        insn += pack("=HH", 0x106e, 0x0002)
+        self.assertSameRefs( insn )
+
+if __name__ == "__main__" :
+    unittest.main()
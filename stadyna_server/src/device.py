@@ -161,6 +161,48 @@ class Device:
         return True
     
     
+    def uninstall_package(self, package_name):
+        logger.debug("Uninstalling package [%s]..." % package_name)
+        if not self.is_alive():
+            logger.error("The device [%s] is not running!" % str(self.device_name))
+            return False
+        
+        if not package_name:
+            logger.warning("The name of the package to uninstall is not specified!")
+            return False
+        
+        try:
+            with open(os.devnull, 'w') as f_null:
+                subprocess.check_call(["adb", "-s", self.device_name, "uninstall", package_name], stdout=f_null, stderr=f_null)
+        except subprocess.CalledProcessError:
+            logger.error("Could not uninstall package [%s] from the device!" % package_name)
+            return False
+        
+        logger.debug("Package [%s] is uninstalled!" % package_name)
+        return True
+    
+    
+    def force_stop_package(self, package_name):
+        logger.debug("Stopping package [%s]..." % package_name)
+        if not self.is_alive():
+            logger.error("The device [%s] is not running!" % self.device_name)
+            return False
+        
+        if not package_name:
+            logger.warning("The name of the package to stop is not specified!")
+            return False
+        
+        try:
+            with open(os.devnull, 'w') as f_null:
+                subprocess.check_call(['adb', '-s', self.device_name, 'shell', 'am force-stop', package_name], stderr=f_null)
+        except subprocess.CalledProcessError:
+            logger.error("Could not stop package [%s]!" % package_name)
+            return False
+        
+        logger.debug("Package [%s] is stopped!" % package_name)
+        return True
+    
+    
     def get_logcat(self, tag = None, level = None):
         logger.debug("Attaching to a logcat pipe...")
         if not self.is_alive():
@@ -37,6 +37,30 @@ import json
 from device import Device
 from logconfig import logger
 
+#Put into the queue by SecconMessageProducer when it stops reading messages
+END_OF_MESSAGES = None
+
+#How long a consumer blocks waiting for a message before waking up (seconds)
+MSG_WAIT_TIMEOUT = 0.5
+#Maximum number of messages taken from the queue at once
+MSG_BATCH_SIZE = 256
+
+
+def getMessageBatch(messages, timeout=MSG_WAIT_TIMEOUT, maxBatchSize=MSG_BATCH_SIZE):
+    '''
+    Blocks until at least one message is available (or the timeout expires)
+    and then drains the messages already waiting in the queue without blocking.
+    Returns a possibly empty list of messages.
+    '''
+    batch = []
+    try:
+        batch.append(messages.get(True, timeout))
+        while len(batch) < maxBatchSize:
+            batch.append(messages.get_nowait())
+    except Queue.Empty:
+        pass
+    return batch
+
 
 class SecconMessageProducer(threading.Thread):
     def __init__(self, device, messages):
@@ -45,6 +69,7 @@ class SecconMessageProducer(threading.Thread):
         self._device = device
         self._messages = messages
         self._stop = False
+        self._process = None
         self._partial_messages = {}
 
     
@@ -85,14 +110,27 @@ class SecconMessageProducer(threading.Thread):
     
     def stopThread(self):
         self._stop = True
+        #unblocks the thread waiting for the next logcat line
+        if self._process != None and self._process.poll() == None:
+            self._process.terminate()
 
     
     def run(self):
+        try:
+            self._readMessages()
+        finally:
+            #signals the consumer that no more messages will come
+            self._messages.put(END_OF_MESSAGES)
+    
+    
+    def _readMessages(self):
         if not self._device.is_alive():
             return
         self._device.clean_logcat()
         process = self._device.get_logcat()
-        msg = None
+        if process == None:
+            return
+        self._process = process
         res = False
         for line in iter(process.stdout.readline, ''):
             res = self.parseSecconMsg(line)
@@ -101,7 +139,8 @@ class SecconMessageProducer(threading.Thread):
 
             if self._stop:
                 logger.info("Terminating thread that reads 'adb logcat' output.")
-                process.terminate() #stops the child process
+                if process.poll() == None:
+                    process.terminate() #stops the child process
                 break
             
         process.stdout.close()
@@ -122,13 +161,14 @@ class SecconMessageProcessor(threading.Thread):
         
     def run(self):
         while True:
-            while not self._messages.empty():
-                line = self._messages.get()
+            for line in getMessageBatch(self._messages):
+                if line is END_OF_MESSAGES:
+                    self._stop = True
+                    break
                 print 'Received line: ' + repr(line)
                 load = json.loads(line)
                 print load
                 
-            time.sleep(.1)
             if self._stop:
                 logger.info("Terminating Stadyna message processor thread.")
                 break
@@ -14,6 +14,7 @@
  #
  # Author(s): Yury Zhauniarovich
  
+import collections
 from xml.sax.saxutils import escape
 
 from logconfig import logger
@@ -128,6 +129,23 @@ ID_ATTRIBUTES = {
 }
 
 
+#the order of the attvalues of a node in the gexf files
+GEXF_ATTRIBUTES = [
+    ATTR_METHOD_NAME,
+    ATTR_DESCRIPTOR,
+    ATTR_REAL,
+    ATTR_PERM_NAME,
+    ATTR_CLASS_NAME,
+    ATTR_DEXLOAD_FILENAME,
+    ATTR_PERM_LEVEL,
+    ATTR_TYPE,
+]
+
+#node types are stored in the nodes as indexes in this list
+NODE_TYPES = sorted(NODE_COLORS.keys())
+NODE_TYPE_IDS = dict((nType, i) for i, nType in enumerate(NODE_TYPES))
+
+
 # DEXCLASSLOADER_COLOR = (0, 0, 0)
 # ACTIVITY_COLOR = (51, 255, 51)
 # SERVICE_COLOR = (0, 204, 204)
@@ -135,9 +153,38 @@ ID_ATTRIBUTES = {
 
 
 
+class NodeCounters(object):
+    """
+    Node statistics of a graph, updated by its nodes when they are created or changed.
+    """
+    #the attributes of the nodes the counters depend on
+    ATTRIBUTES = frozenset([ATTR_TYPE, ATTR_REAL, ATTR_PERM_LEVEL])
+    
+    def __init__(self):
+        self.types = [0] * len(NODE_TYPES)
+        self.real = 0
+        self.permission_levels = {}
+        self.protected = 0
+    
+    def add(self, node):
+        self._update(node, 1)
+    
+    def remove(self, node):
+        self._update(node, -1)
+    
+    def _update(self, node, delta):
+        self.types[node._type] += delta
+        if node._real:
+            self.real += delta
+        if node.permission_level != None:
+            self.permission_levels[node.permission_level] = self.permission_levels.get(node.permission_level, 0) + delta
+            self.protected += delta
+
+
+
 #TODO: Need to be refactored
 #There should be only node features(id, key, label, shape, color) and its attributes, which are obtained externally (nType, real, internal...)
-class NodeS:
+class NodeS(object):
 #     def __init__(self, id, key, label, shape, color, attributes):
 #         self.id = id
 #         self.key = key
@@ -158,62 +205,96 @@ class NodeS:
 #         self.attributes = attributes
         
     
-    def __init__(self, id, nType, key, label=None, real=True):
+    __slots__ = ('id', 'key', '_label', '_type', '_real', '_counters',
+                 'class_name', 'method_name', 'descriptor', 'permission_name', 'permission_level', 'dexload_filename')
+    
+    def __init__(self, id, nType, key, label=None, real=True, counters=None):
         self.id = id
         self.key = key
 #         if isinstance(key, basestring):
 #             self.key = key
 #         elif isinstance(key, tuple):
 #             self.key = "%s %s %s" % key
-        self.nType = nType
-        self.color = NODE_COLORS [nType]
-        if real:
-            self.shape = NODE_SHAPE [REAL_NODE]
-        else:
-            self.shape = NODE_SHAPE [FAKE_NODE]
-         
-         
-         
-        if label == None:
-            self.label = key
-        else:
-            self.label = label
-         
-         
-        self.attributes = {
-                           ATTR_TYPE             : self.nType,
-                           ATTR_CLASS_NAME       : None,
-                           ATTR_METHOD_NAME      : None,
-                           ATTR_DESCRIPTOR       : None,
-                           ATTR_REAL             : str(real),
-                           ATTR_PERM_NAME        : None,
-                           ATTR_PERM_LEVEL       : None,
-                           ATTR_DEXLOAD_FILENAME : None,
-                        }
-        
+        self._type = NODE_TYPE_IDS[nType]
+        self._real = bool(real)
+        
+        #the label is kept only if it differs from the key
+        if label == key:
+            label = None
+        self._label = label
+        
+        self.class_name = None
+        self.method_name = None
+        self.descriptor = None
+        self.permission_name = None
+        self.permission_level = None
+        self.dexload_filename = None
+        
+        self._counters = counters
+        if counters != None:
+            counters.add(self)
+    
+    
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+    
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+    
+    @property
+    def nType(self):
+        return NODE_TYPES[self._type]
+    
+    @property
+    def label(self):
+        if self._label != None:
+            return self._label
+        if isinstance(self.key, tuple):
+            return " ".join(self.key)
+        return self.key
+    
+    @property
+    def color(self):
+        return NODE_COLORS [self.nType]
+    
+    @property
+    def shape(self):
+        if self._real:
+            return NODE_SHAPE [REAL_NODE]
+        return NODE_SHAPE [FAKE_NODE]
+    
     
     def get_attributes(self) :
-        return self.attributes
+        return dict((name, self.get_attribute(name)) for name in GEXF_ATTRIBUTES)
 
     def get_attribute(self, name) :
-        return self.attributes[name]
+        if name == ATTR_TYPE:
+            return self.nType
+        if name == ATTR_REAL:
+            return str(self._real)
+        return getattr(self, name)
+    
     
     def get_attributes_gexf(self):
+        return "".join(self.iter_attributes_gexf())
+    
+    
+    def iter_attributes_gexf(self):
         #TODO: It would be nice to get attributes according to the node type
-        buff = ""
-        
-        buff += "<viz:color r=\"%d\" g=\"%d\" b=\"%d\"/>\n" % (self.color[0], self.color[1], self.color[2])
-        buff += "<viz:shape value=\"%s\"/>\n" % self.shape
+        yield "<viz:color r=\"%d\" g=\"%d\" b=\"%d\"/>\n" % (self.color[0], self.color[1], self.color[2])
+        yield "<viz:shape value=\"%s\"/>\n" % self.shape
         
 #         if self.attributes[ATTR_COLOR] != None : 
 #             buff += "<viz:color r=\"%d\" g=\"%d\" b=\"%d\"/>\n" % (self.attributes[ATTR_COLOR][0], self.attributes[ATTR_COLOR][1], self.attributes[ATTR_COLOR][2])
         
         
-        buff += "<attvalues>\n"
+        yield "<attvalues>\n"
         
-        for attr in self.attributes:
-            if self.attributes[attr] != None:
-                buff += "<attvalue id=\"%d\" value=\"%s\"/>\n" % (ID_ATTRIBUTES[attr], escape(self.attributes[attr]))
+        for attr in GEXF_ATTRIBUTES:
+            value = self.get_attribute(attr)
+            if value != None:
+                yield "<attvalue id=\"%d\" value=\"%s\"/>\n" % (ID_ATTRIBUTES[attr], escape(value))
 #         buff += "<attvalue id=\"%d\" value=\"%s\"/>\n" % (ID_ATTRIBUTES[ATTR_TYPE], escape(self.attributes[ATTR_TYPE]))
 #         
 #         
@@ -235,28 +316,62 @@ class NodeS:
 #         buff += "<attvalue id=\"%d\" value=\"%s\"/>\n" % (ID_ATTRIBUTES[ATTR_REAL], str(self.attributes[ATTR_REAL]))
 #         buff += "<attvalue id=\"%d\" value=\"%s\"/>\n" % (ID_ATTRIBUTES[ATTR_INTERNAL], str(self.attributes[ATTR_INTERNAL]))
         
-        buff += "</attvalues>\n"
-
-        return buff
+        yield "</attvalues>\n"
     
     
     def set_attribute(self, name, value):
-        if name not in self.attributes.keys():
-            logger.debug("There is no [%name] key in the Node attributes!" % name)
+        if name not in ID_ATTRIBUTES:
+            logger.debug("There is no [%s] key in the Node attributes!" % name)
+            return
+        
+        counted = self._counters != None and name in NodeCounters.ATTRIBUTES
+        if counted:
+            self._counters.remove(self)
         
-        self.attributes[name] = value
+        if name == ATTR_TYPE:
+            self._type = NODE_TYPE_IDS[value]
+        elif name == ATTR_REAL:
+            self._real = value == "True"
+        else:
+            #the same class names, method names and descriptors are shared by many nodes
+            if isinstance(value, str):
+                value = intern(value)
+            setattr(self, name, value)
+        
+        if counted:
+            self._counters.add(self)
 
     
 
 
 
 
+#What is kept of the androguard objects (apk, vm, vmx) of the analysed files.
+#They are not needed once the graph is built. An integer N keeps the objects
+#of the last N analysed files.
+RETAIN_NONE    = "none"
+RETAIN_SUMMARY = "summary"
+
+AnalysedFileSummary = collections.namedtuple("AnalysedFileSummary", ["package", "classes", "methods", "nodes", "edges"])
+
+
 class StadynaMcgAnalysis:
-    def __init__(self):
-        self.androGuardObjects = []
+    def __init__(self, retention=RETAIN_SUMMARY):
+        self.retention = retention
+        if isinstance(retention, int):
+            self.androGuardObjects = collections.deque(maxlen=retention)
+        else:
+            self.androGuardObjects = []
         
         self.nodes = {}
-        self.nodes_id = {}
+        #nodes by id (ids are the positions in the list)
+        self.nodes_id = []
+        #statistics, updated as the graph is built (see get_current_*)
+        self.node_counters = NodeCounters()
+        self.edge_count = 0
+        #edges in the order of their insertion, recorded only for the graphs to be merged
+        #(see recordEdgeOrder): the order of the graph dicts is lost when they are pickled
+        self.edge_order = None
         self.entry_nodes = []
         self.G = DiGraph()
         
@@ -264,28 +379,50 @@ class StadynaMcgAnalysis:
         #self.GI = DiGraph()
         
         
+    def __getstate__(self):
+        #androguard objects are neither needed nor picklable once the graph is built,
+        #so only the graph itself is sent between processes
+        state = self.__dict__.copy()
+        if isinstance(self.retention, int):
+            state['androGuardObjects'] = collections.deque(maxlen=self.retention)
+        else:
+            state['androGuardObjects'] = [i for i in self.androGuardObjects if isinstance(i, AnalysedFileSummary)]
+        return state
+    
+    
+    def recordEdgeOrder(self):
+        """
+        Records the order of the edges added from now on, so that merge adds them to
+        another graph in the same order and both graphs are exported identically.
+        """
+        self.edge_order = []
+    
+    
+    def _retainAndroGuardObjects(self, apk, vm, vmx):
+        if self.retention == RETAIN_NONE:
+            return
+        if self.retention == RETAIN_SUMMARY:
+            package = None
+            if apk != None:
+                package = apk.get_package()
+            header = vm.get_header_item()
+            self.androGuardObjects.append(AnalysedFileSummary(package, header.class_defs_size, header.method_ids_size, 
+                                                              len(self.nodes_id), self.edge_count))
+        else:
+            #the deque drops the objects of the oldest file
+            self.androGuardObjects.append((apk, vm, vmx))
+    
+    
     def analyseFile(self, vmx, apk):
         vm = vmx.get_vm()
-        self.androGuardObjects.append((apk, vm, vmx))
+        reflection_invoke_paths, reflection_newInstance_paths, dyn_code_loading = analysis.seccon_get_moi_paths(vmx)
 
 #         self.internal_methods.extend(vm.get_methods())
         
         #creating real internal nodes
         internal_called_methods = vmx.get_tainted_packages().stadyna_get_internal_called_methods()
         for method in internal_called_methods:
-            class_name, method_name, descriptor = method
-            
-            nodeType = None
-            if method_name == "<clinit>":
-                nodeType = NODE_STATIC_INIT
-            elif method_name == "<init>":
-                nodeType = NODE_CONSTRUCTOR
-            else:
-                nodeType = NODE_METHOD
-            n = self._get_node(nodeType, (class_name, method_name, descriptor))
-            n.set_attribute(ATTR_CLASS_NAME, class_name)
-            n.set_attribute(ATTR_METHOD_NAME, method_name)
-            n.set_attribute(ATTR_DESCRIPTOR, descriptor)
+            n = self._get_method_node(method)
             self.G.add_node(n.id)
             
         
@@ -306,7 +443,7 @@ class StadynaMcgAnalysis:
 #             n2.set_attribute(ATTR_CLASS_NAME, dst_class_name)
 #             n2.set_attribute(ATTR_METHOD_NAME, dst_method_name)
 #             n2.set_attribute(ATTR_DESCRIPTOR, dst_descriptor)
-            self.G.add_edge(n1.id, n2.id)
+            self._add_edge(n1.id, n2.id)
         
         
         
@@ -318,13 +455,12 @@ class StadynaMcgAnalysis:
                 n2 = self._get_node(NODE_FAKE_CLASS, src_class_name, None, False)
                 n2.set_attribute(ATTR_CLASS_NAME, src_class_name)
                 if src_method_name == "<clinit>":
-                    self.G.add_edge(n1.id, n2.id)
+                    self._add_edge(n1.id, n2.id)
                 elif src_method_name == "<init>":
-                    self.G.add_edge(n2.id, n1.id)
+                    self._add_edge(n2.id, n1.id)
                 
         
         #real (external) reflection invoke nodes    
-        reflection_invoke_paths = analysis.seccon_get_invoke_method_paths(vmx)
         for j in reflection_invoke_paths:
             src_class_name, src_method_name, src_descriptor = j.get_src( vm.get_class_manager() )
             dst_class_name, dst_method_name, dst_descriptor = j.get_dst( vm.get_class_manager() )
@@ -334,17 +470,16 @@ class StadynaMcgAnalysis:
                 logger.warning("Cannot find the node [%s], where reflection invoke is called!" % (src_class_name, src_method_name, src_descriptor))
                 continue
             
-            key = "%s %s %s %s %s %s %s" % (src_class_name, src_method_name, src_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_REFL_INVOKE)
+            key = (src_class_name, src_method_name, src_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_REFL_INVOKE)
             n2 = self._get_node(NODE_REFL_INVOKE, key, LABEL_REFL_INVOKE, True)
             n2.set_attribute(ATTR_CLASS_NAME, src_class_name)
             n2.set_attribute(ATTR_METHOD_NAME, src_method_name)
             n2.set_attribute(ATTR_DESCRIPTOR, src_descriptor)
             
-            self.G.add_edge( n1.id, n2.id )
+            self._add_edge( n1.id, n2.id )
             
         
         #real (external) reflection new instance nodes   
-        reflection_newInstance_paths = analysis.seccon_get_newInstance_method_paths(vmx)
         for j in reflection_newInstance_paths:
             src_class_name, src_method_name, src_descriptor = j.get_src( vm.get_class_manager() )
             dst_class_name, dst_method_name, dst_descriptor = j.get_dst( vm.get_class_manager() )
@@ -354,43 +489,18 @@ class StadynaMcgAnalysis:
                 logger.warning("Cannot find the node [%s], where reflection new instance is called!" % (src_class_name, src_method_name, src_descriptor))
                 continue
             
-            key = "%s %s %s %s %s %s %s" % (src_class_name, src_method_name, src_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_REFL_NEWINSTANCE)
+            key = (src_class_name, src_method_name, src_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_REFL_NEWINSTANCE)
             n2 = self._get_node(NODE_REFL_NEWINSTANCE, key, LABEL_REFL_NEWINSTANCE, True)
             n2.set_attribute(ATTR_CLASS_NAME, src_class_name)
             n2.set_attribute(ATTR_METHOD_NAME, src_method_name)
             n2.set_attribute(ATTR_DESCRIPTOR, src_descriptor)
             
-            self.G.add_edge( n1.id, n2.id )
+            self._add_edge( n1.id, n2.id )
         
         
         #adding fake entry points
         if apk != None:
-            for i in apk.get_activities() :
-                j = bytecode.FormatClassToJava(i)
-                n1 = self._get_existed_node((j, "onCreate", "(Landroid/os/Bundle;)V"))
-                if n1 != None: 
-                    key = "%s %s %s %s" % (j, "onCreate", "(Landroid/os/Bundle;)V", POSTFIX_ACTIVITY)
-                    n2 = self._get_node(NODE_FAKE_ACTIVITY, key, LABEL_ACTIVITY, False)
-                    self.G.add_edge( n2.id, n1.id )
-                    self.entry_nodes.append( n1.id )
-                    
-            for i in apk.get_services() :
-                j = bytecode.FormatClassToJava(i)
-                n1 = self._get_existed_node( (j, "onCreate", "()V") )
-                if n1 != None : 
-                    key = "%s %s %s %s" % (j, "onCreate", "()V", POSTFIX_SERVICE)
-                    n2 = self._get_node(NODE_FAKE_SERVICE, key, LABEL_SERVICE, False)
-                    self.G.add_edge( n2.id, n1.id )
-                    self.entry_nodes.append( n1.id )
-            
-            for i in apk.get_receivers() :
-                j = bytecode.FormatClassToJava(i)
-                n1 = self._get_existed_node( (j, "onReceive", "(Landroid/content/Context;Landroid/content/Intent;)V") )
-                if n1 != None : 
-                    key = "%s %s %s %s" % (j, "onReceive", "(Landroid/content/Context;Landroid/content/Intent;)V", POSTFIX_RECEIVER)
-                    n2 = self._get_node(NODE_FAKE_SERVICE, key, LABEL_RECEIVER, False)
-                    self.G.add_edge( n2.id, n1.id )
-                    self.entry_nodes.append( n1.id )
+            self.addEntryPoints(apk)
 
         
         #fake permissions
@@ -409,7 +519,7 @@ class StadynaMcgAnalysis:
                     continue
                 
                 #SOURCE, DEST, POSTFIX, PERMISSION_NAME
-                key = "%s %s %s %s %s %s %s %s" %  (src_class_name, src_method_name, src_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_PERM, x)
+                key = (src_class_name, src_method_name, src_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_PERM, x)
                 n2 = self._get_node(NODE_FAKE_PERMISSION, key, x, False)
                 n2.set_attribute(ATTR_CLASS_NAME, dst_class_name)
                 n2.set_attribute(ATTR_METHOD_NAME, dst_method_name)
@@ -417,11 +527,10 @@ class StadynaMcgAnalysis:
                 n2.set_attribute(ATTR_PERM_NAME, x)
                 n2.set_attribute(ATTR_PERM_LEVEL, MANIFEST_PERMISSIONS[ x ][0])
                 
-                self.G.add_edge(n1.id, n2.id)
+                self._add_edge(n1.id, n2.id)
                                 
 
         #fake DexClassLoader nodes
-        dyn_code_loading = analysis.seccon_get_dyncode_loading_paths(vmx)
         for j in dyn_code_loading:
             src_class_name, src_method_name, src_descriptor = j.get_src( vm.get_class_manager() )
             dst_class_name, dst_method_name, dst_descriptor = j.get_dst( vm.get_class_manager() )
@@ -431,49 +540,133 @@ class StadynaMcgAnalysis:
                 logger.warning("Cannot find dexload node [%s]!" % (src_class_name, src_method_name, src_descriptor))
                 continue
             
-            key = "%s %s %s %s %s %s %s" % (src_class_name, src_method_name, src_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_DEXLOAD)
+            key = (src_class_name, src_method_name, src_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_DEXLOAD)
             n2 = self._get_node(NODE_FAKE_DEXLOAD, key, LABEL_DEXLOAD, False)
             n2.set_attribute(ATTR_CLASS_NAME, src_class_name)
             n2.set_attribute(ATTR_METHOD_NAME, src_method_name)
             n2.set_attribute(ATTR_DESCRIPTOR, src_descriptor)
             
-            self.G.add_edge( n1.id, n2.id )
+            self._add_edge( n1.id, n2.id )
         
         
         
         # Specific Java/Android library
+        threadClasses = set(vm.get_classes_by_superclass("Ljava/lang/Thread;") + vm.get_classes_by_superclass("Ljava/util/TimerTask;"))
         for c in vm.get_classes():
             #if c.get_superclassname() == "Landroid/app/Service;" :
             #    n1 = self._get_node( c.get_name(), "<init>", "()V" )
             #    n2 = self._get_node( c.get_name(), "onCreate", "()V" )
 
             #    self.G.add_edge( n1.id, n2.id )
-            if c.get_superclassname() == "Ljava/lang/Thread;" or c.get_superclassname() == "Ljava/util/TimerTask;" :
-                for i in vm.get_method("run") :
-                    if i.get_class_name() == c.get_name() :
-                        n1 = self._get_node(NODE_METHOD, (i.get_class_name(), i.get_name(), i.get_descriptor()))
-                        n2 = self._get_node(NODE_METHOD, (i.get_class_name(), "start", i.get_descriptor())) 
-                       
-                        # link from start to run
-                        self.G.add_edge( n2.id, n1.id )
-                        #n2.add_edge( n1, {} )
-
-                        # link from init to start
-                        for init in vm.get_method("<init>") :
-                            if init.get_class_name() == c.get_name():
-                                #TODO: Leaving _get_existed_node to check if all the nodes are included
-                                #It is possible that internal_packages does not contain this node. Leaving _get_existed_node to check this
-                                n3 = self._get_node(NODE_CONSTRUCTOR, (init.get_class_name(), "<init>", init.get_descriptor()))
-                                self.G.add_edge( n3.id, n2.id )
-                                #n3.add_edge( n2, {} )
-        
+            if c in threadClasses:
+                for i in vm.get_methods_descriptor(c.get_name(), "run"):
+                    n1 = self._get_node(NODE_METHOD, (i.get_class_name(), i.get_name(), i.get_descriptor()))
+                    n2 = self._get_node(NODE_METHOD, (i.get_class_name(), "start", i.get_descriptor())) 
+                   
+                    # link from start to run
+                    self._add_edge( n2.id, n1.id )
+                    #n2.add_edge( n1, {} )
+
+                    # link from init to start
+                    for init in vm.get_methods_descriptor(c.get_name(), "<init>"):
+                        #TODO: Leaving _get_existed_node to check if all the nodes are included
+                        #It is possible that internal_packages does not contain this node. Leaving _get_existed_node to check this
+                        n3 = self._get_node(NODE_CONSTRUCTOR, (init.get_class_name(), "<init>", init.get_descriptor()))
+                        self._add_edge( n3.id, n2.id )
+                        #n3.add_edge( n2, {} )
+        
+        self._retainAndroGuardObjects(apk, vm, vmx)
                         
                         
+    def addEntryPoints(self, apk):
+        for i in apk.get_activities() :
+            j = bytecode.FormatClassToJava(i)
+            n1 = self._get_existed_node((j, "onCreate", "(Landroid/os/Bundle;)V"))
+            if n1 != None: 
+                key = (j, "onCreate", "(Landroid/os/Bundle;)V", POSTFIX_ACTIVITY)
+                n2 = self._get_node(NODE_FAKE_ACTIVITY, key, LABEL_ACTIVITY, False)
+                self._add_edge( n2.id, n1.id )
+                self.entry_nodes.append( n1.id )
+                
+        for i in apk.get_services() :
+            j = bytecode.FormatClassToJava(i)
+            n1 = self._get_existed_node( (j, "onCreate", "()V") )
+            if n1 != None : 
+                key = (j, "onCreate", "()V", POSTFIX_SERVICE)
+                n2 = self._get_node(NODE_FAKE_SERVICE, key, LABEL_SERVICE, False)
+                self._add_edge( n2.id, n1.id )
+                self.entry_nodes.append( n1.id )
+        
+        for i in apk.get_receivers() :
+            j = bytecode.FormatClassToJava(i)
+            n1 = self._get_existed_node( (j, "onReceive", "(Landroid/content/Context;Landroid/content/Intent;)V") )
+            if n1 != None : 
+                key = (j, "onReceive", "(Landroid/content/Context;Landroid/content/Intent;)V", POSTFIX_RECEIVER)
+                n2 = self._get_node(NODE_FAKE_SERVICE, key, LABEL_RECEIVER, False)
+                self._add_edge( n2.id, n1.id )
+                self.entry_nodes.append( n1.id )
+
+
+    def merge(self, mcg):
+        """
+        Adds the nodes and the edges of another graph (e.g., built for another dex file
+        of the same application) to this one. The nodes are matched by their keys.
+        """
+        ids = {}
+        for old_node in mcg.nodes_id:
+            n = self._get_node(old_node.nType, old_node.key, old_node._label, old_node.get_attribute(ATTR_REAL) == "True")
+            for name, value in old_node.get_attributes().items():
+                if value != None and n.get_attribute(name) == None:
+                    n.set_attribute(name, value)
+            ids[old_node.id] = n.id
+        
+        for node in mcg.G.nodes():
+            self.G.add_node(ids[node])
+        edges = mcg.edge_order
+        if edges == None:
+            edges = mcg.G.edges()
+        for src, dst in edges:
+            self._add_edge(ids[src], ids[dst])
+        self.entry_nodes.extend(ids[i] for i in mcg.entry_nodes)
+        if self.retention == RETAIN_SUMMARY:
+            self.androGuardObjects.extend(i for i in mcg.androGuardObjects if isinstance(i, AnalysedFileSummary))
+        elif isinstance(self.retention, int):
+            self.androGuardObjects.extend(i for i in mcg.androGuardObjects if not isinstance(i, AnalysedFileSummary))
+    
+    
+    def addCrossDexCalls(self, calls, classes):
+        """
+        Adds the edges of the calls, which are external for the dex file of the caller,
+        to the methods of the classes defined in the other dex files of the application.
+        
+        :param calls: a list of (src, dst) method triples
+        :param classes: a set of the class names of all dex files of the application
+        """
+        for src, dst in calls:
+            dst_class_name, dst_method_name, _ = dst
+            if dst_class_name not in classes:
+                continue
+            
+            n1 = self._get_existed_node(src)
+            if n1 == None:
+                continue
+            n2 = self._get_method_node(dst)
+            self._add_edge(n1.id, n2.id)
+            
+            if dst_method_name == "<init>" or dst_method_name == "<clinit>":
+                n_class = self._get_node(NODE_FAKE_CLASS, dst_class_name, None, False)
+                n_class.set_attribute(ATTR_CLASS_NAME, dst_class_name)
+                if dst_method_name == "<clinit>":
+                    self._add_edge(n2.id, n_class.id)
+                else:
+                    self._add_edge(n_class.id, n2.id)
+
+
     def addInvokePath(self, src, through, dst):
         src_class_name, src_method_name, src_descriptor = src
         dst_class_name, dst_method_name, dst_descriptor = dst
         through_class_name, through_method_name, through_descriptor = through
-        key = "%s %s %s %s %s %s %s" % (src_class_name, src_method_name, src_descriptor, through_class_name, through_method_name, through_descriptor, POSTFIX_REFL_INVOKE)
+        key = (src_class_name, src_method_name, src_descriptor, through_class_name, through_method_name, through_descriptor, POSTFIX_REFL_INVOKE)
         n1 = self._get_existed_node(key)
         if n1 == None:
             logger.warning("Something wrong has happened! Could not find invoke Node in Graph with key [%s]" % str(key))
@@ -484,21 +677,21 @@ class StadynaMcgAnalysis:
         n2.set_attribute(ATTR_METHOD_NAME, dst_method_name)
         n2.set_attribute(ATTR_DESCRIPTOR, dst_descriptor)
         
-        self.G.add_edge(n1.id, n2.id)
+        self._add_edge(n1.id, n2.id)
         
         #check if called method calls protected feature
         data = "%s-%s-%s" % (dst_class_name, dst_method_name, dst_descriptor)
         if data in DVM_PERMISSIONS_BY_API_CALLS:
             logger.info("BINGOOOOOOO! The protected method is called through reflection!")
             perm = DVM_PERMISSIONS_BY_API_CALLS[ data ]
-            key1 = "%s %s %s %s %s %s %s %s" %  (through_class_name, through_method_name, through_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_PERM, perm)
+            key1 = (through_class_name, through_method_name, through_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_PERM, perm)
             n3 = self._get_node(NODE_FAKE_PERMISSION, key1, perm, False)
             n3.set_attribute(ATTR_CLASS_NAME, dst_class_name)
             n3.set_attribute(ATTR_METHOD_NAME, dst_method_name)
             n3.set_attribute(ATTR_DESCRIPTOR, dst_descriptor)
             n3.set_attribute(ATTR_PERM_NAME, perm)
             n3.set_attribute(ATTR_PERM_LEVEL, MANIFEST_PERMISSIONS[ perm ][0])
-            self.G.add_edge(n2.id, n3.id)
+            self._add_edge(n2.id, n3.id)
             
 
         
@@ -507,7 +700,7 @@ class StadynaMcgAnalysis:
         src_class_name, src_method_name, src_descriptor = src
         dst_class_name, dst_method_name, dst_descriptor = dst
         through_class_name, through_method_name, through_descriptor = through
-        key = "%s %s %s %s %s %s %s" % (src_class_name, src_method_name, src_descriptor, through_class_name, through_method_name, through_descriptor, POSTFIX_REFL_NEWINSTANCE)
+        key = (src_class_name, src_method_name, src_descriptor, through_class_name, through_method_name, through_descriptor, POSTFIX_REFL_NEWINSTANCE)
         n1 = self._get_existed_node(key)
         if n1 == None:
             logger.error("Something wrong has happened! Could not find Node in Graph with key [%s]" % str(key))
@@ -518,33 +711,33 @@ class StadynaMcgAnalysis:
         n2.set_attribute(ATTR_METHOD_NAME, dst_method_name)
         n2.set_attribute(ATTR_DESCRIPTOR, dst_descriptor) 
         
-        self.G.add_edge(n1.id, n2.id)
+        self._add_edge(n1.id, n2.id)
         
         #we also need to add link to the class node
         #TODO: Think in the future what to do with this
         n_class = self._get_node(NODE_FAKE_CLASS, dst_class_name, None, False)
         n_class.set_attribute(ATTR_CLASS_NAME, dst_class_name)
-        self.G.add_edge(n_class.id, n2.id)
+        self._add_edge(n_class.id, n2.id)
         
         #checking if we need to add additional permission nodes
         data = "%s-%s-%s" % (dst_class_name, dst_method_name, dst_descriptor)
         if data in DVM_PERMISSIONS_BY_API_CALLS:
             logger.info("BINGOOOOOOO! The protected method is called through reflection!")
             perm = DVM_PERMISSIONS_BY_API_CALLS[ data ]
-            key1 = "%s %s %s %s %s %s %s %s" %  (through_class_name, through_method_name, through_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_PERM, perm)
+            key1 = (through_class_name, through_method_name, through_descriptor, dst_class_name, dst_method_name, dst_descriptor, POSTFIX_PERM, perm)
             n3 = self._get_node(NODE_FAKE_PERMISSION, key1, perm, False)
             n3.set_attribute(ATTR_CLASS_NAME, dst_class_name)
             n3.set_attribute(ATTR_METHOD_NAME, dst_method_name)
             n3.set_attribute(ATTR_DESCRIPTOR, dst_descriptor)
             n3.set_attribute(ATTR_PERM_NAME, perm)
             n3.set_attribute(ATTR_PERM_LEVEL, MANIFEST_PERMISSIONS[ perm ][0])
-            self.G.add_edge(n2.id, n3.id)
+            self._add_edge(n2.id, n3.id)
         
             
     def addDexloadPath(self, src, through, filename):
         src_class_name, src_method_name, src_descriptor = src
         through_class_name, through_method_name, through_descriptor = through
-        key = "%s %s %s %s %s %s %s" % (src_class_name, src_method_name, src_descriptor,  through_class_name, through_method_name, through_descriptor, POSTFIX_DEXLOAD)
+        key = (src_class_name, src_method_name, src_descriptor,  through_class_name, through_method_name, through_descriptor, POSTFIX_DEXLOAD)
         n1 = self._get_existed_node(key)
         if n1 == None:
             logger.error("Something wrong has happened! Could not find Node in Graph with key [%s]" % str(key))
@@ -553,43 +746,77 @@ class StadynaMcgAnalysis:
         n2 = self._get_node(NODE_FAKE_DEXLOAD_FILE, filename, filename, False)
         n2.set_attribute(ATTR_DEXLOAD_FILENAME, filename)
         
-        self.G.add_edge(n1.id, n2.id)
+        self._add_edge(n1.id, n2.id)
         
     
 
-    def _get_node(self, nType, key, label=None, real=True):
-        node_key = None
-        if isinstance(key, basestring):
-            node_key = key
-        elif isinstance(key, tuple):
-            node_key = "%s %s %s" % key
-        else:
-            logger.error("Unknown instance type of key!!!")
-        
-        if node_key not in self.nodes.keys():
-            new_node = NodeS(len(self.nodes), nType, node_key, label, real)
-            self.nodes[node_key] = new_node
-            self.nodes_id[new_node.id] = new_node
+    def _get_method_node(self, method):
+        class_name, method_name, descriptor = method
         
-        return self.nodes[node_key]
+        nodeType = None
+        if method_name == "<clinit>":
+            nodeType = NODE_STATIC_INIT
+        elif method_name == "<init>":
+            nodeType = NODE_CONSTRUCTOR
+        else:
+            nodeType = NODE_METHOD
+        n = self._get_node(nodeType, (class_name, method_name, descriptor))
+        n.set_attribute(ATTR_CLASS_NAME, class_name)
+        n.set_attribute(ATTR_METHOD_NAME, method_name)
+        n.set_attribute(ATTR_DESCRIPTOR, descriptor)
+        return n
+    
+    
+    def _get_node(self, nType, key, label=None, real=True):
+        """
+        :param key: a (class name, method name, descriptor) tuple for the method nodes,
+            a tuple or a string for the other nodes
+        """
+        try:
+            return self.nodes[key]
+        except KeyError:
+            pass
+        
+        #the nodes table is the only place where the keys are kept, 
+        #their strings are shared with the attributes of the nodes
+        if isinstance(key, tuple):
+            key = tuple(intern(i) if isinstance(i, str) else i for i in key)
+        new_node = NodeS(len(self.nodes_id), nType, key, label, real, self.node_counters)
+        self.nodes[key] = new_node
+        self.nodes_id.append(new_node)
+        return new_node
+    
+    
+    def _add_edge(self, src, dst):
+        if not self.G.has_edge(src, dst):
+            self.edge_count += 1
+            if self.edge_order != None:
+                self.edge_order.append((src, dst))
+        self.G.add_edge(src, dst)
     
     
     def _get_existed_node(self, key):
-        node_key = None
-        if isinstance(key, basestring):
-            node_key = key
-        elif isinstance(key, tuple):
-            node_key = "%s %s %s" % key
-        else:
-            logger.error("Unknown instance type of key!!!")
-        
         try:
-            return self.nodes[node_key]
+            return self.nodes[key]
         except KeyError:
-            logger.error("Could not find existed node [%s]!" % node_key)
+            logger.error("Could not find existed node [%s]!" % str(key))
             return None
 
     def export_to_gexf(self) :
+        return "".join(self.iter_gexf())
+    
+    
+    def write_gexf(self, fd):
+        """
+        Writes the gexf document to a file object piece by piece, without building it in memory.
+        """
+        fd.writelines(self.iter_gexf())
+    
+    
+    def iter_gexf(self):
+        """
+        Generates the gexf document of the graph as a sequence of strings.
+        """
         buff = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n"
         buff += "<gexf xmlns=\"http://www.gephi.org/gexf\" xmlns:viz=\"http://www.gephi.org/gexf/viz\">\n"
         buff += "<graph type=\"static\">\n"
@@ -620,50 +847,42 @@ class StadynaMcgAnalysis:
 #         buff += "</attributes>\n"   
 
         buff += "<nodes>\n"
-        for node in self.G.nodes() :
-            buff += "<node id=\"%d\" label=\"%s\">\n" % (node, escape(self.nodes_id[ node ].label))
-            buff += self.nodes_id[ node ].get_attributes_gexf()
-            buff += "</node>\n"
-        buff += "</nodes>\n"
+        yield buff
+        
+        for node in self.G.nodes_iter() :
+            yield "<node id=\"%d\" label=\"%s\">\n" % (node, escape(self.nodes_id[ node ].label))
+            for attr in self.nodes_id[ node ].iter_attributes_gexf() :
+                yield attr
+            yield "</node>\n"
+        yield "</nodes>\n"
 
 
-        buff += "<edges>\n"
+        yield "<edges>\n"
         nb = 0
-        for edge in self.G.edges() :
-            buff += "<edge id=\"%d\" source=\"%d\" target=\"%d\"/>\n" % (nb, edge[0], edge[1])
+        for edge in self.G.edges_iter() :
+            yield "<edge id=\"%d\" source=\"%d\" target=\"%d\"/>\n" % (nb, edge[0], edge[1])
             nb += 1
-        buff += "</edges>\n"
+        yield "</edges>\n"
 
 
-        buff += "</graph>\n"
-        buff += "</gexf>\n"
-
-        return buff
+        yield "</graph>\n"
+        yield "</gexf>\n"
   
     
     def get_current_real_node_count(self):
-        count = 0
-        for node in self.nodes_id.keys():
-            if self.nodes_id[node].get_attribute(ATTR_REAL) == "True":
-                count += 1
-        return count
+        return self.node_counters.real
 
     def get_current_node_count(self):
-        return len(self.G.nodes())
+        return self.G.number_of_nodes()
     
     def get_current_edge_count(self):
-        return len(self.G.edges())
+        return self.edge_count
+    
+    def get_current_node_type_count(self, nType):
+        return self.node_counters.types[NODE_TYPE_IDS[nType]]
     
     def get_current_permission_level_node_count(self, permission_level):
-        count = 0
-        for node in self.nodes_id.keys():
-            if self.nodes_id[node].get_attribute(ATTR_PERM_LEVEL) == permission_level:
-                count += 1
-        return count
+        return self.node_counters.permission_levels.get(permission_level, 0)
     
     def get_current_protected_node_count(self):
-        count = 0
-        for node in self.nodes_id.keys():
-            if self.nodes_id[node].get_attribute(ATTR_PERM_LEVEL) != None:
-                count += 1
-        return count
\ No newline at end of file
+        return self.node_counters.protected
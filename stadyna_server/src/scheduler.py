@@ -0,0 +1,335 @@
+ # Copyright (C) 2013-2015 StaDynA
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License");
+ # you may not use this file except in compliance with the License.
+ # You may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ # See the License for the specific language governing permissions and
+ # limitations under the License.
+ #
+ # Author(s): Yury Zhauniarovich
+
+"""
+Analysis of APK corpora on a pool of devices.
+
+Every attached device gets its own worker thread that takes the next APK from
+a shared queue and runs the whole pipeline (SecconMessageProducer and
+StadynaAnalyser) for it. The pipeline itself is passed as a callable, so the
+scheduler can be driven by any object that looks like a Device. APKs may be
+supplied lazily (e.g., as the static phase finishes them), the workers wait
+for new ones until the input is exhausted.
+"""
+
+import os
+import time
+import Queue
+import threading
+import collections
+from device import Device
+from logconfig import logger
+from androguard.core import androconf
+
+#Returned by the queue to the workers when there are no more APKs to analyse
+NO_MORE_APKS = None
+
+
+def getAttachedDevices():
+    return [Device.get_device(name) for name in Device.get_devices_list()]
+
+
+def listCorpusApks(corpusPath):
+    '''
+    Returns the list of APK files in a corpus. The corpus is either a directory
+    (searched recursively) or a manifest file with one path per line. Relative
+    paths in a manifest are resolved against the directory of the manifest.
+    Empty lines and lines starting with '#' are ignored.
+    '''
+    apks = []
+    if os.path.isdir(corpusPath):
+        for root, dirs, files in os.walk(corpusPath):
+            #the order (and so the names of the result directories) does not depend on the file system
+            dirs.sort()
+            for f in sorted(files):
+                path = os.path.join(root, f)
+                if androconf.is_android(path) == "APK":
+                    apks.append(path)
+        return apks
+
+    manifestDir = os.path.dirname(os.path.abspath(corpusPath))
+    listed = set()
+    with open(corpusPath, 'r') as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path = os.path.normpath(os.path.join(manifestDir, line))
+            if path in listed:
+                logger.warning("Manifest entry [%s] is listed several times! Skipping it!" % path)
+                continue
+            if androconf.is_android(path) != "APK":
+                logger.warning("Manifest entry [%s] is not an APK file! Skipping it!" % path)
+                continue
+            listed.add(path)
+            apks.append(path)
+    return apks
+
+
+def getCorpusApkNames(apkPaths):
+    '''
+    Returns the names of the result directories of the APK files of a corpus
+    (key = APK path; value = name). The name is the file name without the
+    extension; APK files with the same file name in different directories get
+    a numeric suffix, so that their analyses never share a directory.
+    '''
+    names = {}
+    used = set()
+    for path in apkPaths:
+        apkFileName, _ = os.path.splitext(os.path.basename(path))
+        name = apkFileName
+        suffix = 1
+        while name in used:
+            suffix += 1
+            name = "%s_%d" % (apkFileName, suffix)
+        if name != apkFileName:
+            logger.warning("The name of [%s] is already used in the corpus! Its results are saved in [%s]!" % (path, name))
+        used.add(name)
+        names[path] = name
+    return names
+
+
+
+class ApkQueue:
+    '''
+    Queue of the APK files shared by the device workers. An APK taken by a
+    worker whose device is not alive is put back at the head of the queue, and
+    the other workers do not stop while such an APK may still be returned.
+    '''
+    def __init__(self):
+        self._apks = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        #APKs taken by the workers, which have not started their analysis yet
+        self._taken = 0
+
+
+    def put(self, apkPath):
+        with self._cond:
+            self._apks.append(apkPath)
+            self._cond.notify()
+
+
+    def close(self):
+        '''No more APKs will be put into the queue'''
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+    def get(self, timeout):
+        '''
+        Returns the next APK or NO_MORE_APKS if the queue is closed and empty.
+        Raises Queue.Empty if there is no APK within the timeout.
+        '''
+        deadline = time.time() + timeout
+        with self._cond:
+            while not self._apks:
+                if self._closed and self._taken == 0:
+                    return NO_MORE_APKS
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise Queue.Empty
+                self._cond.wait(remaining)
+            self._taken += 1
+            return self._apks.popleft()
+
+
+    def put_back(self, apkPath):
+        with self._cond:
+            self._taken -= 1
+            self._apks.appendleft(apkPath)
+            self._cond.notify()
+
+
+    def task_started(self):
+        '''The last APK taken by a worker will not be put back'''
+        with self._cond:
+            self._taken -= 1
+            if self._closed and self._taken == 0:
+                self._cond.notify_all()
+
+
+
+class DeviceStats:
+    def __init__(self, device_name):
+        self.device_name = device_name
+        self.analysed = 0
+        self.failed = 0
+        self.busy_time = 0.0
+
+    def add(self, succeeded, duration):
+        if succeeded:
+            self.analysed += 1
+        else:
+            self.failed += 1
+        self.busy_time += duration
+
+    def get_processed(self):
+        return self.analysed + self.failed
+
+    def get_throughput(self, elapsed):
+        '''Number of processed APKs per hour'''
+        if elapsed <= 0:
+            return 0.0
+        return 3600.0 * self.get_processed() / elapsed
+
+
+
+class DeviceWorker(threading.Thread):
+    def __init__(self, device, apks, analyse, scheduler):
+        assert isinstance(apks, ApkQueue)
+        threading.Thread.__init__(self)
+        self._device = device
+        self._apks = apks
+        self._analyse = analyse
+        self._scheduler = scheduler
+        self.stats = DeviceStats(device.device_name)
+
+
+    def run(self):
+        while not self._scheduler.is_stopped():
+            try:
+                apkPath = self._apks.get(1)
+            except Queue.Empty:
+                continue
+            if apkPath is NO_MORE_APKS:
+                break
+
+            if not self._device.is_alive():
+                logger.error("Device [%s] is not alive! Returning [%s] to the queue and stopping its worker!" % (self._device.device_name, apkPath))
+                self._apks.put_back(apkPath)
+                break
+            self._apks.task_started()
+
+            logger.info("Device [%s] starts the analysis of [%s]..." % (self._device.device_name, apkPath))
+            startTime = time.time()
+            succeeded = False
+            try:
+                succeeded = bool(self._analyse(self._device, apkPath))
+            except Exception as e:
+                logger.exception(e)
+                logger.error("The analysis of [%s] on device [%s] has failed!" % (apkPath, self._device.device_name))
+            duration = time.time() - startTime
+            self.stats.add(succeeded, duration)
+            logger.info("Device [%s] has finished [%s] in [%.2f] seconds!" % (self._device.device_name, apkPath, duration))
+
+
+
+class AnalysisScheduler:
+    '''
+    Keeps all given devices busy with the analysis of the APKs from a corpus.
+
+    :param devices: objects with the interface of :class:`device.Device`
+    :param analyse: callable(device, apkPath) returning True if the analysis succeeded
+    '''
+    def __init__(self, devices, analyse):
+        self._devices = devices
+        self._analyse = analyse
+        self._stopped = threading.Event()
+        self._workers = []
+        self._elapsed = 0.0
+        self._total = 0
+
+
+    def is_stopped(self):
+        return self._stopped.is_set()
+
+
+    def stop(self):
+        '''Workers finish the current APK and do not take new ones'''
+        self._stopped.set()
+
+
+    def _feed(self, apkPaths, apks):
+        try:
+            for apkPath in apkPaths:
+                if self.is_stopped():
+                    break
+                apks.put(apkPath)
+                self._total += 1
+        except Exception as e:
+            logger.exception(e)
+            logger.error("Could not get the next APK file to analyse! No more APK files will be scheduled!")
+        finally:
+            apks.close()
+
+
+    def run(self, apkPaths):
+        '''
+        :param apkPaths: an iterable (possibly a generator) of the APK files to analyse
+        '''
+        apks = ApkQueue()
+        self._total = 0
+
+        startTime = time.time()
+        self._workers = [DeviceWorker(dev, apks, self._analyse, self) for dev in self._devices]
+        feeder = threading.Thread(target=self._feed, args=(apkPaths, apks))
+        feeder.setDaemon(True)
+        feeder.start()
+        for worker in self._workers:
+            worker.setDaemon(True)
+            worker.start()
+
+        #joining with timeout keeps the main thread responsive to Ctrl+C
+        try:
+            while any(worker.is_alive() for worker in self._workers):
+                for worker in self._workers:
+                    worker.join(1)
+        except KeyboardInterrupt:
+            logger.info("Stopping the scheduler! Waiting for the running analyses to finish...")
+            self.stop()
+            for worker in self._workers:
+                while worker.is_alive():
+                    worker.join(1)
+        self._elapsed = time.time() - startTime
+
+        notAnalysed = self._total - sum(stats.get_processed() for stats in self.get_stats())
+        if notAnalysed > 0:
+            logger.warning("[%d] APK files have not been analysed!" % notAnalysed)
+        return self.get_stats()
+
+
+    def get_stats(self):
+        return [worker.stats for worker in self._workers]
+
+
+    def get_report(self):
+        buff = ""
+        buff += "=============================================\n"
+        buff += "Number of APK files scheduled for devices: \t%d\n" % self._total
+        buff += "Number of devices: \t%d\n" % len(self._workers)
+        buff += "Elapsed time (s): \t%.2f\n" % self._elapsed
+        buff += "=============================================\n"
+
+        analysed = 0
+        failed = 0
+        for stats in self.get_stats():
+            analysed += stats.analysed
+            failed += stats.failed
+            buff += "Device [%s]:\n" % stats.device_name
+            buff += "\tanalysed: \t%d\n" % stats.analysed
+            buff += "\tfailed: \t%d\n" % stats.failed
+            buff += "\tbusy time (s): \t%.2f\n" % stats.busy_time
+            buff += "\tthroughput (APK/h): \t%.2f\n" % stats.get_throughput(self._elapsed)
+
+        buff += "=============================================\n"
+        buff += "Total analysed: \t%d\n" % analysed
+        buff += "Total failed: \t%d\n" % failed
+        if self._elapsed > 0:
+            buff += "Aggregate throughput (APK/h): \t%.2f\n" % (3600.0 * (analysed + failed) / self._elapsed)
+        buff += "=============================================\n"
+        return buff
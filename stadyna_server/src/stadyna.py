@@ -20,16 +20,20 @@ MOI - methods of interest
 
 import sys, os, shutil
 import json
+import signal
+import multiprocessing
 import consts
 import Queue
 import utils
 import time
-from androguard.core import androconf
-from messages import SecconMessageProducer
+from androguard.core import androconf, bytecode
+from messages import SecconMessageProducer, END_OF_MESSAGES, getMessageBatch
 from device import Device
 from optparse import OptionParser
 from logconfig import logger
-from stadyna_analyser import StadynaAnalyser
+import method_call_graph
+from stadyna_analyser import StadynaAnalyser, triageFile
+from scheduler import AnalysisScheduler, getAttachedDevices, listCorpusApks, getCorpusApkNames
 
 from androguard.core.bytecodes import apk
 
@@ -37,7 +41,22 @@ script_usage = "Usage: %prog apk_file_name [options]"
 
 option_0 = {'name': ('-o', '--outdir'), 'dest': 'outputDir', 'help': 'directory with all files related to the analysis', 'type': 'string', 'nargs' : 1}
 option_1 = {'name' : ('-i', '--inputApk'), 'dest': 'inputApk', 'help' : 'path to the file with results of processing', 'type': 'string', 'nargs' : 1}
-options = [option_0, option_1]
+option_2 = {'name' : ('-c', '--corpus'), 'dest': 'corpus', 'help' : 'directory with apk files or a file listing them (one per line) to analyse on all attached devices', 'type': 'string', 'nargs' : 1}
+option_3 = {'name' : ('-t', '--timeout'), 'dest': 'timeout', 'help' : 'time (in seconds) of dynamic analysis of each apk file in corpus mode', 'type': 'int', 'nargs' : 1, 'default' : 300}
+option_4 = {'name' : ('-j', '--jobs'), 'dest': 'jobs', 'help' : 'number of processes for static analysis: of the apk files in corpus mode, of the dex files of a multidex apk otherwise (default: number of cores)', 'type': 'int', 'nargs' : 1}
+option_5 = {'name' : ('-l', '--lazy'), 'dest': 'lazy', 'help' : 'parse the classes and the code of dex files only when the analysis needs them', 'action' : 'store_true', 'default' : False}
+option_6 = {'name' : ('-n', '--native'), 'dest': 'native', 'help' : 'decode the bytecode for the call graph with the native engine (androguard/core/bytecodes/libdvm) if it is built', 'action' : 'store_true', 'default' : False}
+option_7 = {'name' : ('-z', '--gzip'), 'dest': 'gzip', 'help' : 'save the graphs compressed (.gexf.gz)', 'action' : 'store_true', 'default' : False}
+option_8 = {'name' : ('-r', '--retain'), 'dest': 'retain', 'help' : 'what is kept of the androguard objects of the analysed files: none, summary or the number of the last files to keep (default: summary)', 'type': 'string', 'nargs' : 1, 'default' : 'summary'}
+option_9 = {'name' : ('-k', '--cache'), 'dest': 'cache', 'help' : 'directory of the persistent cache of the static analysis of the apk and dex files (the files taken from the cache are not parsed, so no androguard objects are retained for them)', 'type': 'string', 'nargs' : 1}
+option_10 = {'name' : ('-s', '--cache-size'), 'dest': 'cacheSize', 'help' : 'maximum size (in MB) of the cache directory (default: 1024)', 'type': 'int', 'nargs' : 1, 'default' : 1024}
+options = [option_0, option_1, option_2, option_3, option_4, option_5, option_6, option_7, option_8, option_9, option_10]
+
+#results of the static phase in corpus mode
+STATIC_FAILED  = "failed"
+STATIC_TRIAGED = "triaged"
+STATIC_ONLY    = "static_only"
+NEEDS_DEVICE   = "needs_device"
 
 
 
@@ -216,38 +235,94 @@ def startMainActivity(device, package, mainActivity):
     
 
 
-def perform_analysis(inputApkPath, resultsDirPath, sourceFilesDirPath):    
-    logger.debug("Starting analysis of the application [%s]..." % inputApkPath)
-    startTime = time.time()
-    
+def processMessages(messages, uid, device, filesDir, stadynaAnalyser, analysisTimeout=None):
+    #Blocks on the queue with a timeout instead of sleeping, so that messages
+    #are processed as soon as they arrive and Ctrl+C is still handled.
+    deadline = None
+    if analysisTimeout != None:
+        deadline = time.time() + analysisTimeout
+    finished = False
+    while not finished:
+        if deadline != None and time.time() >= deadline:
+            logger.info("The time for the analysis is over!")
+            break
+        try:
+            batch = getMessageBatch(messages)
+            analysed = False
+            for line in batch:
+                if line is END_OF_MESSAGES:
+                    logger.info("The producer has stopped reading messages!")
+                    finished = True
+                    break
+                #print 'Received line: ' + repr(line)
+                decodedLine = json.loads(line)
+                if int(decodedLine.get(consts.JSON_UID)) != uid:
+                    continue
+                analyseStadynaMsg(device, filesDir, stadynaAnalyser, decodedLine)
+                analysed = True
+            
+            if analysed:
+                stadynaAnalyser.printMoiLists()
+            #The same method can be used for different calls. Thus, we comment this line now )
+            #checkExit(stadynaAnalyser)
+        except KeyboardInterrupt:
+            logger.debug("Exiting...")  
+            break
+
+
+
+def perform_static_analysis(inputApkPath, resultsDirPath, sourceFilesDirPath, **analyserOptions):
+    logger.debug("Starting static analysis of the application [%s]..." % inputApkPath)
     if not copyFileToDir(inputApkPath, sourceFilesDirPath):
         logger.error("Could not copy source file to directory! The analysis was not performed!")
-        return
+        return None
     
     apkFileNameExt = os.path.basename(inputApkPath)
     apkFileName, _ = os.path.splitext(apkFileNameExt)
     apkFilePath = os.path.join(sourceFilesDirPath, apkFileNameExt)
     
-    stadynaAnalyser = StadynaAnalyser()
+    stadynaAnalyser = StadynaAnalyser(**analyserOptions)
     stadynaAnalyser.makeInitialAnalysis(apkFilePath)
     
     initial_name = apkFileName + "_initial"
     stadynaAnalyser.saveGexf(resultsDirPath, initial_name)
+    return stadynaAnalyser
+
+
+
+def perform_triaged_analysis(inputApkPath, resultsDirPath, sourceFilesDirPath, **analyserOptions):
+    logger.debug("Saving the report of the application [%s] without MOI..." % inputApkPath)
+    startTime = time.time()
+    if not copyFileToDir(inputApkPath, sourceFilesDirPath):
+        logger.error("Could not copy source file to directory! The analysis was not performed!")
+        return False
     
-    if not stadynaAnalyser.containMethodsToAnalyse():
-        logger.info("Input apk file does not contain suspicious methods!")
-        stadynaAnalyser.performInfoSave(resultsDirPath, apkFileName)
-        logger.info("The analysis is finished!")
-        return
+    apkFileNameExt = os.path.basename(inputApkPath)
+    apkFileName, _ = os.path.splitext(apkFileNameExt)
+    apkFilePath = os.path.join(sourceFilesDirPath, apkFileNameExt)
+    
+    stadynaAnalyser = StadynaAnalyser(**analyserOptions)
+    stadynaAnalyser.makeTriagedAnalysis(apkFilePath)
+    stadynaAnalyser.performFinalInfoSave(resultsDirPath, apkFileName, (time.time()-startTime))
+    return True
+
+
+
+def perform_dynamic_analysis(stadynaAnalyser, inputApkPath, resultsDirPath, sourceFilesDirPath, dev=None, analysisTimeout=None, elapsedTime=0,
+                             uninstall=False):
+    logger.debug("Starting dynamic analysis of the application [%s]..." % inputApkPath)
+    startTime = time.time() - elapsedTime
+    apkFileName, _ = os.path.splitext(os.path.basename(inputApkPath))
     
     stadynaAnalyser.printMoiLists()
     
-    dev = getDeviceForDynAnalysis()
-    if not dev.is_alive():
+    if dev == None:
+        dev = getDeviceForDynAnalysis()
+    if dev == None or not dev.is_alive():
         logger.warning("The selected device to perform dynamic analysis is not alive! Finishing!")
-        stadynaAnalyser.performInfoSave(resultsDirPath, apkFileName)
+        stadynaAnalyser.performFinalInfoSave(resultsDirPath, apkFileName, (time.time()-startTime))
         logger.info("The analysis is finished!")
-        return
+        return False
     
     #TODO: Check if it is possible racing conditions here
     #If we at first install application and then run Message analyser
@@ -255,56 +330,192 @@ def perform_analysis(inputApkPath, resultsDirPath, sourceFilesDirPath):
     #If we at first start Message analyser and then start the application
     #the first dex load is actual load when the application is installed. 
     
-    androApk = apk.APK(inputApkPath)
+    androApk = apk.APK(bytecode.mmap_file(inputApkPath), raw=True)
     installed = dev.install_package(inputApkPath)
     if not installed:
         logger.error("An error occurred during the installation of the app [%s]! Cannot perform an analysis!" % inputApkPath)
-        return
+        return False
     
     package = androApk.get_package()
     mainActivity = androApk.get_main_activity() 
-    uid = dev.get_package_uid(package)
-    if uid == -1:
-        logger.error("Cannot get the uid of the package [%s]! Cannot start an analysis!" % package)
-        return
-    
-    #TODO: test section
-    messages = Queue.Queue()
-    seccon_producer = SecconMessageProducer(dev, messages)
-    seccon_producer.setDaemon(False)
-    seccon_producer.start()
-    
-    #sleeping 3sec before starting new activity 
-    time.sleep(3)
-    
-    #Add here the invocation of the main activity
-    startMainActivity(dev, package, mainActivity) 
-    
-    while 1:
-        while not messages.empty():
-            line = messages.get()
-            #print 'Received line: ' + repr(line)
-            decodedLine = json.loads(line)
-            if int(decodedLine.get(consts.JSON_UID)) != uid:
-                continue
-            analyseStadynaMsg(dev, sourceFilesDirPath, stadynaAnalyser, decodedLine)
-            stadynaAnalyser.printMoiLists()
+    try:
+        uid = dev.get_package_uid(package)
+        if uid == -1:
+            logger.error("Cannot get the uid of the package [%s]! Cannot start an analysis!" % package)
+            return False
+        
+        #TODO: test section
+        messages = Queue.Queue()
+        seccon_producer = SecconMessageProducer(dev, messages)
+        seccon_producer.setDaemon(False)
+        seccon_producer.start()
         
         try:
-            time.sleep(2)
-            #The same method can be used for different calls. Thus, we comment this line now )
-            #checkExit(stadynaAnalyser)  
-        except KeyboardInterrupt:
-            logger.debug("Exiting...")  
-            break
-    
-    seccon_producer.stopThread()
-    seccon_producer.join()
+            #sleeping 3sec before starting new activity 
+            time.sleep(3)
+            
+            #Add here the invocation of the main activity
+            startMainActivity(dev, package, mainActivity) 
+            
+            processMessages(messages, uid, dev, sourceFilesDirPath, stadynaAnalyser, analysisTimeout)
+        finally:
+            seccon_producer.stopThread()
+            seccon_producer.join()
+    finally:
+        #in corpus mode the device must not fill up with the analysed apps
+        if uninstall:
+            dev.force_stop_package(package)
+            dev.uninstall_package(package)
     
     endTime = time.time()
     
     stadynaAnalyser.performFinalInfoSave(resultsDirPath, apkFileName, (endTime-startTime))
     logger.info("The analysis is finished!")
+    return True
+
+
+
+def perform_analysis(inputApkPath, resultsDirPath, sourceFilesDirPath, dev=None, analysisTimeout=None, **analyserOptions):    
+    logger.debug("Starting analysis of the application [%s]..." % inputApkPath)
+    startTime = time.time()
+    
+    stadynaAnalyser = perform_static_analysis(inputApkPath, resultsDirPath, sourceFilesDirPath, **analyserOptions)
+    if stadynaAnalyser == None:
+        return False
+    
+    if not stadynaAnalyser.containMethodsToAnalyse():
+        apkFileName, _ = os.path.splitext(os.path.basename(inputApkPath))
+        logger.info("Input apk file does not contain suspicious methods!")
+        stadynaAnalyser.performFinalInfoSave(resultsDirPath, apkFileName, (time.time()-startTime))
+        logger.info("The analysis is finished!")
+        return True
+    
+    return perform_dynamic_analysis(stadynaAnalyser, inputApkPath, resultsDirPath, sourceFilesDirPath, dev, analysisTimeout, time.time()-startTime)
+
+
+
+def getCorpusApkDirs(apkName, resultsDirPath):
+    apkResultsDirPath = os.path.join(resultsDirPath, apkName)
+    apkSourceFilesDirPath = os.path.join(apkResultsDirPath, "source_files/")
+    return apkResultsDirPath, apkSourceFilesDirPath
+
+
+def initStaticAnalysisWorker():
+    #Ctrl+C is handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def staticAnalysisWorker(args):
+    """
+    Runs the static phase for one apk in a pool process. Apps without MOI are
+    finished here: the ones without MOI references (see triageFile) are not
+    analysed at all. For the others the analyser (MOI lists and the graph) is
+    sent back to continue with the dynamic phase.
+    
+    :rtype: (inputApkPath, status, stadynaAnalyser or None, static time)
+    """
+    inputApkPath, apkName, resultsDirPath, analyserOptions = args
+    startTime = time.time()
+    apkResultsDirPath, apkSourceFilesDirPath = getCorpusApkDirs(apkName, resultsDirPath)
+    try:
+        if not checkOutputPath(apkResultsDirPath) or not checkOutputPath(apkSourceFilesDirPath):
+            return (inputApkPath, STATIC_FAILED, None, time.time()-startTime)
+        
+        moi = triageFile(inputApkPath)
+        if moi != None and not any(moi):
+            logger.info("Input apk file [%s] does not reference suspicious methods!" % inputApkPath)
+            if not perform_triaged_analysis(inputApkPath, apkResultsDirPath, apkSourceFilesDirPath, **analyserOptions):
+                return (inputApkPath, STATIC_FAILED, None, time.time()-startTime)
+            return (inputApkPath, STATIC_TRIAGED, None, time.time()-startTime)
+        
+        stadynaAnalyser = perform_static_analysis(inputApkPath, apkResultsDirPath, apkSourceFilesDirPath, **analyserOptions)
+        if stadynaAnalyser == None:
+            return (inputApkPath, STATIC_FAILED, None, time.time()-startTime)
+        
+        if not stadynaAnalyser.containMethodsToAnalyse():
+            apkFileName, _ = os.path.splitext(os.path.basename(inputApkPath))
+            logger.info("Input apk file [%s] does not contain suspicious methods!" % inputApkPath)
+            stadynaAnalyser.performFinalInfoSave(apkResultsDirPath, apkFileName, (time.time()-startTime))
+            return (inputApkPath, STATIC_ONLY, None, time.time()-startTime)
+    except Exception as e:
+        logger.exception(e)
+        logger.error("Static analysis of [%s] has failed!" % inputApkPath)
+        return (inputApkPath, STATIC_FAILED, None, time.time()-startTime)
+    
+    return (inputApkPath, NEEDS_DEVICE, stadynaAnalyser, time.time()-startTime)
+
+
+
+def perform_corpus_analysis(corpusPath, resultsDirPath, analysisTimeout, jobs=None, **analyserOptions):
+    logger.debug("Starting analysis of the corpus [%s]..." % corpusPath)
+    apkPaths = listCorpusApks(corpusPath)
+    if not apkPaths:
+        logger.error("The corpus [%s] does not contain apk files!" % corpusPath)
+        return
+    #apk files with the same name must not share the directory of the results
+    apkNames = getCorpusApkNames(apkPaths)
+    
+    devices = getAttachedDevices()
+    if not devices:
+        logger.warning("No device has been detected! Only static analysis will be performed!")
+    
+    if not jobs:
+        jobs = multiprocessing.cpu_count()
+    
+    #key = apk path; value = (analyser after the static phase, static time)
+    staticResults = {}
+    staticStats = {STATIC_FAILED : 0, STATIC_TRIAGED : 0, STATIC_ONLY : 0, NEEDS_DEVICE : 0}
+    
+    def needDevice(results):
+        for inputApkPath, status, stadynaAnalyser, staticTime in results:
+            staticStats[status] += 1
+            if status == NEEDS_DEVICE:
+                staticResults[inputApkPath] = (stadynaAnalyser, staticTime)
+                yield inputApkPath
+    
+    def analyseApk(dev, inputApkPath):
+        stadynaAnalyser, staticTime = staticResults.pop(inputApkPath)
+        apkResultsDirPath, apkSourceFilesDirPath = getCorpusApkDirs(apkNames[inputApkPath], resultsDirPath)
+        return perform_dynamic_analysis(stadynaAnalyser, inputApkPath, apkResultsDirPath, apkSourceFilesDirPath, dev, analysisTimeout, staticTime,
+                                        uninstall=True)
+    
+    logger.info("Analysing [%d] apk files with [%d] static analysis processes and [%d] devices..." % (len(apkPaths), jobs, len(devices)))
+    startTime = time.time()
+    pool = multiprocessing.Pool(jobs, initStaticAnalysisWorker)
+    scheduler = AnalysisScheduler(devices, analyseApk)
+    try:
+        results = pool.imap_unordered(staticAnalysisWorker, [(p, apkNames[p], resultsDirPath, analyserOptions) for p in apkPaths])
+        if devices:
+            scheduler.run(needDevice(results))
+        else:
+            for _ in needDevice(results):
+                pass
+    except KeyboardInterrupt:
+        scheduler.stop()
+    
+    if scheduler.is_stopped():
+        logger.info("Terminating static analysis processes...")
+        pool.terminate()
+    else:
+        pool.close()
+    pool.join()
+    
+    if staticResults:
+        logger.warning("[%d] apk files require dynamic analysis but have not been analysed on a device!" % len(staticResults))
+    
+    report = ""
+    report += "=============================================\n"
+    report += "Number of APK files in the corpus: \t%d\n" % len(apkPaths)
+    report += "Number of static analysis processes: \t%d\n" % jobs
+    report += "Finished after the triage (no MOI references): \t%d\n" % staticStats[STATIC_TRIAGED]
+    report += "Finished after the static analysis (no MOI): \t%d\n" % staticStats[STATIC_ONLY]
+    report += "Forwarded to the devices: \t%d\n" % staticStats[NEEDS_DEVICE]
+    report += "Failed static analysis: \t%d\n" % staticStats[STATIC_FAILED]
+    report += "Total elapsed time (s): \t%.2f\n" % (time.time() - startTime)
+    report += scheduler.get_report()
+    logger.info("Corpus analysis statistics:\n%s" % report)
+    with open(os.path.join(resultsDirPath, "corpus_log.txt"), 'wb') as log:
+        log.write(report)
     
 
 
@@ -313,18 +524,42 @@ def main(options, arguments):
     resultsDirPath = None
     sourceFilesDirPath = None
     
-    if (options.inputApk == None):
-        logger.error("The path to an input file is not specified! Exiting!")
-        exit(1)
-    else:
-        inputApkPath = options.inputApk
-    
     if (options.outputDir == None):
         logger.error("The path an output directory is not specified! Exiting!")
         exit(1)
     else:
         resultsDirPath = options.outputDir
     
+    #the call graph is built without the debug information and the annotations
+    androconf.set_skip_debug_annotations()
+    if options.lazy:
+        androconf.set_lazy()
+    if options.native:
+        androconf.CONF["ENGINE"] = "automatic"
+    
+    retention = options.retain
+    if retention not in (method_call_graph.RETAIN_NONE, method_call_graph.RETAIN_SUMMARY):
+        if not retention.isdigit() or int(retention) == 0:
+            logger.error("Unknown retention [%s]! Exiting!" % retention)
+            exit(1)
+        retention = int(retention)
+    
+    if (options.corpus != None):
+        if not os.path.exists(options.corpus):
+            logger.error("The corpus path [%s] does not exist! Exiting!" % options.corpus)
+            exit(1)
+        if not checkOutputPath(resultsDirPath):
+            exit(1)
+        perform_corpus_analysis(options.corpus, resultsDirPath, options.timeout, options.jobs, gzipGexf=options.gzip, retention=retention,
+                                cacheDir=options.cache, cacheMaxSize=options.cacheSize * 1024 * 1024)
+        return
+    
+    if (options.inputApk == None):
+        logger.error("The path to an input file is not specified! Exiting!")
+        exit(1)
+    else:
+        inputApkPath = options.inputApk
+    
     if not checkInputFile(inputApkPath):
         exit(1)
     
@@ -342,7 +577,8 @@ def main(options, arguments):
 #     copiedApkPath = os.path.join(sourceFilesDirPath, apkFilename)
     
     #starting the analysis
-    perform_analysis(inputApkPath, resultsDirPath, sourceFilesDirPath)
+    perform_analysis(inputApkPath, resultsDirPath, sourceFilesDirPath, dexJobs=options.jobs, gzipGexf=options.gzip, retention=retention,
+                     cacheDir=options.cache, cacheMaxSize=options.cacheSize * 1024 * 1024)
 
 
 
@@ -15,37 +15,159 @@
  # Author(s): Yury Zhauniarovich
 
 import method_call_graph
-import os, hashlib
+import analysis_cache
+import os, hashlib, gzip, gc, mmap, time
+import multiprocessing
+import utils
 
 from logconfig import logger
-from androguard.core import androconf
+from androguard.core import androconf, bytecode
 from androguard.core.analysis import analysis
 from androguard.core.bytecodes import apk, dvm
 from method_call_graph import PERM_LEVEL_DANGEROUS, PERM_LEVEL_NORMAL,\
     PERM_LEVEL_SIGNATURE, PERM_LEVEL_SIGNATUREORSYSTEM
 
-def getSha256(f, block_size=2**8):
+#key = (path, size, mtime, inode); value = SHA-256 of the file
+_sha256Cache = {}
+
+def _getSha256Key(f):
+    st = os.stat(f)
+    return (os.path.abspath(f), st.st_size, st.st_mtime, st.st_ino)
+
+
+def getSha256(f, block_size=2**20):
     """
     Calculate SHA-256
-    hash of a file
+    hash of a file.
+    The hash is calculated once for a file as long as its path, size,
+    modification time and inode do not change.
     """
+    key = _getSha256Key(f)
+    fileHash = _sha256Cache.get(key)
+    if fileHash != None:
+        return fileHash
     
     sha256 = hashlib.sha256()
-    f = open(f, 'rb')
-    while True:
-        data = f.read(block_size)
-        if not data:
-            break
-        sha256.update(data)
-    return sha256.hexdigest()
+    with open(f, 'rb') as fd:
+        #the whole file is hashed at once from a memory map, empty files cannot be mapped
+        data = None
+        if key[1] > 0:
+            try:
+                data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError):
+                data = None
+        
+        if data != None:
+            try:
+                sha256.update(data)
+            finally:
+                data.close()
+        else:
+            while True:
+                data = fd.read(block_size)
+                if not data:
+                    break
+                sha256.update(data)
+    
+    fileHash = sha256.hexdigest()
+    _sha256Cache[key] = fileHash
+    return fileHash
+
+
+def setSha256(f, fileHash):
+    """
+    Register the known hash of a file (e.g., after it has been renamed).
+    """
+    _sha256Cache[_getSha256Key(f)] = fileHash
   
 
+#Methods of interest as (class name, method name), which are checked by triageFile
+TRIAGE_METHODS = (analysis.SECCON_INVOKE_METHODS, analysis.SECCON_NEWINSTANCE_METHODS, analysis.SECCON_DYNCODE_LOADING_METHODS)
+
+
+def triageFile(file_path):
+    """
+    Checks if a file (apk or dex) may contain methods of interest, looking only
+    at the method references of its dex files. It is much cheaper than
+    makeFileAnalysis and is used to route applications without MOI.
+    
+    :rtype: (has invoke, has newInstance, has dexload) or None if the file cannot be read
+    """
+    try:
+        ret_type = androconf.is_android(file_path)
+        if ret_type == "APK":
+            raws = list(apk.APK(bytecode.mmap_file(file_path), raw=True).get_all_dex())
+        elif ret_type == "DEX" or ret_type == "DEY":
+            raws = [bytecode.mmap_file(file_path)]
+        else:
+            raws = []
+        if not raws or not all(raws):
+            return None
+        
+        classes = set(c for methods in TRIAGE_METHODS for (c, _) in methods)
+        refs = set()
+        for raw in raws:
+            refs.update(dvm.seccon_get_method_refs(raw, classes))
+    except Exception as e:
+        logger.error("Could not read method references of [%s]: %s" % (file_path, e))
+        return None
+    
+    return tuple(any(m in refs for m in methods) for methods in TRIAGE_METHODS)
+
+
+def getMoiPairs(dx):
+    """
+    :rtype: a tuple of three lists (invoke, newInstance, dexload) of the MOI as (src, dst) method triples
+    """
+    cm = dx.get_vm().get_class_manager()
+    return tuple([(path.get_src(cm), path.get_dst(cm)) for path in paths] for paths in analysis.seccon_get_moi_paths(dx))
+
+
+def analyseDexFile(args):
+    """
+    Analyses one dex file of a multidex apk file. It is run in a worker process,
+    thus only picklable results are returned.
+    
+    :rtype: ((invoke, newInstance, dexload) MOI as (src, dst) lists, call graph of the dex file,
+        class names of the dex file, external calls of the dex file as (src, dst) list)
+    """
+    file_path, dex_name, profile = args
+    logger.debug("Performing analysis of [%s] of file [%s]..." % (dex_name, file_path))
+    a = apk.APK(bytecode.mmap_file(file_path), raw=True)
+    d = dvm.DalvikVMFormat(a.get_file(dex_name))
+    dx = analysis.VMAnalysis(d, profile)
+    cm = d.get_class_manager()
+    
+    moiPaths = getMoiPairs(dx)
+    #the entry points are added once all dex files are merged
+    mcg = method_call_graph.StadynaMcgAnalysis()
+    mcg.analyseFile(dx, None)
+    externalCalls = [(path.get_src(cm), path.get_dst(cm)) for path in dx.get_tainted_packages().get_external_packages()]
+    return (moiPaths, mcg, d.get_classes_names_set(), externalCalls)
+
+
 class StadynaAnalyser:
-    def __init__(self):
-        
-        self._stadynaMcg = method_call_graph.StadynaMcgAnalysis()
+    def __init__(self, analysisProfile=analysis.ANALYSIS_PROFILE_CALL_GRAPH, dexJobs=None, gzipGexf=False,
+                 retention=method_call_graph.RETAIN_SUMMARY, cacheDir=None, cacheMaxSize=analysis_cache.DEFAULT_CACHE_MAX_SIZE):
+        
+        #retention: what the graph keeps of the androguard objects of the analysed files
+        self._stadynaMcg = method_call_graph.StadynaMcgAnalysis(retention)
+        #profile of the VMAnalysis made for every file (see makeFileAnalysis)
+        self._analysisProfile = analysisProfile
+        #number of processes parsing the dex files of a multidex apk (None = number of cores)
+        self._dexJobs = dexJobs
+        #the gexf files are saved compressed (.gexf.gz)
+        self._gzipGexf = gzipGexf
+        #persistent cache of the analysis of the files (see makeFileAnalysis)
+        self._cache = None
+        if cacheDir != None:
+            self._cache = analysis_cache.AnalysisCache(cacheDir, cacheMaxSize)
+        #the main file has been triaged as MOI-free and has not been analysed (see makeTriagedAnalysis)
+        self._triaged = False
         #key = path, value = hash
         self._codeFiles = {} 
+        #key = path, value = time (s) spent hashing the file
+        self._hashing_times = {}
         #files loaded several times
         #key = hash; value = loaded_times_num
         self._loaded_files_count = {}
@@ -56,11 +178,18 @@ class StadynaAnalyser:
         self._sources_newInstance = []
         self._sources_dexload = []
         
+        #Indexes over the MOI detected in application sources
+        #key = src; value = the first (src, dst) path with this src
+        self._sources_invoke_by_src = {}
+        self._sources_newInstance_by_src = {}
+        #(src, dst) pairs as they appear in the stack of a dexload call
+        self._sources_dexload_pairs = set()
+        
         #These are MOI that have been not yet covered at least one time
         #src; dst
-        self._uncovered_invoke = []
-        self._uncovered_newInstance = []
-        self._uncovered_dexload = []
+        self._uncovered_invoke = utils.OrderedMultiset()
+        self._uncovered_newInstance = utils.OrderedMultiset()
+        self._uncovered_dexload = utils.OrderedMultiset()
         
         #MOI is not detected in the sources but method is called
         #This is for analysis
@@ -76,6 +205,10 @@ class StadynaAnalyser:
         self._covered_newInstance = []
         #source method; through; loaded file path
         self._covered_dexload = []
+        #the same paths for constant time membership checks
+        self._covered_invoke_set = set()
+        self._covered_newInstance_set = set()
+        self._covered_dexload_set = set()
         
         
         self.initial_num_of_nodes = 0
@@ -89,6 +222,7 @@ class StadynaAnalyser:
         self.initial_num_of_refl_invoke_nodes = 0
         self.initial_num_of_refl_newInstance_nodes = 0
         self.initial_num_of_dexload_nodes = 0
+        self.initial_peak_rss = 0
         
         self.final_num_of_nodes = 0
         self.final_num_of_edges = 0
@@ -101,11 +235,19 @@ class StadynaAnalyser:
         self.final_num_of_refl_invoke_nodes = 0
         self.final_num_of_refl_newInstance_nodes = 0
         self.final_num_of_dexload_nodes = 0
+        self.final_peak_rss = 0
         
 
     
+    def _hashFile(self, f):
+        startTime = time.time()
+        fileHash = getSha256(f)
+        self._hashing_times[f] = self._hashing_times.get(f, 0) + (time.time() - startTime)
+        return fileHash
+    
+    
     def _update_filename(self, f):
-        file_hash = getSha256(f)
+        file_hash = self._hashFile(f)
         file_load_count = self._loaded_files_count.setdefault(file_hash, 1) 
         
         # if a got file is not unique we rename it
@@ -120,7 +262,51 @@ class StadynaAnalyser:
     
     
     
-    def makeFileAnalysis(self, file_path):
+    def makeFileAnalysis(self, file_path, profile=None):
+        """
+        :param profile: the profile of the VMAnalysis (analysis.ANALYSIS_PROFILE_*).
+            If None, the profile given to the constructor is used. StaDynA needs only
+            the call graph, so ANALYSIS_PROFILE_FULL is required only if the
+            VMAnalysis objects are used for something else.
+        """
+        if profile == None:
+            profile = self._analysisProfile
+        
+        peakRssBefore = utils.getPeakRss()
+        if self._cache == None:
+            self._makeFileAnalysis(file_path, profile)
+        else:
+            self._makeCachedFileAnalysis(file_path, profile)
+        #the androguard objects of the file are not referenced anymore (unless the graph retains them),
+        #but they contain reference cycles, which are freed only by the garbage collector
+        gc.collect()
+        logger.info("Peak RSS before and after the analysis of [%s]: %d KB, %d KB" % (file_path, peakRssBefore, utils.getPeakRss()))
+    
+    
+    def _makeCachedFileAnalysis(self, file_path, profile):
+        fileHash = self._codeFiles.get(file_path)
+        if fileHash == None:
+            fileHash = self._hashFile(file_path)
+        
+        entry = self._cache.get(fileHash, profile)
+        if entry != None:
+            logger.debug("The analysis of file [%s] is taken from the cache!" % file_path)
+        else:
+            #the file is analysed alone, so that its MOI and graph can be reused for other applications;
+            #its androguard objects are retained as for the other files (a cached entry has none)
+            fileAnalyser = StadynaAnalyser(profile, self._dexJobs, retention=self._stadynaMcg.retention)
+            #a cached graph is merged with the edges in the order of the analysis, as if it were built in place
+            fileAnalyser._stadynaMcg.recordEdgeOrder()
+            fileAnalyser._makeFileAnalysis(file_path, profile)
+            entry = ((fileAnalyser._sources_invoke, fileAnalyser._sources_newInstance, fileAnalyser._sources_dexload), fileAnalyser._stadynaMcg)
+            self._cache.put(fileHash, profile, entry)
+        
+        moiPaths, mcg = entry
+        self._addMoiPaths(*moiPaths)
+        self._stadynaMcg.merge(mcg)
+    
+    
+    def _makeFileAnalysis(self, file_path, profile):
         logger.debug("Performing analysis of file [%s]..." % file_path)
 
         a = None
@@ -128,64 +314,109 @@ class StadynaAnalyser:
         dx = None
         
         ret_type = androconf.is_android(file_path)
+        #the files are mapped in memory and not read (they can be big)
         if ret_type == "APK":
-            a = apk.APK(file_path)
+            a = apk.APK(bytecode.mmap_file(file_path), raw=True)
+            if a.is_multidex():
+                self._makeMultidexAnalysis(file_path, a, profile)
+                return
             d = dvm.DalvikVMFormat(a.get_dex())
         
         elif ret_type == "DEX" :
             try :
-                d = dvm.DalvikVMFormat(open(file_path, "rb").read())
+                d = dvm.DalvikVMFormat(bytecode.mmap_file(file_path))
             except Exception as e :
                 logger.error("[%s] is not valid dex file!" % file_path, e)
                 return
                 
                 
-        dx = analysis.VMAnalysis(d)
-        
-        invokeMethodPaths = analysis.seccon_get_invoke_method_paths(dx)
-        newInstanceMethodPaths = analysis.seccon_get_newInstance_method_paths(dx)
-        dynamicMethodPaths = analysis.seccon_get_dyncode_loading_paths(dx)
-        
-        if invokeMethodPaths:
-            t = None
-            for path in invokeMethodPaths:
-                src = path.get_src(d.get_class_manager())
-                dst = path.get_dst(d.get_class_manager())
-                t = (src, dst)
-                self._sources_invoke.append(t)
-                self._uncovered_invoke.append(t)
-        
-        if newInstanceMethodPaths:
-            t = None
-            for path in newInstanceMethodPaths:
-                src = path.get_src(d.get_class_manager())
-                dst = path.get_dst(d.get_class_manager())
-                t = (src, dst)
-                self._sources_newInstance.append(t)
-                self._uncovered_newInstance.append(t)
-        
-        if dynamicMethodPaths:
-            t = None
-            for path in dynamicMethodPaths:
-                src = path.get_src(d.get_class_manager())
-                dst = path.get_dst(d.get_class_manager())
-                t = (src, dst)
-                self._sources_dexload.append(t)
-                self._uncovered_dexload.append(t)
+        dx = analysis.VMAnalysis(d, profile)
+        
+        self._addMoiPaths(*getMoiPairs(dx))
         
         #building MFG for the file
         self._stadynaMcg.analyseFile(dx, a)
 #         return file_path    
 
     
-    def makeInitialAnalysis(self, f):
-        fhash = getSha256(f)
+    def _makeMultidexAnalysis(self, file_path, a, profile):
+        dexNames = a.get_dex_names()
+        jobs = self._dexJobs
+        if not jobs:
+            jobs = multiprocessing.cpu_count()
+        jobs = min(jobs, len(dexNames))
+        #daemonic processes (e.g., static analysis workers in corpus mode) cannot have children
+        if multiprocessing.current_process().daemon:
+            jobs = 1
+        
+        logger.debug("Analysing [%d] dex files of [%s] with [%d] processes..." % (len(dexNames), file_path, jobs))
+        args = [(file_path, dexName, profile) for dexName in dexNames]
+        if jobs > 1:
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = pool.map(analyseDexFile, args)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            results = map(analyseDexFile, args)
+        
+        #the class names of all dex files are the global index of the internal methods
+        classes = set()
+        for moiPaths, mcg, dexClasses, _ in results:
+            self._addMoiPaths(*moiPaths)
+            self._stadynaMcg.merge(mcg)
+            classes.update(dexClasses)
+        
+        for _, _, _, externalCalls in results:
+            self._stadynaMcg.addCrossDexCalls(externalCalls, classes)
+        self._stadynaMcg.addEntryPoints(a)
+    
+    
+    def _addMoiPaths(self, invokePaths, newInstancePaths, dexloadPaths):
+        for t in invokePaths:
+            src, _ = t
+            self._sources_invoke.append(t)
+            self._sources_invoke_by_src.setdefault(src, t)
+            self._uncovered_invoke.add(t)
+        
+        for t in newInstancePaths:
+            src, _ = t
+            self._sources_newInstance.append(t)
+            self._sources_newInstance_by_src.setdefault(src, t)
+            self._uncovered_newInstance.add(t)
+        
+        for t in dexloadPaths:
+            self._sources_dexload.append(t)
+            self._sources_dexload_pairs.add(t)
+            self._uncovered_dexload.add(t)
+    
+    
+    def _addMainFile(self, f):
+        fhash = self._hashFile(f)
         new_path = self._rename_source_file(f, fhash, 'main')
         self._loaded_files_count[fhash] = 1
         self._codeFiles[new_path] = fhash
-        
+        return new_path
+    
+    
+    def makeInitialAnalysis(self, f):
+        new_path = self._addMainFile(f)
         self.makeFileAnalysis(new_path)
-        
+        self._calculateInitialNumbers()
+    
+    
+    def makeTriagedAnalysis(self, f):
+        """
+        Registers the main file triaged as MOI-free (see triageFile). The file is
+        not analysed, so the graph stays empty and only the report is saved.
+        """
+        self._addMainFile(f)
+        self._triaged = True
+        self._calculateInitialNumbers()
+    
+    
+    def _calculateInitialNumbers(self):
         self.initial_num_of_nodes = self._stadynaMcg.get_current_node_count()
         self.initial_num_of_edges = self._stadynaMcg.get_current_edge_count()
         self.initial_num_of_real_nodes = self._stadynaMcg.get_current_real_node_count()
@@ -199,6 +430,7 @@ class StadynaAnalyser:
         self.initial_num_of_refl_invoke_nodes = len(self._sources_invoke)
         self.initial_num_of_refl_newInstance_nodes = len(self._sources_newInstance)
         self.initial_num_of_dexload_nodes = len(self._sources_dexload)
+        self.initial_peak_rss = utils.getPeakRss()
         
         #TODO: add initial statistics
 #         self._initial_num_of_real_nodes = self._stadynaMcg.get_current_real_node_count()
@@ -210,6 +442,7 @@ class StadynaAnalyser:
         head, extention = os.path.splitext(f)
         new_filepath = "%s_%s-%s%s" % (head, fhash, count_str, extention)
         os.rename(f, new_filepath)
+        setSha256(new_filepath, fhash)
         return new_filepath 
     
 
@@ -227,7 +460,7 @@ class StadynaAnalyser:
     def processDexLoad(self, fileName, source, output, stack):
         logger.debug("Processing dex load message...")
          
-        file_hash = getSha256(fileName)
+        file_hash = self._hashFile(fileName)
         file_load_count = self._loaded_files_count.setdefault(file_hash, 0) + 1
         newFilePath = self._rename_source_file(fileName, file_hash, str(file_load_count))
          
@@ -239,8 +472,7 @@ class StadynaAnalyser:
         if dexloadPathFromStack:
             srcFromStack = dexloadPathFromStack[0]
             throughMethod = dexloadPathFromStack[1]
-            if dexloadPathFromStack in self._uncovered_dexload:
-                self._uncovered_dexload.remove(dexloadPathFromStack)
+            self._uncovered_dexload.discard(dexloadPathFromStack)
              
             self._addDexloadPathToMCG(srcFromStack, throughMethod, newFilePath) 
             #we do analyse files if appropriate dex load calls have found in sources of application
@@ -276,17 +508,10 @@ class StadynaAnalyser:
         #because it is possible that there are several dexload entries
         #in the stack. Thus, we look for the most recent one.
         for stackEntryPos in xrange(1, len(stack)):
-            stackEntry = stack[stackEntryPos]
-            for dexloadPathFromSources in self._sources_dexload:
-                dexloadSrcFromSources = dexloadPathFromSources[0]
-                dexloadDstFromSources = dexloadPathFromSources[1]
-                if stackEntry != dexloadSrcFromSources:
-                    continue
-                 
-                prevStackEntry = stack[stackEntryPos - 1]
-                if prevStackEntry == dexloadDstFromSources:
-                    logger.debug("The method, which calls dexload, is found [%s%s%s]!" % dexloadSrcFromSources)
-                    return dexloadPathFromSources
+            dexloadPathFromStack = (stack[stackEntryPos], stack[stackEntryPos - 1])
+            if dexloadPathFromStack in self._sources_dexload_pairs:
+                logger.debug("The method, which calls dexload, is found [%s%s%s]!" % dexloadPathFromStack[0])
+                return dexloadPathFromStack
                              
         logger.debug("The called dexload method was not detected in sources!")            
         return None
@@ -296,7 +521,8 @@ class StadynaAnalyser:
     def _addDexloadPathToMCG(self, src, through, filename):
         logger.debug("Adding dexload method path to our graph...")
         tupl = (src, through, filename) 
-        if tupl not in self._covered_dexload:
+        if tupl not in self._covered_dexload_set:
+            self._covered_dexload_set.add(tupl)
             self._covered_dexload.append(tupl)
             self._stadynaMcg.addDexloadPath(src, through, filename)
             logger.info("The path [%s] -- [%s] through [%s] for dexload is added to our graph!" % (str(src), str(filename), str(through)))
@@ -324,15 +550,10 @@ class StadynaAnalyser:
             return
         
 
-        for invokePathFromSources in self._sources_invoke:
-            invokeSrcFromSources = invokePathFromSources[0]
-            if invokeSrcFromSources != invokeSrcFromStack:
-                continue
-            
-            self._addInvokePathToMCG(invokeSrcFromSources, throughMethod, invokeDstFromClient)
-            
-            if invokePathFromSources in self._uncovered_invoke:
-                self._uncovered_invoke.remove(invokePathFromSources)
+        invokePathFromSources = self._sources_invoke_by_src.get(invokeSrcFromStack)
+        if invokePathFromSources:
+            self._addInvokePathToMCG(invokePathFromSources[0], throughMethod, invokeDstFromClient)
+            self._uncovered_invoke.discard(invokePathFromSources)
             return
         
         self._addSuspiciousInvoke(throughMethod, invokeDstFromClient, stack)
@@ -361,7 +582,8 @@ class StadynaAnalyser:
     def _addInvokePathToMCG(self, src, through, dst):
         logger.debug("Adding invoke method path to our graph...")
         tupl = (src, through, dst)
-        if tupl not in self._covered_invoke:
+        if tupl not in self._covered_invoke_set:
+            self._covered_invoke_set.add(tupl)
             self._covered_invoke.append(tupl)
             self._stadynaMcg.addInvokePath(src, through, dst)
             logger.debug("The path [%s] -- [%s] through [%s] for invoke method is added to our graph!" % (str(src), str(dst), str(through)))
@@ -385,15 +607,10 @@ class StadynaAnalyser:
             self._addSuspiciousNewInstance(throughMethod, newInstanceDstFromClient, stack)
             return
         
-        for newInstancePathFromSources in self._sources_newInstance:
-            newInstanceSrcFromSources = newInstancePathFromSources[0]
-            if newInstanceSrcFromSources != newInstanceSrcFromStack:
-                continue
-            
-            self._addNewInstancePathToMCG(newInstanceSrcFromSources, throughMethod, newInstanceDstFromClient)
-            
-            if newInstancePathFromSources in self._uncovered_newInstance:
-                self._uncovered_newInstance.remove(newInstancePathFromSources)
+        newInstancePathFromSources = self._sources_newInstance_by_src.get(newInstanceSrcFromStack)
+        if newInstancePathFromSources:
+            self._addNewInstancePathToMCG(newInstancePathFromSources[0], throughMethod, newInstanceDstFromClient)
+            self._uncovered_newInstance.discard(newInstancePathFromSources)
             return
         
         self._addSuspiciousNewInstance(throughMethod, newInstanceDstFromClient, stack)
@@ -421,7 +638,8 @@ class StadynaAnalyser:
     def _addNewInstancePathToMCG(self, src, through, dst):
         logger.debug("Adding newInstance method path to our graph...")
         tupl = (src, through, dst)
-        if tupl not in self._covered_newInstance:
+        if tupl not in self._covered_newInstance_set:
+            self._covered_newInstance_set.add(tupl)
             self._covered_newInstance.append(tupl)
             self._stadynaMcg.addNewInstancePath(src, through, dst)
             logger.info("The path [%s] -- [%s] through [%s] for newInstance method is added to our graph!" % (str(src), str(dst), str(through)))
@@ -479,6 +697,7 @@ class StadynaAnalyser:
         self.final_num_of_refl_invoke_nodes = len(self._sources_invoke)
         self.final_num_of_refl_newInstance_nodes = len(self._sources_newInstance)
         self.final_num_of_dexload_nodes = len(self._sources_dexload)
+        self.final_peak_rss = utils.getPeakRss()
     
     
 
@@ -500,10 +719,15 @@ class StadynaAnalyser:
         logger.debug("Final results are saved!")
     
     def saveGexf(self, where, resultsFileName):
-        gexfFileName = '%s%s' % (resultsFileName, '.gexf')
-        gexfSavePath = os.path.join(where, gexfFileName)
-        b = self._stadynaMcg.export_to_gexf()
-        androconf.save_to_disk(b, gexfSavePath)
+        #the graph is streamed to the file, it can be too big to be built in memory
+        if self._gzipGexf:
+            gexfFileName = '%s%s' % (resultsFileName, '.gexf.gz')
+            fd = gzip.open(os.path.join(where, gexfFileName), 'wb')
+        else:
+            gexfFileName = '%s%s' % (resultsFileName, '.gexf')
+            fd = open(os.path.join(where, gexfFileName), 'w')
+        with fd:
+            self._stadynaMcg.write_gexf(fd)
     
     
     def _save_log_file(self, logSavePath, executionTime):
@@ -526,6 +750,11 @@ class StadynaAnalyser:
         
         buff = ""
         
+        if self._triaged:
+            buff += "=============================================\n"
+            buff += "The file does not reference methods of interest (triage)! The call graph has not been built!\n"
+            buff += "=============================================\n\n"
+        
         buff += "=============================================\n"
         buff += "Initial number of nodes in the graph: \t%d\n" % self.initial_num_of_nodes
         buff += "Initial number of real nodes in the graph: \t%d\n" % self.initial_num_of_real_nodes
@@ -538,6 +767,7 @@ class StadynaAnalyser:
         buff += "Initial number of reflection invoke nodes: \t%d\n" % self.initial_num_of_refl_invoke_nodes
         buff += "Initial number of reflection new instance nodes: \t%d\n" % self.initial_num_of_refl_newInstance_nodes
         buff += "Initial number of dexload nodes: \t%d\n" % self.initial_num_of_dexload_nodes
+        buff += "Peak RSS after the initial analysis (KB): \t%d\n" % self.initial_peak_rss
         buff += "\n"
         buff += "Final number of nodes in the graph: \t%d\n" % self.final_num_of_nodes
         buff += "Final number of real nodes in the graph: \t%d\n" % self.final_num_of_real_nodes
@@ -550,6 +780,7 @@ class StadynaAnalyser:
         buff += "Final number of reflection invoke nodes: \t%d\n" % self.final_num_of_refl_invoke_nodes
         buff += "Final number of reflection new instance nodes: \t%d\n" % self.final_num_of_refl_newInstance_nodes
         buff += "Final number of dexload nodes: \t%d\n" % self.final_num_of_dexload_nodes
+        buff += "Peak RSS at the end of the analysis (KB): \t%d\n" % self.final_peak_rss
         buff += "=============================================\n\n"
         
         buff += "=============================================\n"
@@ -585,6 +816,16 @@ class StadynaAnalyser:
         buff += "Number of suspicious dexload methods: \t%d\n" % suspiciousDexloadNum
         buff += "=============================================\n\n"
         
+        if self._cache != None:
+            buff += self._cache.get_report()
+            buff += "\n"
+        
+        buff += "=============================================\n"
+        buff += "Total time of file hashing (s): \t%.3f\n" % sum(self._hashing_times.values())
+        for path in sorted(self._hashing_times):
+            buff += "Hashing time of [%s] (s): \t%.3f\n" % (os.path.basename(path), self._hashing_times[path])
+        buff += "=============================================\n\n"
+        
         
         buff += "\n\n"    
         buff += "%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%\n"
@@ -633,9 +874,9 @@ class StadynaAnalyser:
             buff += "=============================================\n"
             buff += "UNCOVERED REFLECTION INVOKE PATHS:\n"
             buff += "*********************************************\n"
-            for i in xrange(0, numOfUncoveredInvMethods):
-                buff += "SRC MOI: \t%s\n" % str(self._uncovered_invoke[i][0])
-                buff += "REFL CALL: \t%s\n" % str(self._uncovered_invoke[i][1])
+            for (src, dst) in self._uncovered_invoke:
+                buff += "SRC MOI: \t%s\n" % str(src)
+                buff += "REFL CALL: \t%s\n" % str(dst)
                 buff += "\n"
             buff += "=============================================\n\n"
               
@@ -643,9 +884,9 @@ class StadynaAnalyser:
             buff += "=============================================\n"
             buff += "UNCOVERED REFLECTION INVOKE PATHS:\n"
             buff += "*********************************************\n"
-            for i in xrange(0, numOfUncoveredNewInstanceMethods):
-                buff += "SRC MOI: \t%s\n" % str(self._uncovered_newInstance[i][0])
-                buff += "REFL CALL: \t%s\n" % str(self._uncovered_newInstance[i][1])
+            for (src, dst) in self._uncovered_newInstance:
+                buff += "SRC MOI: \t%s\n" % str(src)
+                buff += "REFL CALL: \t%s\n" % str(dst)
                 buff += "\n"
             buff += "=============================================\n\n"
               
@@ -653,9 +894,9 @@ class StadynaAnalyser:
             buff += "=============================================\n"
             buff += "UNCOVERED DEXLOAD PATHS:\n"
             buff += "*********************************************\n"
-            for i in xrange(0, numOfUncoveredDexloadMethods):
-                buff += "SRC MOI: \t%s\n" % str(self._uncovered_dexload[i][0])
-                buff += "DEXLOAD CALL: \t%s\n" % str(self._uncovered_dexload[i][1])
+            for (src, dst) in self._uncovered_dexload:
+                buff += "SRC MOI: \t%s\n" % str(src)
+                buff += "DEXLOAD CALL: \t%s\n" % str(dst)
                 buff += "\n"
             buff += "=============================================\n\n"
           
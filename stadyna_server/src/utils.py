@@ -14,6 +14,8 @@
  #
  # Author(s): Yury Zhauniarovich
  
+import collections
+import resource
 from logconfig import logger
 
 def clsToDalvikCls(className):
@@ -36,7 +38,53 @@ def transformStack(stack):
     logger.debug("Stack transformed successfully!")
     return transformedStack
 
+def getPeakRss():
+    """
+    Peak resident set size of the current process in KB (the maximum since its start)
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
 def convertPathToSeccon((cls, method, proto)):
     protoNew = proto.replace(" ", "")
     return (cls, method, protoNew)
-    
\ No newline at end of file
+    
+
+class OrderedMultiset:
+    '''
+    Ordered collection with constant time membership test, insertion and
+    removal. Duplicates are counted, so the length and the iteration match
+    the list it replaces (the first insertion defines the order).
+    '''
+    
+    def __init__(self, iterable=()):
+        self._counts = collections.OrderedDict()
+        self._len = 0
+        for elem in iterable:
+            self.add(elem)
+    
+    def add(self, elem):
+        self._counts[elem] = self._counts.get(elem, 0) + 1
+        self._len += 1
+    
+    def remove(self, elem):
+        count = self._counts[elem]
+        if count == 1:
+            del self._counts[elem]
+        else:
+            self._counts[elem] = count - 1
+        self._len -= 1
+    
+    def discard(self, elem):
+        if elem in self._counts:
+            self.remove(elem)
+    
+    def __contains__(self, elem):
+        return elem in self._counts
+    
+    def __len__(self):
+        return self._len
+    
+    def __iter__(self):
+        for elem, count in self._counts.iteritems():
+            for _ in xrange(count):
+                yield elem
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+ # Copyright (C) 2013-2015 StaDynA
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License");
+ # you may not use this file except in compliance with the License.
+ # You may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ # See the License for the specific language governing permissions and
+ # limitations under the License.
+
+"""
+Tests of analysis_cache.AnalysisCache in a temporary directory and of the merge
+of the call graphs taken from it. Usage:
+
+    python test_analysis_cache.py
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import analysis_cache
+from analysis_cache import AnalysisCache
+
+#the call graph needs the permission mappings of androguard
+try:
+    import method_call_graph
+except ImportError:
+    method_call_graph = None
+
+FILE_HASH = "ab" * 32
+PROFILE = 1
+
+
+def getEntries(cacheDir):
+    return sorted(f for _, _, files in os.walk(cacheDir) for f in files)
+
+
+def getIncompressibleEntry(size):
+    return (os.urandom(size),)
+
+
+class AnalysisCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def test_miss_put_hit(self):
+        cache = AnalysisCache(self.cacheDir)
+        self.assertEqual(cache.get(FILE_HASH, PROFILE), None)
+        cache.put(FILE_HASH, PROFILE, ("moi", [1, 2, 3]))
+        self.assertEqual(cache.get(FILE_HASH, PROFILE), ("moi", [1, 2, 3]))
+
+        self.assertEqual((cache.hits, cache.misses, cache.stores, cache.errors), (1, 1, 1, 0))
+        report = cache.get_report()
+        self.assertTrue("Analysis cache hits: \t1\n" in report)
+        self.assertTrue("Analysis cache misses: \t1\n" in report)
+
+    def test_key(self):
+        cache = AnalysisCache(self.cacheDir)
+        cache.put(FILE_HASH, PROFILE, ("moi",))
+        self.assertEqual(cache.get(FILE_HASH, PROFILE + 1), None)
+        self.assertEqual(cache.get("cd" * 32, PROFILE), None)
+
+        version = analysis_cache.CACHE_VERSION
+        analysis_cache.CACHE_VERSION = version + 1
+        try:
+            self.assertEqual(cache.get(FILE_HASH, PROFILE), None)
+        finally:
+            analysis_cache.CACHE_VERSION = version
+        self.assertEqual(cache.get(FILE_HASH, PROFILE), ("moi",))
+
+    def test_corrupted_entry(self):
+        cache = AnalysisCache(self.cacheDir)
+        cache.put(FILE_HASH, PROFILE, ("moi",))
+        with open(cache._getEntryPath(FILE_HASH, PROFILE), 'wb') as f:
+            f.write("not a compressed pickle")
+
+        self.assertEqual(cache.get(FILE_HASH, PROFILE), None)
+        self.assertEqual((cache.hits, cache.misses, cache.errors), (0, 1, 1))
+        self.assertEqual(getEntries(self.cacheDir), [])
+
+    def test_eviction(self):
+        #two entries fit into the cache, the third one evicts the least recently used
+        cache = AnalysisCache(self.cacheDir, 2500)
+        hashes = ["%02x" % i * 32 for i in xrange(3)]
+        cache.put(hashes[0], PROFILE, getIncompressibleEntry(1000))
+        cache.put(hashes[1], PROFILE, getIncompressibleEntry(1000))
+        os.utime(cache._getEntryPath(hashes[0], PROFILE), (1000, 1000))
+        os.utime(cache._getEntryPath(hashes[1], PROFILE), (2000, 2000))
+        #the hit makes the first entry the most recently used one
+        self.assertNotEqual(cache.get(hashes[0], PROFILE), None)
+        cache.put(hashes[2], PROFILE, getIncompressibleEntry(1000))
+
+        self.assertEqual(cache.evictions, 1)
+        self.assertNotEqual(cache.get(hashes[0], PROFILE), None)
+        self.assertEqual(cache.get(hashes[1], PROFILE), None)
+        self.assertNotEqual(cache.get(hashes[2], PROFILE), None)
+        self.assertTrue(cache._scan()[1] <= 2500)
+
+    def test_oversized_entry(self):
+        cache = AnalysisCache(self.cacheDir, 100)
+        cache.put(FILE_HASH, PROFILE, getIncompressibleEntry(1000))
+        self.assertEqual(cache.stores, 0)
+        self.assertEqual(getEntries(self.cacheDir), [])
+
+    def test_rename_failure(self):
+        def rename(src, dst):
+            raise OSError(28, "No space left on device")
+
+        cache = AnalysisCache(self.cacheDir)
+        originalRename = os.rename
+        os.rename = rename
+        try:
+            cache.put(FILE_HASH, PROFILE, ("moi",))
+        finally:
+            os.rename = originalRename
+
+        self.assertEqual((cache.stores, cache.errors), (0, 1))
+        #neither the entry nor the temporary file is left
+        self.assertEqual(getEntries(self.cacheDir), [])
+
+
+def getMethod(i):
+    return ("Lcom/test/C%d;" % (i / 10), "m%d" % (i % 10), "()V")
+
+
+def buildGraph(mcg, methods=300):
+    """a graph with many successors per node, whose order depends on the insertion order"""
+    for i in xrange(methods):
+        mcg.G.add_node(mcg._get_method_node(getMethod(i)).id)
+    for i in xrange(methods):
+        n1 = mcg._get_existed_node(getMethod(i))
+        for step in (1, 7, 31, 97, 211):
+            n2 = mcg._get_existed_node(getMethod((i * step + 13) % methods))
+            mcg._add_edge(n1.id, n2.id)
+    mcg.addInvokePath(getMethod(0), ("Ljava/lang/reflect/Method;", "invoke", "()V"), getMethod(1))
+    mcg.addDexloadPath(getMethod(2), ("Ldalvik/system/DexClassLoader;", "<init>", "()V"), "plugin.dex")
+    moiPaths = ([(getMethod(0), ("Ljava/lang/reflect/Method;", "invoke", "()V"))], [],
+                [(getMethod(2), ("Ldalvik/system/DexClassLoader;", "<init>", "()V"))])
+    return moiPaths
+
+
+@unittest.skipIf(method_call_graph == None, "the permission mappings of androguard are not available")
+class CachedGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.cacheDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cacheDir)
+
+    def test_merged_fragment(self):
+        uncached = method_call_graph.StadynaMcgAnalysis()
+        uncachedMoiPaths = buildGraph(uncached)
+
+        #as in StadynaAnalyser._makeCachedFileAnalysis
+        fragment = method_call_graph.StadynaMcgAnalysis()
+        fragment.recordEdgeOrder()
+        cache = AnalysisCache(self.cacheDir)
+        cache.put(FILE_HASH, PROFILE, (buildGraph(fragment), fragment))
+        moiPaths, cachedFragment = cache.get(FILE_HASH, PROFILE)
+
+        for mcg in (fragment, cachedFragment):
+            merged = method_call_graph.StadynaMcgAnalysis()
+            merged.merge(mcg)
+            self.assertEqual(moiPaths, uncachedMoiPaths)
+            self.assertEqual(sorted(merged.nodes), sorted(uncached.nodes))
+            self.assertEqual(merged.get_current_edge_count(), uncached.get_current_edge_count())
+            self.assertEqual(sorted(merged.G.edges()), sorted(uncached.G.edges()))
+            #the same document, edge ids included
+            self.assertEqual(merged.export_to_gexf(), uncached.export_to_gexf())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+ # Copyright (C) 2013-2015 StaDynA
+ #
+ # Licensed under the Apache License, Version 2.0 (the "License");
+ # you may not use this file except in compliance with the License.
+ # You may obtain a copy of the License at
+ #
+ #      http://www.apache.org/licenses/LICENSE-2.0
+ #
+ # Unless required by applicable law or agreed to in writing, software
+ # distributed under the License is distributed on an "AS IS" BASIS,
+ # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ # See the License for the specific language governing permissions and
+ # limitations under the License.
+
+"""
+Tests of scheduler.AnalysisScheduler with fake devices and a fake analysis.
+Usage:
+
+    python test_scheduler.py
+"""
+
+import os
+import sys
+import time
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from scheduler import AnalysisScheduler, getCorpusApkNames
+
+
+class FakeDevice:
+    def __init__(self, name, alive_checks=None):
+        self.device_name = name
+        #number of the successful liveness checks, None - always alive
+        self._alive_checks = alive_checks
+
+    def is_alive(self):
+        if self._alive_checks == None:
+            return True
+        self._alive_checks -= 1
+        return self._alive_checks >= 0
+
+
+class FakeAnalysis:
+    def __init__(self, failing=(), duration=0.01):
+        self._failing = set(failing)
+        self._duration = duration
+        self._lock = threading.Lock()
+        #key = apk path; value = names of the devices which analysed it
+        self.analysed = {}
+
+    def __call__(self, device, apkPath):
+        time.sleep(self._duration)
+        with self._lock:
+            self.analysed.setdefault(apkPath, []).append(device.device_name)
+        if apkPath in self._failing:
+            raise RuntimeError("analysis of [%s] has failed" % apkPath)
+        return True
+
+
+def getApks(number):
+    return ["/corpus/app%d.apk" % i for i in xrange(number)]
+
+
+class AnalysisSchedulerTest(unittest.TestCase):
+    def test_distribution(self):
+        devices = [FakeDevice("emulator-5554"), FakeDevice("emulator-5556"), FakeDevice("emulator-5558")]
+        analysis = FakeAnalysis()
+        apks = getApks(30)
+        stats = AnalysisScheduler(devices, analysis).run(apks)
+
+        self.assertEqual(sorted(analysis.analysed.keys()), sorted(apks))
+        self.assertTrue(all(len(names) == 1 for names in analysis.analysed.values()))
+        self.assertEqual(sum(s.analysed for s in stats), len(apks))
+        #every device gets a share of the corpus
+        self.assertTrue(all(s.analysed > 0 for s in stats))
+
+    def test_dead_device(self):
+        #the second device dies before its first apk
+        devices = [FakeDevice("alive"), FakeDevice("dead", 0)]
+        analysis = FakeAnalysis(duration=0.05)
+        apks = getApks(5)
+        stats = AnalysisScheduler(devices, analysis).run(apks)
+
+        self.assertEqual(sorted(analysis.analysed.keys()), sorted(apks))
+        self.assertTrue(all(names == ["alive"] for names in analysis.analysed.values()))
+        statsByName = dict((s.device_name, s) for s in stats)
+        self.assertEqual(statsByName["alive"].analysed, len(apks))
+        self.assertEqual(statsByName["dead"].get_processed(), 0)
+
+    def test_no_more_apks(self):
+        #a lazy input: the workers wait for the apks and stop when it is exhausted
+        def apksLater():
+            for apkPath in getApks(3):
+                time.sleep(0.05)
+                yield apkPath
+
+        devices = [FakeDevice("emulator-5554"), FakeDevice("emulator-5556")]
+        analysis = FakeAnalysis()
+        sched = AnalysisScheduler(devices, analysis)
+        stats = sched.run(apksLater())
+
+        self.assertEqual(len(analysis.analysed), 3)
+        self.assertEqual(sum(s.get_processed() for s in stats), 3)
+        self.assertFalse(any(worker.is_alive() for worker in sched._workers))
+
+    def test_empty_corpus(self):
+        stats = AnalysisScheduler([FakeDevice("emulator-5554")], FakeAnalysis()).run([])
+        self.assertEqual(stats[0].get_processed(), 0)
+
+    def test_stats_and_report(self):
+        apks = getApks(4)
+        sched = AnalysisScheduler([FakeDevice("emulator-5554")], FakeAnalysis(failing=apks[:1]))
+        stats = sched.run(apks)
+
+        self.assertEqual(stats[0].analysed, 3)
+        self.assertEqual(stats[0].failed, 1)
+        self.assertTrue(stats[0].busy_time > 0)
+        report = sched.get_report()
+        self.assertTrue("Number of APK files scheduled for devices: \t4\n" in report)
+        self.assertTrue("Device [emulator-5554]:\n" in report)
+        self.assertTrue("Total analysed: \t3\n" in report)
+        self.assertTrue("Total failed: \t1\n" in report)
+
+
+class CorpusApkNamesTest(unittest.TestCase):
+    def test_same_file_names(self):
+        names = getCorpusApkNames(["/corpus/a/sample.apk", "/corpus/b/sample.apk", "/corpus/sample_2.apk", "/corpus/c.apk"])
+        self.assertEqual(names["/corpus/a/sample.apk"], "sample")
+        self.assertEqual(names["/corpus/c.apk"], "c")
+        self.assertEqual(len(set(names.values())), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()